@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Bitrate, GOP and timing statistics
+
+   The statistics are computed from the columns of a SampleTable, from the stbl of a progressive file or the
+   truns of a fragmented one, with prefix sums and bisection over the arrays rather than a loop per sample
+   in Python. Times are in seconds and bitrates in bits per second.
+"""
+import logging
+from array import array
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from itertools import accumulate, repeat
+from operator import add, ne, sub
+
+from pymp4 import writer
+from pymp4.samples import U32, U64, read_source
+
+log = logging.getLogger(__name__)
+
+Bitrate = namedtuple("Bitrate", "average peak window windows")
+GOPs = namedtuple("GOPs", "lengths distribution keyframe_intervals")
+Timing = namedtuple("Timing", "duration sample_rate sample_duration irregular min_duration max_duration "
+                              "discontinuities")
+TrackStats = namedtuple("TrackStats", "track_ID handler_type sample_count bitrate gops timing")
+Drift = namedtuple("Drift", "video_track_ID audio_track_ID start end")
+Analysis = namedtuple("Analysis", "tracks drift")
+
+
+def _prefix(values):
+    # prefix[i] is the sum of values[:i]
+    prefix = array(U64, [0])
+    prefix.extend(accumulate(values))
+    return prefix
+
+
+def _seconds(table, ticks):
+    return ticks / float(table.timescale) if table.timescale else 0.0
+
+
+def bitrate(table, window=1.0):
+    """
+    Average bitrate, peak bitrate over any window seconds starting at a sample, and the bitrate of each
+    consecutive window from the first sample, by decode time
+    """
+    duration = _seconds(table, table.duration - (table.dts[0] if len(table) else 0))
+    prefix = _prefix(table.sizes)
+    average = 8 * prefix[-1] / duration if duration else 0.0
+    span = max(int(round(window * table.timescale)), 1)
+    if not len(table):
+        return Bitrate(average, 0.0, window, array("d"))
+    dts = table.dts
+
+    # bytes of the samples decoded in [dts[i], dts[i] + span) for every sample i
+    ends = map(bisect_left, repeat(dts), map(span.__add__, dts))
+    peak = max(map(sub, map(prefix.__getitem__, ends), prefix[:len(table)]))
+
+    count = -(-(table.duration - dts[0]) // span)
+    bounds = list(map(bisect_left, repeat(dts), range(dts[0], dts[0] + (count + 1) * span, span)))
+    sizes = map(sub, map(prefix.__getitem__, bounds[1:]), map(prefix.__getitem__, bounds[:-1]))
+    return Bitrate(average, 8 * peak / window, window, array("d", map((8.0 / window).__mul__, sizes)))
+
+
+def gops(table):
+    """
+    Number of samples from each sync sample to the next, how many GOPs there are of each length and the time
+    between consecutive sync samples
+    """
+    keyframes = array(U32, table.sync_samples())
+    if not keyframes:
+        return GOPs(array(U32), {}, array("d"))
+    lengths = array(U32, map(sub, keyframes[1:], keyframes[:-1]))
+    lengths.append(len(table) - keyframes[-1])
+    times = array(U64, map(table.dts.__getitem__, keyframes))
+    scale = 1.0 / table.timescale if table.timescale else 0.0
+    intervals = array("d", map(scale.__mul__, map(sub, times[1:], times[:-1])))
+    return GOPs(lengths, dict(sorted(Counter(lengths).items())), intervals)
+
+
+def timing(table):
+    """
+    Duration and the most common sample duration, with the number of samples that have a different one and
+    the number of times the decode time does not carry on from the previous sample
+    """
+    if not len(table):
+        return Timing(0.0, 0.0, 0, 0, 0, 0, 0)
+    counts = Counter(table.durations)
+    sample_duration, regular = counts.most_common(1)[0]
+    sample_rate = table.timescale / float(sample_duration) if sample_duration else 0.0
+    dts = table.dts
+    expected = map(add, dts[:-1], table.durations[:-1])
+    discontinuities = sum(map(ne, dts[1:], expected))
+    return Timing(_seconds(table, table.duration - dts[0]), sample_rate, sample_duration, len(table) - regular,
+                  min(counts), max(counts), discontinuities)
+
+
+def track_stats(table, window=1.0):
+    return TrackStats(table.track_ID, table.handler_type, len(table), bitrate(table, window), gops(table),
+                      timing(table))
+
+
+def drift(video, audio):
+    """
+    How far the audio starts and ends after the video, by presentation time
+    """
+    def start(table):
+        return _seconds(table, min(table.pts)) if len(table) else 0.0
+
+    def end(table):
+        return _seconds(table, max(map(add, table.pts, table.durations))) if len(table) else 0.0
+
+    return Drift(video.track_ID, audio.track_ID, start(audio) - start(video), end(audio) - end(video))
+
+
+def analyze(source, window=1.0):
+    """
+    Statistics of every track of a progressive or fragmented file, and the drift between its first video and
+    first audio track (None unless it has both)
+    """
+    with writer.opened(source, "rb") as fd:
+        _, _, tables = read_source(fd)
+    video = next((table for table in tables if table.handler_type == b"vide"), None)
+    audio = next((table for table in tables if table.handler_type == b"soun"), None)
+    return Analysis([track_stats(table, window) for table in tables],
+                    drift(video, audio) if video is not None and audio is not None else None)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Parsing and building many buffers on a thread pool
+
+   Parsing is thread safe as long as every call has its own stream: parse(data) creates a new stream and a
+   new context for each call, the box definitions are never modified while parsing or building and the box
+   hooks are per thread. Sharing one file object between threads is not safe, the stream position is part
+   of the parse state.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from pymp4.parser import MP4
+
+log = logging.getLogger(__name__)
+
+
+def _capture(func):
+    def call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            return e
+    return call
+
+
+def map_many(func, items, max_workers=None, executor=None, return_exceptions=False):
+    """
+    Run func on every item on a thread pool, yielding the results in the order of items
+
+    :param executor: an existing executor to use, by default a ThreadPoolExecutor is created for the call
+    :param return_exceptions: yield the exception raised for an item in place of its result instead of
+                              raising it
+    """
+    if return_exceptions:
+        func = _capture(func)
+    if executor is not None:
+        for result in executor.map(func, items):
+            yield result
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for result in pool.map(func, items):
+            yield result
+
+
+def parse_many(buffers, con=MP4, max_workers=None, executor=None, return_exceptions=False):
+    """
+    Parse each buffer with con (all the top level boxes by default), returning a list of the results
+    """
+    return list(map_many(con.parse, buffers, max_workers, executor, return_exceptions))
+
+
+def build_many(objs, con=MP4, max_workers=None, executor=None, return_exceptions=False):
+    """
+    Build each object with con, returning a list of bytes
+    """
+    return list(map_many(con.build, objs, max_workers, executor, return_exceptions))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Parse budgets for untrusted files
+
+   The arrays of pymp4.parser always check that their count fits in the bytes left in the box, whatever
+   the budget. A ParseBudget also limits the number of boxes and array entries, the bytes of the boxes, how
+   deep they nest and how long the parse takes. The limits are checked before a box or an array is parsed,
+   from its size and count, so a file that is over budget fails before the memory is allocated.
+
+       >>> with parse_budget(max_objects=100000, max_bytes=64 << 20, max_depth=16, timeout=5.0):
+       ...     boxes = MP4.parse(upload)
+"""
+import logging
+import struct
+import time
+from contextlib import contextmanager
+
+from pymp4.parser import BudgetExceeded, box_hook
+
+log = logging.getLogger(__name__)
+
+_size = struct.Struct(">I")
+
+
+class ParseBudget(object):
+    """
+    Box hook that raises BudgetExceeded once the boxes parsed by the current thread go over a limit, the
+    limits that are None are not checked
+
+    :param max_objects: number of boxes and array entries
+    :param max_bytes: bytes of the outermost boxes, which include the boxes in them
+    :param max_depth: how many boxes deep a box can be, the outermost boxes are at depth 1
+    :param timeout: seconds from the creation of the budget, checked at every box and array
+    """
+    def __init__(self, max_objects=None, max_bytes=None, max_depth=None, timeout=None, clock=time.monotonic):
+        self.max_objects = max_objects
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.clock = clock
+        self.deadline = clock() + timeout if timeout is not None else None
+        self.objects = 0
+        self.bytes = 0
+        self.depth = 0
+
+    def _check(self):
+        if self.max_objects is not None and self.objects > self.max_objects:
+            raise BudgetExceeded("{} boxes and entries is over the budget of {}".format(
+                self.objects, self.max_objects))
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            raise BudgetExceeded("{} bytes of boxes is over the budget of {}".format(self.bytes, self.max_bytes))
+        if self.deadline is not None and self.clock() > self.deadline:
+            raise BudgetExceeded("parsing took longer than the time budget")
+
+    def _box_size(self, stream):
+        # the size field of the box about to be parsed, without moving the stream
+        offset = stream.tell()
+        data = stream.read(_size.size)
+        stream.seek(offset)
+        return _size.unpack(data)[0] if len(data) == _size.size else 0
+
+    def entries(self, count):
+        self.objects += count
+        self._check()
+
+    def parse(self, parse, stream, context, path):
+        if self.max_depth is not None and self.depth >= self.max_depth:
+            raise BudgetExceeded("boxes nested deeper than the budget of {}".format(self.max_depth))
+        self.objects += 1
+        if self.depth == 0 and self.max_bytes is not None:
+            self.bytes += self._box_size(stream)
+        self._check()
+        self.depth += 1
+        try:
+            return parse(stream, context, path)
+        finally:
+            self.depth -= 1
+
+    def build(self, build, obj, stream, context, path):
+        return build(obj, stream, context, path)
+
+
+@contextmanager
+def parse_budget(max_objects=None, max_bytes=None, max_depth=None, timeout=None):
+    """
+    Apply a ParseBudget to the boxes parsed by the current thread within the block, the budget is shared by
+    all of them
+    """
+    with box_hook(ParseBudget(max_objects, max_bytes, max_depth, timeout)) as budget:
+        yield budget
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import hashlib
+import io
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from pymp4.index import index_boxes
+
+log = logging.getLogger(__name__)
+
+# the boxes that can make up an initialisation segment
+INIT_BOXES = frozenset([b"ftyp", b"moov", b"free", b"skip", b"uuid", b"pssh"])
+
+
+class _Packed(object):
+    """
+    Picklable stand-in for the construct containers, they cannot be unpickled directly
+    """
+    __slots__ = ("kind", "items")
+
+    def __init__(self, kind, items):
+        self.kind = kind
+        self.items = items
+
+
+def _pack(obj):
+    from construct import Container, ListContainer
+
+    if isinstance(obj, Container):
+        return _Packed("container", [(k, _pack(v)) for k, v in obj.items()])
+    if isinstance(obj, ListContainer):
+        return _Packed("list", [_pack(v) for v in obj])
+    if isinstance(obj, list):
+        return [_pack(v) for v in obj]
+    return obj
+
+
+def _unpack(obj):
+    from construct import Container, ListContainer
+
+    if isinstance(obj, _Packed):
+        if obj.kind == "container":
+            return Container((k, _unpack(v)) for k, v in obj.items)
+        return ListContainer(_unpack(v) for v in obj.items)
+    if isinstance(obj, list):
+        return [_unpack(v) for v in obj]
+    return obj
+
+
+def file_key(path):
+    """
+    Identify a file by its path, modification time and size
+    """
+    st = os.stat(path)
+    return "file", os.path.realpath(path), st.st_mtime_ns, st.st_size
+
+
+def content_key(data):
+    """
+    Identify a buffer by the hash of its content
+    """
+    return "sha1", hashlib.sha1(data).hexdigest()
+
+
+class BoxCache(object):
+    """
+    LRU cache for parsed boxes and box indexes
+
+    The in-memory store holds at most `maxsize` entries and, if `maxbytes` is set, at most that many bytes
+    of source data. When `directory` is given the entries are also pickled there, and misses in memory are
+    looked up on disk before parsing again. Only point the disk store at a directory you trust, the entries
+    are loaded with pickle.
+    """
+    def __init__(self, maxsize=128, maxbytes=None, directory=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.currbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, disk_hits=self.disk_hits, evictions=self.evictions,
+                    entries=len(self._entries), bytes=self.currbytes)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        value = self._load(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+            self.put(key, value[0], value[1], persist=False)
+            return value[0]
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def put(self, key, value, cost=0, persist=True):
+        with self._lock:
+            if key in self._entries:
+                self.currbytes -= self._entries[key][1]
+            self._entries[key] = (value, cost)
+            self._entries.move_to_end(key)
+            self.currbytes += cost
+            self._shrink()
+        if persist:
+            self._store(key, value, cost)
+
+    def evict(self, key):
+        """
+        Remove an entry from the memory and disk stores
+        """
+        with self._lock:
+            if key in self._entries:
+                self.currbytes -= self._entries.pop(key)[1]
+        if self.directory is not None:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.currbytes = 0
+
+    def _shrink(self):
+        while self._entries and (len(self._entries) > self.maxsize or
+                                 (self.maxbytes is not None and self.currbytes > self.maxbytes)):
+            _, (_, cost) = self._entries.popitem(last=False)
+            self.currbytes -= cost
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode("utf8")).hexdigest() + ".pickle")
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as fd:
+                stored_key, value, cost = pickle.load(fd)
+            value = _unpack(value)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if stored_key != key:
+            return None
+        return value, cost
+
+    def _store(self, key, value, cost):
+        if self.directory is None:
+            return
+        import tempfile
+
+        fdno, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fdno, "wb") as fd:
+                pickle.dump((key, _pack(value), cost), fd, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            log.warning("could not store cache entry for %r", key)
+            os.remove(tmp)
+
+    @staticmethod
+    def _open(source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return content_key(source), io.BytesIO(source)
+        return file_key(source), open(source, "rb")
+
+    def index(self, source):
+        """
+        Index of all the boxes in a file or buffer, see pymp4.index.index_boxes
+        """
+        key, fd = self._open(source)
+        with fd:
+            key += ("index",)
+            index = self.get(key)
+            if index is None:
+                index = index_boxes(fd)
+                self.put(key, index, len(index) * 64)
+        return index
+
+    def parse(self, source, offset=0, size=None):
+        """
+        Parse the boxes in the byte range [offset, offset+size) of a file or buffer
+        """
+        from pymp4.parser import MP4
+
+        key, fd = self._open(source)
+        with fd:
+            key += ("boxes", offset, size)
+            boxes = self.get(key)
+            if boxes is None:
+                fd.seek(offset)
+                data = fd.read() if size is None else fd.read(size)
+                boxes = MP4.parse(data)
+                self.put(key, boxes, len(data))
+        return boxes
+
+    def init_segment(self, source):
+        """
+        Parse the leading boxes of a file up to the first moof or mdat, ie. the ftyp and moov
+        """
+        end = 0
+        for header in self.index(source):
+            if header.depth > 0:
+                continue
+            if header.type not in INIT_BOXES:
+                break
+            end = header.end
+        return self.parse(source, 0, end)
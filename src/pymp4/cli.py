@@ -1,27 +1,375 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import io
+import sys
+import json
+import struct
 import logging
 import argparse
+from array import array
+from contextlib import contextmanager
 
-from pymp4.parser import Box
-from construct import setglobalfullprinting
+from pymp4.exceptions import MalformedBox
+from pymp4.index import CONTAINER_BOXES, iter_boxes
+from pymp4.recover import recover_boxes
+from pymp4 import samples
 
 log = logging.getLogger(__name__)
-setglobalfullprinting(True)
+
+# boxes with payloads that are never decoded, only their size is shown
+OPAQUE_BOXES = frozenset([b"mdat", b"free", b"skip"])
+BYTES_CAP = 32
+
+
+def _stsz(payload):
+    version, sample_size, sample_count = struct.unpack_from(">B3xII", payload)
+    return dict(version=version, sample_size=sample_size, sample_count=sample_count,
+                entry_sizes=samples.decode_stsz(payload) if sample_size == 0 else None)
+
+
+def _runs(payload, names, typecode=samples.U32):
+    count, = struct.unpack_from(">I", payload, 4)
+    values = samples.be_array(typecode, payload, 8, count * len(names))
+    return [dict(zip(names, values[i:i + len(names)])) for i in range(0, len(values), len(names))]
+
+
+# decoders for the sample tables that avoid building a Container per entry
+TABLES = {
+    b"stsz": _stsz,
+    b"stts": lambda p: dict(version=p[0], entries=_runs(p, ("sample_count", "sample_delta"))),
+    b"ctts": lambda p: dict(version=p[0], entries=_runs(p, ("sample_count", "sample_offset"),
+                                                        samples.S32 if p[0] else samples.U32)),
+    b"stss": lambda p: dict(version=p[0], entries=samples.decode_stss(p)),
+    b"stsc": lambda p: dict(version=p[0], entries=_runs(p, ("first_chunk", "samples_per_chunk",
+                                                            "sample_description_index"))),
+    b"stco": lambda p: dict(version=p[0], entries=samples.decode_stco(p)),
+    b"co64": lambda p: dict(version=p[0], entries=samples.decode_co64(p)),
+}
+
+
+class Summary(object):
+    """
+    Stand-in for a long list in the output: how many items there are and the first few
+    """
+    __slots__ = ("count", "first")
+
+    def __init__(self, count, first):
+        self.count = count
+        self.first = first
+
+
+def summarize(obj, items):
+    """
+    Make obj printable: long lists are replaced by a Summary and nested containers become dicts
+    """
+    if isinstance(obj, dict):
+        return dict((k, summarize(v, items)) for k, v in obj.items() if not (isinstance(k, str) and k.startswith("_")))
+    if isinstance(obj, (list, tuple, array)):
+        if items is not None and len(obj) > items:
+            return Summary(len(obj), [summarize(v, items) for v in obj[:items]])
+        return [summarize(v, items) for v in obj]
+    return obj
+
+
+def _scalar(value):
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) <= 16 and all(32 <= c < 127 for c in bytearray(value)):
+            return value.decode("ascii")
+        if len(value) > BYTES_CAP:
+            return "{}... ({} bytes)".format(bytes(value[:BYTES_CAP]).hex(), len(value))
+        return bytes(value).hex()
+    return value
+
+
+def to_json(value):
+    if isinstance(value, dict):
+        return dict((str(k), to_json(v)) for k, v in value.items())
+    if isinstance(value, Summary):
+        return dict(count=value.count, first=[to_json(v) for v in value.first])
+    if isinstance(value, list):
+        return [to_json(v) for v in value]
+    value = _scalar(value)
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def format_text(value, indent):
+    if isinstance(value, dict):
+        lines = []
+        for k, v in value.items():
+            if isinstance(v, (dict, list, Summary)):
+                lines.append("{}{} =".format(indent, k))
+                lines.extend(format_text(v, indent + "    "))
+            else:
+                lines.append("{}{} = {}".format(indent, k, _scalar(v)))
+        return lines
+    if isinstance(value, Summary):
+        lines = ["{}({} items, showing the first {})".format(indent, value.count, len(value.first))]
+        return lines + format_text(value.first, indent)
+    if isinstance(value, list):
+        lines = []
+        for v in value:
+            if isinstance(v, (dict, list, Summary)):
+                lines.append("{}-".format(indent))
+                lines.extend(format_text(v, indent + "    "))
+            else:
+                lines.append("{}- {}".format(indent, _scalar(v)))
+        return lines
+    return ["{}{}".format(indent, _scalar(value))]
+
+
+def decode_box(fd, header, items):
+    """
+    Decode the fields of a box that is not a container, summarizing anything longer than items entries
+    """
+    if header.type in OPAQUE_BOXES:
+        return {}
+    fd.seek(header.offset)
+    data = fd.read(header.size)
+    if items is not None and header.type in TABLES:
+        return summarize(TABLES[header.type](data[header.header_size:]), items)
+    from pymp4.parser import Box
+
+    box = Box.parse(data)
+    for key in ("offset", "type", "end"):
+        box.pop(key, None)
+    return summarize(box, items)
+
+
+def profile_box(fd, header, profiler):
+    """
+    Parse a whole box with pymp4.parser.Box for the profiler, the output is decoded separately, by the box
+    headers and without construct for the sample tables, which would leave most boxes out of the profile
+    """
+    from pymp4.parser import Box, box_hook
+
+    fd.seek(header.offset)
+    data = fd.read(header.size)
+    with box_hook(profiler):
+        try:
+            Box.parse(data)
+        except Exception as e:
+            log.warning("could not profile the box %r at offset %d: %s", header.type, header.offset,
+                        str(e).split("\n")[0])
+
+
+def walk(fd, offset, end, depth, path, args):
+    """
+    Yield (header, path, fields) for the boxes in [offset, end), one box at a time
+    """
+    profiler = getattr(args, "profiler", None)
+    if getattr(args, "damaged", None) is None:
+        boxes = iter_boxes(fd, offset, end, depth)
+    else:
+        boxes = recover_boxes(fd, offset, end, depth, damaged=args.damaged)
+    for header in boxes:
+        if profiler is not None and depth == 0 and header.type not in OPAQUE_BOXES:
+            profile_box(fd, header, profiler)
+        box_path = path + (header.type.decode("ascii", "replace"),)
+        selected = args.types is None or header.type in args.types
+        descend = header.type in CONTAINER_BOXES and (args.max_depth is None or depth < args.max_depth)
+        fields = None
+        if selected and header.type not in CONTAINER_BOXES:
+            try:
+                fields = decode_box(fd, header, args.items)
+            except Exception as e:
+                fields = {"error": str(e).split("\n")[0]}
+        if selected:
+            yield header, box_path, fields
+        if descend:
+            for child in walk(fd, header.data_offset, header.end, depth + 1, box_path, args):
+                yield child
+
+
+def _followed(fd, args):
+    # walk each top level box once it has been completely written
+    from pymp4.follow import Follower
+
+    follower = Follower(fd)
+    for header in follower.follow(args.interval, args.idle_timeout):
+        for item in walk(fd, header.offset, header.end, 0, (), args):
+            yield item
+
+
+def _emit_text(out, header, path, fields):
+    indent = "    " * header.depth
+    out.write("{}{} (offset={}, size={})\n".format(indent, path[-1], header.offset, header.size))
+    for line in format_text(fields or {}, indent + "    "):
+        out.write(line + "\n")
+
+
+def _emit_damage(out, fmt, damage, first):
+    if fmt == "text":
+        out.write("{}[damaged] (offset={}, size={}) {}\n".format("    " * damage.depth, damage.offset, damage.size,
+                                                                damage.reason))
+        return
+    record = json.dumps(dict(damaged=True, offset=damage.offset, size=damage.size, depth=damage.depth,
+                             reason=damage.reason))
+    if fmt == "json":
+        out.write("\n" if first else ",\n")
+        out.write(record)
+    else:
+        out.write(record + "\n")
+
+
+def _record(header, path, fields):
+    return json.dumps(dict(type=path[-1], path="/".join(path), offset=header.offset, size=header.size,
+                           depth=header.depth, fields=to_json(fields or {})))
+
+
+def _types(value):
+    return frozenset(t.encode("ascii").ljust(4) for t in value.split(","))
 
 
 def dump():
     parser = argparse.ArgumentParser(description='Dump all the boxes from an MP4 file')
     parser.add_argument("input_file", type=argparse.FileType("rb"), metavar="FILE", help="Path to the MP4 file to open")
+    parser.add_argument("--format", choices=("text", "json", "ndjson"), default="text",
+                        help="Output format, ndjson writes one JSON object per box")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="Do not descend into boxes deeper than this, 0 only shows the top level boxes")
+    parser.add_argument("--types", type=_types, default=None,
+                        help="Comma separated list of the box types to show, eg. moof,trun")
+    parser.add_argument("--items", type=int, default=10,
+                        help="Number of entries to show for sample tables and other long lists (default: 10)")
+    parser.add_argument("--full", action="store_const", dest="items", const=None,
+                        help="Show every entry of every list")
+    parser.add_argument("--recover", action="store_true",
+                        help="Skip over damaged or truncated parts of the file and report them, the exit status "
+                             "is 2 when there were any")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep the file open and dump the boxes that are appended to it as they are completed")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="Seconds between checks for new boxes with --follow (default: 1)")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Stop following once no box has been completed for this many seconds")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent parsing each box type to stderr")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Include memory allocations in the profile, this is slow")
 
     args = parser.parse_args()
+    if args.follow and args.format == "json":
+        parser.error("--follow writes the boxes as they come, use --format ndjson or text")
 
     fd = args.input_file
     fd.seek(0, io.SEEK_END)
     eof = fd.tell()
-    fd.seek(0)
+    boxes = _followed(fd, args) if args.follow else walk(fd, 0, eof, 0, (), args)
+    out = sys.stdout
+    # damaged ranges are written out before the box that follows them
+    args.damaged = [] if args.recover else None
+    reported = 0
+
+    try:
+        with profiled(args.profile or args.profile_memory, args.profile_memory) as args.profiler:
+            first = True
+            if args.format == "json":
+                out.write("[")
+            for header, path, fields in boxes:
+                for damage in (args.damaged or [])[reported:]:
+                    _emit_damage(out, args.format, damage, first)
+                    first = False
+                    reported += 1
+                if args.format == "text":
+                    _emit_text(out, header, path, fields)
+                elif args.format == "json":
+                    out.write("\n" if first else ",\n")
+                    out.write(_record(header, path, fields))
+                else:
+                    out.write(_record(header, path, fields) + "\n")
+                if args.follow:
+                    out.flush()
+                first = False
+            for damage in (args.damaged or [])[reported:]:
+                _emit_damage(out, args.format, damage, first)
+                first = False
+            if args.format == "json":
+                out.write("\n]\n")
+    except MalformedBox as e:
+        log.error("%s", e)
+        sys.exit(1)
+    except BrokenPipeError:
+        # the output was piped to something like head that stopped reading
+        sys.stderr.close()
+    except KeyboardInterrupt:
+        if not args.follow:
+            raise
+    if args.damaged:
+        sys.exit(2)
+
+
+def _paths(args):
+    for path in args.paths:
+        yield path
+    if args.paths_from is not None:
+        for line in args.paths_from:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def drm():
+    parser = argparse.ArgumentParser(description='Scan MP4 init segments for pssh, tenc and schm boxes and write '
+                                                 'one JSON object per file')
+    parser.add_argument("paths", nargs="*", metavar="FILE", help="Paths of the MP4 files to scan")
+    parser.add_argument("--paths-from", type=argparse.FileType("r"), default=None, metavar="LIST",
+                        help="Read the paths to scan from a file, one per line, - for stdin")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: the number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=64,
+                        help="Number of files handed to a worker process at a time (default: 64)")
+
+    args = parser.parse_args()
+    from pymp4.drm import scan_many, write_ndjson
+
+    try:
+        errors = write_ndjson(scan_many(_paths(args), args.workers, args.chunksize), sys.stdout)
+    except BrokenPipeError:
+        sys.stderr.close()
+        return
+    if errors:
+        log.error("%d files could not be scanned", errors)
+        sys.exit(1)
+
+
+def validate():
+    parser = argparse.ArgumentParser(description='Check the structure of an MP4 file in a single pass')
+    parser.add_argument("input_file", type=argparse.FileType("rb"), metavar="FILE", help="Path to the MP4 file to open")
+    parser.add_argument("--format", choices=("text", "ndjson"), default="text",
+                        help="Output format, ndjson writes one JSON object per issue")
+
+    args = parser.parse_args()
+    from pymp4.validate import ERROR, validate as validate_file
+
+    errors = 0
+    try:
+        for issue in validate_file(args.input_file):
+            errors += issue.severity == ERROR
+            if args.format == "text":
+                sys.stdout.write("{} [{}] offset={} {}: {}\n".format(issue.severity, issue.rule, issue.offset,
+                                                                   issue.type, issue.message))
+            else:
+                sys.stdout.write(json.dumps(issue._asdict()) + "\n")
+    except BrokenPipeError:
+        sys.stderr.close()
+        return
+    if errors:
+        sys.exit(1)
+
+
+@contextmanager
+def profiled(enabled, tracemalloc=False):
+    """
+    The BoxProfiler that walk parses the top level boxes for, None when profiling is not enabled
+    """
+    if not enabled:
+        yield None
+        return
+    from pymp4.instrument import BoxProfiler, tracing
 
-    while fd.tell() < eof:
-        box = Box.parse_stream(fd)
-        print(box)
+    profiler = BoxProfiler(tracemalloc)
+    with tracing(tracemalloc):
+        yield profiler
+    print(profiler.report(), file=sys.stderr)
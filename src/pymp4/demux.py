@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Demuxing into one output per track
+
+   The sample tables of a progressive file, or the track runs of a fragmented one, are resolved first. The
+   byte ranges of all the outputs are then merged in the order of the source, so that it is read once from
+   start to end whatever the number of tracks, and each range is copied to the output of its track.
+"""
+import heapq
+import logging
+import struct
+from collections import namedtuple
+from contextlib import ExitStack
+
+from pymp4 import writer
+from pymp4.index import iter_boxes, read_payload
+from pymp4.nal import AVC_FORMATS, HEVC_FORMATS, iter_nal_units, nal_config
+from pymp4.remux import init_segment, moof, plan_fragments
+from pymp4.samples import read_source
+
+log = logging.getLogger(__name__)
+
+FMP4 = "fmp4"
+RAW = "raw"
+
+# kind of track for each handler_type of the hdlr box
+KINDS = {
+    b"vide": "video",
+    b"soun": "audio",
+    b"text": "text",
+    b"sbtl": "subtitle",
+    b"subt": "subtitle",
+    b"meta": "metadata",
+    b"hint": "hint",
+}
+
+START_CODE = b"\x00\x00\x00\x01"
+
+TrackInfo = namedtuple("TrackInfo", "track_ID handler_type kind language sample_count")
+
+
+def _child(fd, parent, type_):
+    for header in iter_boxes(fd, parent.data_offset, parent.end, parent.depth + 1, recursive=True):
+        if header.type == type_:
+            return header
+    return None
+
+
+def _language(fd, trak):
+    # ISO 639-2/T code packed in the mdhd as three 5 bit letters
+    mdhd = _child(fd, trak, b"mdhd")
+    if mdhd is None:
+        return None
+    payload = read_payload(fd, mdhd)
+    packed, = struct.unpack_from(">H", payload, 32 if payload[0] == 1 else 20)
+    return "".join(chr(((packed >> shift) & 0x1f) + 0x60) for shift in (10, 5, 0))
+
+
+def _sample_entry(fd, trak):
+    stsd = _child(fd, trak, b"stsd")
+    if stsd is None:
+        return None
+    fd.seek(stsd.data_offset + 12)
+    return fd.read(4)
+
+
+def classify(fd, trak, table):
+    """
+    TrackInfo of a track: the track ID, handler type and sample count of its SampleTable (from the tkhd, hdlr
+    and sample tables) and the language of its mdhd box
+    """
+    return TrackInfo(table.track_ID, table.handler_type, KINDS.get(table.handler_type, "other"),
+                     _language(fd, trak), len(table))
+
+
+class _TrackOutput(object):
+    """
+    Where the samples of a track go, pieces yields (offset, size, prefix) for the byte ranges of the source
+    in the order they are written, prefix being the bytes that come before the range
+    """
+    def __init__(self, out, table):
+        self.out = out
+        self.table = table
+
+    def pieces(self):
+        for offset, size in self.table.byte_ranges():
+            yield offset, size, b""
+
+    def copy(self, src, offset, size):
+        writer.copy_range(src, self.out, offset, size)
+
+
+class _FragmentedOutput(_TrackOutput):
+    def __init__(self, out, table, init, fragment_duration):
+        super(_FragmentedOutput, self).__init__(out, table)
+        self.init = init
+        self.fragment_duration = fragment_duration
+
+    def pieces(self):
+        prefix = self.init
+        for sequence_number, fragment in enumerate(plan_fragments([self.table], self.fragment_duration), 1):
+            (_, (first, last)), = fragment
+            mdat_header = writer.box_header(b"mdat", sum(self.table.sizes[first:last]))
+            prefix += moof(sequence_number, fragment, len(mdat_header)) + mdat_header
+            for offset, size in self.table.byte_ranges(first, last):
+                yield offset, size, prefix
+                prefix = b""
+        if prefix:
+            yield 0, 0, prefix
+
+
+class _AnnexBOutput(_TrackOutput):
+    """
+    Elementary stream with start codes, with the parameter sets of the sample entry in front of each sync
+    sample. Each sample is a piece, as the NAL units have to be split
+    """
+    def __init__(self, out, table, config):
+        super(_AnnexBOutput, self).__init__(out, table)
+        self.config = config
+        self.parameter_sets = b"".join(START_CODE + bytes(nal) for nal in config.parameter_sets)
+
+    def pieces(self):
+        table = self.table
+        for sample in range(len(table)):
+            yield table.offsets[sample], table.sizes[sample], self.parameter_sets if table.is_sync(sample) else b""
+
+    def copy(self, src, offset, size):
+        src.seek(offset)
+        data = src.read(size)
+        if len(data) < size:
+            raise IOError("unexpected end of file at offset {}".format(src.tell()))
+        for _, _, nal in iter_nal_units(data, self.config.length_size, self.config.codec):
+            self.out.write(START_CODE)
+            self.out.write(nal)
+
+
+def _output_for(fd, trak, table, out, format, fragment_duration):
+    if format == FMP4:
+        return _FragmentedOutput(out, table, init_segment(fd, [table]), fragment_duration)
+    if format != RAW:
+        raise ValueError("unknown demux format {!r}".format(format))
+    if _sample_entry(fd, trak) in AVC_FORMATS | HEVC_FORMATS:
+        return _AnnexBOutput(out, table, nal_config(fd, trak))
+    return _TrackOutput(out, table)
+
+
+def _template(template):
+    def output(info):
+        return template.format(**info._asdict())
+    return output
+
+
+def demux(source, output, format=FMP4, fragment_duration=2.0):
+    """
+    Write each track of the progressive or fragmented MP4 source to its own output, reading source once
+
+    :param output: a format string for the path of each output, with the fields of TrackInfo, or a function
+                   of the TrackInfo that returns a path or file object, or None to skip the track
+    :param format: FMP4 for a fragmented MP4 per track, or RAW for the elementary streams, with start codes
+                   for AVC and HEVC and the samples as they are for anything else
+    :returns: the TrackInfo of the tracks that were written
+    """
+    if not callable(output):
+        output = _template(output)
+
+    with ExitStack() as stack:
+        src = stack.enter_context(writer.opened(source, "rb"))
+        _, traks, tables = read_source(src)
+        written, outputs = [], []
+        for trak, table in zip(traks, tables):
+            info = classify(src, trak, table)
+            target = output(info)
+            if target is None:
+                continue
+            out = stack.enter_context(writer.opened(target, "wb"))
+            outputs.append(_output_for(src, trak, table, out, format, fragment_duration))
+            written.append(info)
+
+        def keyed(track_output):
+            for offset, size, prefix in track_output.pieces():
+                yield offset, size, prefix, track_output
+
+        for offset, size, prefix, track_output in heapq.merge(*map(keyed, outputs), key=lambda piece: piece[0]):
+            if prefix:
+                track_output.out.write(prefix)
+            if size:
+                track_output.copy(src, offset, size)
+    return written
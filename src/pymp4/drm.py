@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Protection headers of init segments
+
+   scan finds the pssh boxes (plain or PIFF uuid ones), and the schm, frma and tenc boxes of the protected
+   sample entries, by walking the box headers down moov/trak/mdia/minf/stbl/stsd/<entry>/sinf/schi. Only
+   those boxes are read and decoded, the rest of the file is stepped over. scan_many runs it on a process
+   pool for large catalogues.
+
+   With key rotation the KID and IV parameters of a sample come from the seig sample group it belongs to.
+   SampleKeys keeps the runs of an sbgp as they are, a column of run ends and one of group indices, and
+   bisects them to find the group of a sample, so looking up a sample does not expand the runs.
+"""
+import base64
+import json
+import logging
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from uuid import UUID
+
+from pymp4 import writer
+from pymp4.exceptions import MalformedBox
+from pymp4.index import iter_boxes, read_payload
+from pymp4.samples import U32, U64, be_array
+
+log = logging.getLogger(__name__)
+
+PIFF_PSSH = UUID("D08A4F18-10F3-4A82-B6C8-32D8ABA183D3")
+PIFF_TENC = UUID("8974DBCE-7BE7-4C51-84F9-7148F9882554")
+SEIG = b"seig"
+# group description indices above this one refer to the sgpd of the traf rather than the one of the trak
+FRAGMENT_GROUP_OFFSET = 0x10000
+
+# boxes that can hold pssh boxes, and the boxes on the way to the sample descriptions
+_PSSH_PARENTS = frozenset([b"moov", b"moof"])
+_PATH = frozenset([b"trak", b"mdia", b"minf", b"stbl"])
+# size of the fields of a sample entry before its child boxes
+_VISUAL_ENTRY_SIZE = 78
+_AUDIO_ENTRY_SIZE = 28
+_AUDIO_ENTRY_EXTRA = {1: 16, 2: 36}
+
+PSSH = namedtuple("PSSH", "system_ID version key_IDs data offset")
+ProtectedTrack = namedtuple("ProtectedTrack", "track_ID format original_format scheme_type scheme_version "
+                                              "is_protected per_sample_iv_size default_KID constant_iv "
+                                              "crypt_byte_block skip_byte_block")
+Protection = namedtuple("Protection", "pssh tracks")
+KeyParams = namedtuple("KeyParams", "is_protected per_sample_iv_size KID constant_iv crypt_byte_block "
+                                    "skip_byte_block")
+
+
+def decode_pssh(payload, piff=False, offset=None):
+    """
+    PSSH of a pssh payload, or of a PIFF uuid one after the extended type
+    """
+    version, = struct.unpack_from(">B", payload)
+    system_ID = UUID(bytes=bytes(payload[4:20]))
+    pos = 20
+    key_IDs = []
+    if version > 0 and not piff:
+        count, = struct.unpack_from(">I", payload, pos)
+        pos += 4
+        key_IDs = [UUID(bytes=bytes(payload[pos + 16 * i:pos + 16 * (i + 1)])) for i in range(count)]
+        pos += 16 * count
+    size, = struct.unpack_from(">I", payload, pos)
+    return PSSH(system_ID, version, key_IDs, bytes(payload[pos + 4:pos + 4 + size]), offset)
+
+
+def decode_tenc(payload):
+    """
+    :returns: is_protected, per_sample_iv_size, default_KID, constant_iv (None if there is none) and the
+              crypt and skip byte blocks of the pattern of a tenc payload, or of a PIFF uuid one after the
+              extended type, where the algorithm ID takes the place of is_protected
+    """
+    is_protected, iv_size = payload[6], payload[7]
+    key_ID = UUID(bytes=bytes(payload[8:24]))
+    constant_iv = None
+    if is_protected and iv_size == 0 and len(payload) > 24:
+        constant_iv = bytes(payload[25:25 + payload[24]])
+    blocks = payload[5] if payload[0] > 0 else 0
+    return bool(is_protected), iv_size, key_ID, constant_iv, blocks >> 4, blocks & 0x0f
+
+
+def decode_seig(entry):
+    """
+    KeyParams of a seig sample group description entry
+    """
+    blocks, is_protected, iv_size = entry[1], entry[2], entry[3]
+    constant_iv = None
+    if is_protected and iv_size == 0:
+        constant_iv = bytes(entry[21:21 + entry[20]])
+    return KeyParams(bool(is_protected), iv_size, UUID(bytes=bytes(entry[4:20])), constant_iv, blocks >> 4,
+                     blocks & 0x0f)
+
+
+def _seig_length(payload, pos):
+    # a seig entry is 20 bytes, and the constant IV with its size when there is one
+    if payload[pos + 2] and payload[pos + 3] == 0:
+        return 21 + payload[pos + 20]
+    return 20
+
+
+def decode_sbgp(payload):
+    """
+    :returns: grouping_type, grouping_type_parameter (None in version 0), and the runs of an sbgp payload as
+              a column of run ends, the number of samples up to the end of each run, and one of group
+              description indices
+    """
+    version = payload[0]
+    grouping_type = bytes(payload[4:8])
+    parameter, pos = None, 8
+    if version == 1:
+        parameter, = struct.unpack_from(">I", payload, pos)
+        pos += 4
+    entry_count, = struct.unpack_from(">I", payload, pos)
+    runs = be_array(U32, payload, pos + 4, entry_count * 2)
+    return grouping_type, parameter, array(U64, accumulate(runs[0::2])), runs[1::2]
+
+
+def decode_sgpd(payload):
+    """
+    :returns: grouping_type, default_group_description_index (0 before version 2) and the bytes of each
+              entry of an sgpd payload
+    """
+    version = payload[0]
+    grouping_type = bytes(payload[4:8])
+    default_length = default_index = 0
+    pos = 8
+    if version == 1:
+        default_length, = struct.unpack_from(">I", payload, pos)
+        pos += 4
+    elif version >= 2:
+        default_index, = struct.unpack_from(">I", payload, pos)
+        pos += 4
+    entry_count, = struct.unpack_from(">I", payload, pos)
+    pos += 4
+    entries = []
+    for _ in range(entry_count):
+        length = default_length
+        if version == 1 and not default_length:
+            length, = struct.unpack_from(">I", payload, pos)
+            pos += 4
+        if not length:
+            if grouping_type != SEIG:
+                raise MalformedBox("the length of the {!r} entries of a version {} sgpd is not known".format(
+                    grouping_type, version))
+            length = _seig_length(payload, pos)
+        if pos + length > len(payload):
+            raise MalformedBox("sgpd entry needs {} bytes but only {} are available".format(
+                length, len(payload) - pos))
+        entries.append(bytes(payload[pos:pos + length]))
+        pos += length
+    return grouping_type, default_index, entries
+
+
+def _children(fd, header):
+    return iter_boxes(fd, header.data_offset, header.end, header.depth + 1)
+
+
+def _uuid(fd, header):
+    fd.seek(header.data_offset)
+    return UUID(bytes=fd.read(16))
+
+
+def _pssh(fd, header):
+    if header.type == b"pssh":
+        return decode_pssh(read_payload(fd, header), offset=header.offset)
+    if header.type == b"uuid" and header.data_size > 16 and _uuid(fd, header) == PIFF_PSSH:
+        return decode_pssh(read_payload(fd, header)[16:], piff=True, offset=header.offset)
+    return None
+
+
+def _entry_children(fd, entry, handler_type):
+    # the child boxes of a sample entry start after its fixed fields, which depend on the kind of track
+    if handler_type == b"soun":
+        fd.seek(entry.data_offset + 8)
+        version, = struct.unpack(">H", fd.read(2))
+        start = entry.data_offset + _AUDIO_ENTRY_SIZE + _AUDIO_ENTRY_EXTRA.get(version, 0)
+    elif handler_type == b"vide":
+        start = entry.data_offset + _VISUAL_ENTRY_SIZE
+    else:
+        return []
+    if start >= entry.end:
+        return []
+    return iter_boxes(fd, start, entry.end, entry.depth + 1)
+
+
+def _protected_track(fd, track_ID, handler_type, entry):
+    values = dict(track_ID=track_ID, format=entry.type.decode("ascii", "replace"), original_format=None,
+                  scheme_type=None, scheme_version=None, is_protected=None, per_sample_iv_size=None,
+                  default_KID=None, constant_iv=None, crypt_byte_block=None, skip_byte_block=None)
+    sinf = next((h for h in _entry_children(fd, entry, handler_type) if h.type == b"sinf"), None)
+    if sinf is None:
+        return None
+    for header in _children(fd, sinf):
+        if header.type == b"frma":
+            values["original_format"] = read_payload(fd, header)[:4].decode("ascii", "replace")
+        elif header.type == b"schm":
+            payload = read_payload(fd, header)
+            values["scheme_type"] = payload[4:8].decode("ascii", "replace")
+            values["scheme_version"], = struct.unpack_from(">I", payload, 8)
+        elif header.type == b"schi":
+            for child in _children(fd, header):
+                tenc = None
+                if child.type == b"tenc":
+                    tenc = decode_tenc(read_payload(fd, child))
+                elif child.type == b"uuid" and child.data_size > 16 and _uuid(fd, child) == PIFF_TENC:
+                    tenc = decode_tenc(read_payload(fd, child)[16:])
+                if tenc is not None:
+                    values.update(zip(("is_protected", "per_sample_iv_size", "default_KID", "constant_iv",
+                                       "crypt_byte_block", "skip_byte_block"), tenc))
+    return ProtectedTrack(**values)
+
+
+def _trak(fd, trak):
+    track_ID, handler_type, tracks = None, None, []
+    stsd = None
+    pending = [trak]
+    while pending:
+        for header in _children(fd, pending.pop()):
+            if header.type in _PATH:
+                pending.append(header)
+            elif header.type == b"tkhd":
+                payload = read_payload(fd, header)
+                track_ID, = struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)
+            elif header.type == b"hdlr":
+                fd.seek(header.data_offset + 8)
+                handler_type = fd.read(4)
+            elif header.type == b"stsd":
+                stsd = header
+    if stsd is not None:
+        # the entries follow the version, flags and entry count
+        for entry in iter_boxes(fd, stsd.data_offset + 8, stsd.end, stsd.depth + 1):
+            track = _protected_track(fd, track_ID, handler_type, entry)
+            if track is not None:
+                tracks.append(track)
+    return tracks
+
+
+def scan(fd):
+    """
+    Protection of a file: the pssh boxes of the file, its moov and moofs, and the protected sample entries
+    """
+    pssh, tracks = [], []
+    for header in iter_boxes(fd):
+        found = _pssh(fd, header)
+        if found is not None:
+            pssh.append(found)
+        if header.type not in _PSSH_PARENTS:
+            continue
+        for child in _children(fd, header):
+            if child.type == b"trak":
+                tracks.extend(_trak(fd, child))
+                continue
+            found = _pssh(fd, child)
+            if found is not None:
+                pssh.append(found)
+            elif child.type == b"traf":
+                pssh.extend(p for p in (_pssh(fd, h) for h in _children(fd, child)) if p is not None)
+    return Protection(pssh, tracks)
+
+
+class SampleKeys(object):
+    """
+    KeyParams of the samples of a track or track fragment, from the runs of its seig sbgp
+
+    :param ends: number of samples up to the end of each run
+    :param indices: group description index of each run
+    :param descriptions: KeyParams of the seig entries of the sgpd of the trak, indices 1 to 0x10000
+    :param fragment_descriptions: KeyParams of the seig entries of the sgpd of the traf, from 0x10001
+    :param default: KeyParams of the samples that are in no group, from the tenc of the track
+    :param default_index: group description index of the samples after the last run, from a version 2 sgpd
+    """
+    def __init__(self, ends=None, indices=None, descriptions=(), fragment_descriptions=(), default=None,
+                 default_index=0):
+        self.ends = ends if ends is not None else array(U64)
+        self.indices = indices if indices is not None else array(U32)
+        self.descriptions = list(descriptions)
+        self.fragment_descriptions = list(fragment_descriptions)
+        self.default = default
+        self.default_index = default_index
+
+    def __len__(self):
+        """
+        Number of samples mapped by the runs
+        """
+        return self.ends[-1] if self.ends else 0
+
+    def group_index(self, sample):
+        run = bisect_right(self.ends, sample)
+        return self.indices[run] if run < len(self.indices) else self.default_index
+
+    def description(self, index):
+        """
+        KeyParams of a group description index, the track defaults for index 0
+        """
+        if index == 0:
+            return self.default
+        descriptions = self.descriptions
+        if index > FRAGMENT_GROUP_OFFSET:
+            descriptions, index = self.fragment_descriptions, index - FRAGMENT_GROUP_OFFSET
+        if index > len(descriptions):
+            raise MalformedBox("group description index {} is out of range, there are {} entries".format(
+                index, len(descriptions)))
+        return descriptions[index - 1]
+
+    def __getitem__(self, sample):
+        """
+        KeyParams of a sample, by its number from 0 in the track or track fragment
+        """
+        if sample < 0:
+            raise IndexError("sample {} is out of range".format(sample))
+        return self.description(self.group_index(sample))
+
+    def runs(self):
+        """
+        Yield (first, end, KeyParams) for each run, end being the number of the sample after it
+        """
+        first = 0
+        for end, index in zip(self.ends, self.indices):
+            yield first, end, self.description(index)
+            first = end
+
+    def key_IDs(self):
+        """
+        KIDs of the samples that are mapped, and of the defaults
+        """
+        used = set(self.description(index) for index in set(self.indices))
+        used.add(self.description(self.default_index))
+        return set(params.KID for params in used if params is not None)
+
+
+def _seig_groups(fd, header, recursive=False):
+    # the seig sbgp and sgpd below header, as decoded
+    sbgp = sgpd = None
+    for child in iter_boxes(fd, header.data_offset, header.end, header.depth + 1, recursive=recursive):
+        if child.type not in (b"sbgp", b"sgpd") or read_payload(fd, child)[4:8] != SEIG:
+            continue
+        if child.type == b"sbgp":
+            sbgp = decode_sbgp(read_payload(fd, child))
+        else:
+            sgpd = decode_sgpd(read_payload(fd, child))
+    return sbgp, sgpd
+
+
+def read_sample_keys(fd, trak, traf=None):
+    """
+    SampleKeys of the samples of a trak, or of one of its trafs, from their seig sample groups and the
+    tenc of the track
+    """
+    default = next((KeyParams(track.is_protected, track.per_sample_iv_size, track.default_KID,
+                              track.constant_iv, track.crypt_byte_block, track.skip_byte_block)
+                    for track in _trak(fd, trak) if track.is_protected is not None), None)
+    sbgp, sgpd = _seig_groups(fd, trak, recursive=True)
+    fragment_sgpd = None
+    if traf is not None:
+        sbgp, fragment_sgpd = _seig_groups(fd, traf)
+
+    def descriptions(found):
+        return [decode_seig(entry) for entry in found[2]] if found is not None else []
+
+    # the default group of the sgpd of a traf is one of its own entries
+    default_index = sgpd[1] if sgpd is not None else 0
+    if fragment_sgpd is not None and fragment_sgpd[1]:
+        default_index = fragment_sgpd[1] + FRAGMENT_GROUP_OFFSET
+    ends, indices = (sbgp[2], sbgp[3]) if sbgp is not None else (None, None)
+    return SampleKeys(ends, indices, descriptions(sgpd), descriptions(fragment_sgpd), default, default_index)
+
+
+def _json(value):
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, list):
+        return [_json(v) for v in value]
+    if isinstance(value, tuple) and hasattr(value, "_asdict"):
+        return dict((k, _json(v)) for k, v in value._asdict().items())
+    return value
+
+
+def to_record(path, protection):
+    """
+    JSON serialisable record of the protection of a file, the pssh data and constant IVs are base64
+    """
+    return dict(path=path, pssh=_json(protection.pssh), tracks=_json(protection.tracks))
+
+
+def scan_record(path):
+    """
+    Record for one file, with an error instead of the boxes when the file could not be scanned
+    """
+    try:
+        with writer.opened(path, "rb") as fd:
+            return to_record(path, scan(fd))
+    except Exception as e:
+        return dict(path=path, error="{}: {}".format(type(e).__name__, e))
+
+
+def _scan_chunk(paths):
+    return [scan_record(path) for path in paths]
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan_many(paths, max_workers=None, chunksize=64, executor=None):
+    """
+    Scan every path on a process pool, yielding the records in the order of paths
+
+    The paths are handed out chunksize at a time and only a few chunks per worker are queued, so paths can
+    be a generator over millions of files.
+    """
+    pool = executor if executor is not None else ProcessPoolExecutor(max_workers=max_workers)
+    backlog = 4 * (max_workers or os.cpu_count() or 1)
+    pending = deque()
+    try:
+        for chunk in _chunks(paths, chunksize):
+            pending.append(pool.submit(_scan_chunk, chunk))
+            if len(pending) >= backlog:
+                for record in pending.popleft().result():
+                    yield record
+        while pending:
+            for record in pending.popleft().result():
+                yield record
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+
+def write_ndjson(records, out):
+    """
+    Write one JSON object per line, returns the number of records with an error
+    """
+    errors = 0
+    for record in records:
+        errors += "error" in record
+        out.write(json.dumps(record, sort_keys=True) + "\n")
+    return errors
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Event messages and producer reference times
+
+   The emsg and prft boxes of a segment are top level boxes, so extract_events only steps from one box
+   header to the next and decodes these two, the moof and mdat are never looked into. A segment can be
+   given as bytes, as it arrives from a live encoder, or as a file object.
+
+       >>> for event in extract_events(segment):
+       ...     if event.scheme_id_uri in SCTE35_SCHEMES:
+       ...         splice(event.message_data)
+"""
+import logging
+import struct
+from collections import namedtuple
+
+from pymp4.exceptions import MalformedBox
+from pymp4.index import iter_boxes, read_payload
+
+log = logging.getLogger(__name__)
+
+EVENT_BOXES = frozenset([b"emsg", b"prft"])
+SCTE35_SCHEMES = frozenset([
+    "urn:scte:scte35:2013:bin",
+    "urn:scte:scte35:2014:bin",
+    "urn:scte:scte35:2013:xml",
+    "urn:scte:scte35:2014:xml+bin",
+])
+# seconds from the NTP epoch (1900) to the Unix epoch (1970)
+NTP_UNIX_OFFSET = 2208988800
+
+Event = namedtuple("Event", "scheme_id_uri value timescale presentation_time presentation_time_delta "
+                            "event_duration id message_data version offset")
+ProducerReferenceTime = namedtuple("ProducerReferenceTime", "reference_track_ID ntp_timestamp media_time "
+                                                            "flags version offset")
+
+_size_type = struct.Struct(">I4s")
+_largesize = struct.Struct(">Q")
+_emsg_v0 = struct.Struct(">IIII")
+_emsg_v1 = struct.Struct(">IQII")
+
+
+def ntp_to_unix(ntp_timestamp):
+    """
+    Unix time in seconds of a 64 bit NTP timestamp, as found in prft
+    """
+    return (ntp_timestamp >> 32) - NTP_UNIX_OFFSET + (ntp_timestamp & 0xffffffff) / 4294967296.0
+
+
+def _cstring(payload, pos):
+    end = payload.index(b"\x00", pos)
+    return bytes(payload[pos:end]).decode("utf8"), end + 1
+
+
+def decode_emsg(payload, offset=None):
+    """
+    Event of an emsg payload, presentation_time is None in version 0 which only has the delta from the
+    earliest presentation time of the segment, and presentation_time_delta is None in version 1
+    """
+    payload = bytes(payload)
+    version = payload[0]
+    if version == 0:
+        scheme_id_uri, pos = _cstring(payload, 4)
+        value, pos = _cstring(payload, pos)
+        timescale, delta, event_duration, id_ = _emsg_v0.unpack_from(payload, pos)
+        time = None
+        pos += _emsg_v0.size
+    elif version == 1:
+        timescale, time, event_duration, id_ = _emsg_v1.unpack_from(payload, 4)
+        delta = None
+        scheme_id_uri, pos = _cstring(payload, 4 + _emsg_v1.size)
+        value, pos = _cstring(payload, pos)
+    else:
+        raise MalformedBox("unknown emsg version {}".format(version))
+    return Event(scheme_id_uri, value, timescale, time, delta, event_duration, id_, payload[pos:], version, offset)
+
+
+def decode_prft(payload, offset=None):
+    version, flags = payload[0], int.from_bytes(payload[1:4], "big")
+    reference_track_ID, ntp_timestamp = struct.unpack_from(">IQ", payload, 4)
+    media_time, = struct.unpack_from(">Q" if version == 1 else ">I", payload, 16)
+    return ProducerReferenceTime(reference_track_ID, ntp_timestamp, media_time, flags, version, offset)
+
+
+_DECODERS = {
+    b"emsg": decode_emsg,
+    b"prft": decode_prft,
+}
+
+
+def _scan(data, types):
+    # (type, offset, payload) of the top level boxes of the given types in data
+    view = memoryview(data)
+    offset, end = 0, len(view)
+    while offset < end:
+        if end - offset < 8:
+            raise MalformedBox("truncated box header at offset {}".format(offset))
+        size, type_ = _size_type.unpack_from(view, offset)
+        header_size = 8
+        if size == 1:
+            if end - offset < 16:
+                raise MalformedBox("truncated box header at offset {}".format(offset))
+            size, = _largesize.unpack_from(view, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MalformedBox("invalid size {} for box {!r} at offset {}".format(size, type_, offset))
+        if type_ in types:
+            yield type_, offset, view[offset + header_size:offset + size]
+        offset += size
+
+
+def extract_events(segment, types=EVENT_BOXES):
+    """
+    Yield an Event for each emsg and a ProducerReferenceTime for each prft of a segment, bytes or a file
+    object, in the order they appear
+
+    :param types: the subset of EVENT_BOXES to extract
+    """
+    types = frozenset(types) & EVENT_BOXES
+    if isinstance(segment, (bytes, bytearray, memoryview)):
+        boxes = _scan(segment, types)
+    else:
+        boxes = ((header.type, header.offset, read_payload(segment, header))
+                 for header in iter_boxes(segment) if header.type in types)
+    for type_, offset, payload in boxes:
+        yield _DECODERS[type_](payload, offset)
+
+
+def iter_events(segments, types=EVENT_BOXES):
+    """
+    Yield (index, event) for the events of a stream of segments, index being the position of the segment
+    """
+    for index, segment in enumerate(segments):
+        for event in extract_events(segment, types):
+            yield index, event
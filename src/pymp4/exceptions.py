@@ -18,3 +18,7 @@
 
 class BoxNotFound(Exception):
     pass
+
+
+class MalformedBox(Exception):
+    pass
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Round-trip fidelity
+
+   parse keeps a view of the original bytes of every box and returns containers that notice when they are
+   modified. build copies the boxes that were not modified, and do not contain a modified box, straight from
+   the original bytes and only encodes the rest, so the unchanged parts of a file come out byte for byte
+   the same whatever quirks they have.
+
+       >>> boxes = fidelity.parse(data)
+       >>> BoxUtil.first(boxes[1], b"mvhd").timescale = 90000
+       >>> data = fidelity.build(boxes)
+"""
+import io
+import logging
+
+from construct import Container, ListContainer
+
+from pymp4.parser import MP4, box_hook
+
+log = logging.getLogger(__name__)
+
+
+def _touch(node):
+    # the box that holds node and all the boxes above it have to be encoded again
+    while node is not None:
+        object.__setattr__(node, "_source", None)
+        node = node._owner
+
+
+class TrackedContainer(Container):
+    """
+    Container that marks its box, and the boxes that contain it, as modified when it is changed
+
+    For a box, _source is the view of its original bytes, or None once it has been modified. _owner is the
+    enclosing box.
+    """
+    __slots__ = ["_owner", "_source"]
+
+    def __setitem__(self, key, val):
+        Container.__setitem__(self, key, val)
+        _touch(self)
+
+    def __delitem__(self, key):
+        Container.__delitem__(self, key)
+        _touch(self)
+
+    __setattr__ = __setitem__
+    __delattr__ = __delitem__
+
+    def clear(self):
+        Container.clear(self)
+        _touch(self)
+
+    def pop(self, key, *default):
+        val = Container.pop(self, key, *default)
+        _touch(self)
+        return val
+
+    def popitem(self):
+        item = Container.popitem(self)
+        _touch(self)
+        return item
+
+    def update(self, seqordict, **kw):
+        Container.update(self, seqordict)
+        for k, v in kw.items():
+            Container.__setitem__(self, k, v)
+        _touch(self)
+
+
+def _touching(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        result = method(self, *args)
+        _touch(self._owner)
+        return result
+    wrapper.__name__ = name
+    return wrapper
+
+
+class TrackedList(ListContainer):
+    """
+    ListContainer that marks the box it belongs to as modified when it is changed
+    """
+    _owner = None
+
+    __setitem__ = _touching("__setitem__")
+    __delitem__ = _touching("__delitem__")
+    __iadd__ = _touching("__iadd__")
+    __imul__ = _touching("__imul__")
+    append = _touching("append")
+    extend = _touching("extend")
+    insert = _touching("insert")
+    remove = _touching("remove")
+    pop = _touching("pop")
+    clear = _touching("clear")
+    sort = _touching("sort")
+    reverse = _touching("reverse")
+
+
+def _track(obj, owner, view, spans):
+    if isinstance(obj, Container):
+        node = TrackedContainer()
+        span = spans.get(id(obj))
+        object.__setattr__(node, "_owner", owner)
+        object.__setattr__(node, "_source", None)
+        child_owner = node if span is not None else owner
+        for key, value in obj.items():
+            Container.__setitem__(node, key, _track(value, child_owner, view, spans))
+        if span is not None:
+            object.__setattr__(node, "_source", view[span[1]:span[2]])
+        return node
+    if isinstance(obj, list):
+        node = TrackedList()
+        list.extend(node, (_track(value, owner, view, spans) for value in obj))
+        node._owner = owner
+        return node
+    return obj
+
+
+class _SpanRecorder(object):
+    def __init__(self):
+        self.spans = {}
+
+    def parse(self, parse, stream, context, path):
+        start = stream.tell()
+        obj = parse(stream, context, path)
+        # the object is kept alongside so that its id stays unique until the tree is converted
+        self.spans[id(obj)] = (obj, start, stream.tell())
+        return obj
+
+    def build(self, build, obj, stream, context, path):
+        return build(obj, stream, context, path)
+
+
+class _CleanCopier(object):
+    def parse(self, parse, stream, context, path):
+        return parse(stream, context, path)
+
+    def build(self, build, obj, stream, context, path):
+        source = getattr(obj, "_source", None) if isinstance(obj, TrackedContainer) else None
+        if source is None:
+            return build(obj, stream, context, path)
+        stream.write(source)
+
+
+def parse(data, con=MP4):
+    """
+    Parse data with con, all the top level boxes by default, into tracked containers that keep a view of
+    the bytes of each box
+    """
+    view = memoryview(data)
+    recorder = _SpanRecorder()
+    with box_hook(recorder):
+        obj = con.parse(data)
+    return _track(obj, None, view, recorder.spans)
+
+
+def build(obj, con=MP4):
+    """
+    Build obj with con, copying the original bytes of the boxes that have not been modified
+    """
+    stream = io.BytesIO()
+    with box_hook(_CleanCopier()):
+        con.build_stream(obj, stream)
+    return stream.getvalue()
+
+
+def is_modified(box):
+    """
+    Whether box will be encoded again by build, True for anything that did not come from parse
+    """
+    return not isinstance(box, TrackedContainer) or box._source is None
+
+
+def original_bytes(box):
+    """
+    The bytes box was parsed from, None if it has been modified since
+    """
+    return box._source if isinstance(box, TrackedContainer) else None
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Fragmented to progressive MP4
+
+   The track runs of the segments are resolved into arrays, only the box headers and the trun payloads are
+   read. The output is the ftyp of the init segment, a moov with sample tables built from the arrays and an
+   mdat with a chunk per track run, copied from the segments a byte range at a time.
+"""
+import logging
+import struct
+from array import array
+
+from pymp4 import writer
+from pymp4.exceptions import BoxNotFound
+from pymp4.index import iter_boxes, read_payload
+from pymp4.samples import S32, SAMPLE_IS_NON_SYNC, U8, U32, U64, iter_track_runs, read_tracks, read_trex
+
+log = logging.getLogger(__name__)
+
+
+class _Track(object):
+    """
+    Sample table of a track as it is collected from the track runs
+    """
+    __slots__ = ("track_ID", "timescale", "sizes", "durations", "cts_offsets", "sync", "start", "end",
+                 "chunk_samples", "chunk_descriptions", "chunk_offsets")
+
+    def __init__(self, track_ID, timescale):
+        self.track_ID = track_ID
+        self.timescale = timescale
+        self.sizes = array(U32)
+        self.durations = array(U32)
+        self.cts_offsets = None
+        self.sync = array(U8)
+        self.start = self.end = None
+        self.chunk_samples = array(U32)
+        self.chunk_descriptions = array(U32)
+        self.chunk_offsets = array(U64)
+
+    def add(self, run):
+        if self.end is None:
+            self.start = self.end = run.decode_time
+        elif run.decode_time > self.end and len(self.durations):
+            # a gap in the decode times, the previous sample lasts until the run starts
+            self.durations[-1] += run.decode_time - self.end
+            self.end = run.decode_time
+        elif run.decode_time < self.end:
+            log.warning("track %d: run at %d overlaps the previous one ending at %d", self.track_ID,
+                        run.decode_time, self.end)
+
+        count = len(run.sizes)
+        if run.cts_offsets is not None and self.cts_offsets is None:
+            self.cts_offsets = array(S32, bytes(4 * len(self.sizes)))
+        if self.cts_offsets is not None:
+            self.cts_offsets.extend(run.cts_offsets if run.cts_offsets is not None else array(S32, bytes(4 * count)))
+        self.sizes.extend(run.sizes)
+        self.durations.extend(run.durations)
+        self.sync.extend(array(U8, (0 if flags & SAMPLE_IS_NON_SYNC else 1 for flags in run.flags)))
+        self.end += sum(run.durations)
+        self.chunk_samples.append(count)
+        self.chunk_descriptions.append(run.sample_description_index)
+
+    @property
+    def duration(self):
+        return 0 if self.end is None else self.end - self.start
+
+    def stsc(self):
+        first_chunks, samples_per_chunk, descriptions = array(U32), array(U32), array(U32)
+        for chunk, (samples, description) in enumerate(zip(self.chunk_samples, self.chunk_descriptions)):
+            if not first_chunks or samples != samples_per_chunk[-1] or description != descriptions[-1]:
+                first_chunks.append(chunk + 1)
+                samples_per_chunk.append(samples)
+                descriptions.append(description)
+        return writer.stsc(first_chunks, samples_per_chunk, descriptions)
+
+    def stbl(self, stsd):
+        children = [stsd, writer.stts(self.durations)]
+        if self.cts_offsets is not None:
+            children.append(writer.ctts(self.cts_offsets))
+        if not all(self.sync):
+            children.append(writer.stss(self.sync))
+        children += [self.stsc(), writer.stsz(self.sizes), writer.stco(self.chunk_offsets)]
+        return writer.box(b"stbl", *children)
+
+
+def _with_duration(data, header, offsets, duration):
+    # patch the duration of a mvhd, tkhd or mdhd box, a version 0 box that can not hold it gets all ones
+    data = bytearray(data)
+    pos = header.header_size
+    if data[pos] == 1:
+        struct.pack_into(">Q", data, pos + offsets[1], duration)
+    else:
+        struct.pack_into(">I", data, pos + offsets[0], min(duration, writer.MAX_U32))
+    return bytes(data)
+
+
+class _Movie(object):
+    def __init__(self, fd):
+        self.fd = fd
+        self.ftyp = self.moov = None
+        for header in iter_boxes(fd):
+            if header.type == b"ftyp" and self.ftyp is None:
+                self.ftyp = header
+            elif header.type == b"moov":
+                self.moov = header
+        if self.moov is None:
+            raise BoxNotFound("could not find box of type: {}".format(b"moov"))
+        self.defaults = read_trex(fd, self.moov)
+        traks = [header for header in iter_boxes(fd, self.moov.data_offset, self.moov.end, 1)
+                 if header.type == b"trak"]
+        self.tracks = {}
+        self.traks = {}
+        for trak, table in zip(traks, read_tracks(fd, self.moov)):
+            self.tracks[table.track_ID] = self.traks[trak.offset] = _Track(table.track_ID, table.timescale)
+        mvhd = next((h for h in iter_boxes(fd, self.moov.data_offset, self.moov.end, 1) if h.type == b"mvhd"), None)
+        if mvhd is None:
+            raise BoxNotFound("could not find box of type: {}".format(b"mvhd"))
+        payload = read_payload(fd, mvhd)
+        self.timescale, = struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)
+
+    def movie_duration(self, track):
+        return track.duration * self.timescale // track.timescale if track.timescale else 0
+
+    def _replace(self, header, path):
+        fd = self.fd
+        if header.type == b"mvex":
+            return b""
+        if header.type == b"mvhd":
+            duration = max([self.movie_duration(track) for track in self.tracks.values()] or [0])
+            return _with_duration(_read(fd, header), header, (16, 24), duration)
+        track = self.traks.get(path[1].offset) if len(path) > 1 else None
+        if track is None:
+            return None
+        if header.type == b"tkhd":
+            return _with_duration(_read(fd, header), header, (20, 28), self.movie_duration(track))
+        if header.type == b"mdhd":
+            return _with_duration(_read(fd, header), header, (16, 24), track.duration)
+        if header.type == b"stbl":
+            stsd = b"".join(_read(fd, child) for child in iter_boxes(fd, header.data_offset, header.end,
+                                                                     header.depth + 1) if child.type == b"stsd")
+            return track.stbl(stsd)
+        return None
+
+    def build_moov(self):
+        return writer.rewrite(self.fd, self.moov, self._replace)
+
+
+def _read(fd, header):
+    fd.seek(header.offset)
+    return fd.read(header.size)
+
+
+def flatten(init, segments=(), output=None):
+    """
+    Write a progressive MP4 from an init segment and its media segments, all of them paths or file objects
+
+    When segments is empty the fragments are read from init, for a fragmented file that is in one piece.
+
+    :returns: the number of samples of each track, keyed by track_ID
+    """
+    sources = [init] + list(segments)
+    with writer.opened(init, "rb") as fd:
+        movie = _Movie(fd)
+        # the chunks of the output, in order: source index, offset in the source and size
+        chunk_sources, chunk_offsets, chunk_sizes, chunk_tracks = array(U32), array(U64), array(U64), []
+        decode_times = {}
+        for index, source in enumerate(sources):
+            with writer.opened(source, "rb") as src:
+                for run in iter_track_runs(src, movie.defaults, decode_times=decode_times):
+                    track = movie.tracks.get(run.track_ID)
+                    if track is None:
+                        log.warning("skipping the samples of track %d, it is not in the moov", run.track_ID)
+                        continue
+                    track.add(run)
+                    chunk_sources.append(index)
+                    chunk_offsets.append(run.offset)
+                    chunk_sizes.append(sum(run.sizes))
+                    chunk_tracks.append(track)
+
+        ftyp = _read(fd, movie.ftyp) if movie.ftyp is not None else b""
+        size = sum(chunk_sizes)
+        mdat_header = writer.box_header(b"mdat", size)
+
+        # the chunk offsets depend on the size of the moov, which only changes if stco turns into co64
+        moov = b""
+        while True:
+            position = len(ftyp) + len(moov) + len(mdat_header)
+            for track in movie.tracks.values():
+                del track.chunk_offsets[:]
+            for track, chunk_size in zip(chunk_tracks, chunk_sizes):
+                track.chunk_offsets.append(position)
+                position += chunk_size
+            previous, moov = moov, movie.build_moov()
+            if len(moov) == len(previous):
+                break
+
+        with writer.opened(output, "wb") as out:
+            out.write(ftyp)
+            out.write(moov)
+            out.write(mdat_header)
+            _copy_chunks(sources, out, chunk_sources, chunk_offsets, chunk_sizes)
+
+    return dict((track_ID, len(track.sizes)) for track_ID, track in movie.tracks.items())
+
+
+def _copy_chunks(sources, out, chunk_sources, chunk_offsets, chunk_sizes):
+    # the chunks are in the order of the sources, adjacent chunks are copied as one range
+    chunk = 0
+    while chunk < len(chunk_sizes):
+        index = chunk_sources[chunk]
+        with writer.opened(sources[index], "rb") as src:
+            offset, size = chunk_offsets[chunk], chunk_sizes[chunk]
+            chunk += 1
+            while chunk < len(chunk_sizes) and chunk_sources[chunk] == index:
+                if chunk_offsets[chunk] == offset + size:
+                    size += chunk_sizes[chunk]
+                else:
+                    writer.copy_range(src, out, offset, size)
+                    offset, size = chunk_offsets[chunk], chunk_sizes[chunk]
+                chunk += 1
+            writer.copy_range(src, out, offset, size)
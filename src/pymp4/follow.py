@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Following growing files
+
+   A Follower keeps a file that is still being written open and remembers where the last complete top
+   level box ended. Each poll only reads the headers of the boxes appended since then, a box is handed out
+   once all of it has been written, and a box that is still being written is looked at again on the next
+   poll. The cost of a poll depends on what was appended, not on the length of the recording.
+
+       >>> with Follower("live.mp4") as follower:
+       ...     for header in follower.follow(types=[b"moof", b"emsg"]):
+       ...         box = follower.parse(header)
+"""
+import io
+import logging
+import struct
+import time
+
+from pymp4.exceptions import MalformedBox
+from pymp4.index import BoxHeader
+
+log = logging.getLogger(__name__)
+
+_size_type = struct.Struct(">I4s")
+_largesize = struct.Struct(">Q")
+
+
+class Follower(object):
+    """
+    Complete top level boxes appended to a file, path or file object, starting at offset
+    """
+    def __init__(self, file, offset=0):
+        self._owned = not hasattr(file, "read")
+        self.fd = open(file, "rb") if self._owned else file
+        self.offset = offset
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owned:
+            self.fd.close()
+
+    def _header(self, offset):
+        # the header of the box at offset if the whole box has been written, None if it has not
+        self.fd.seek(offset)
+        data = self.fd.read(16)
+        if len(data) < 8:
+            return None
+        size, type_ = _size_type.unpack_from(data)
+        header_size = 8
+        if size == 1:
+            if len(data) < 16:
+                return None
+            size, = _largesize.unpack_from(data, 8)
+            header_size = 16
+        elif size == 0:
+            # runs to the end of the file, which is not known until the file stops growing
+            return None
+        if size < header_size:
+            raise MalformedBox("invalid size {} for box {!r} at offset {}".format(size, type_, offset))
+        if offset + size > self.size:
+            return None
+        return BoxHeader(type_, offset, size, header_size, 0)
+
+    def poll(self):
+        """
+        Headers of the boxes that were completed since the last poll
+        """
+        size = self.fd.seek(0, io.SEEK_END)
+        if size < self.size or size < self.offset:
+            log.warning("the file shrank from %d to %d bytes, following it from the start", self.size, size)
+            self.offset = 0
+        self.size = size
+        headers = []
+        while self.offset < size:
+            header = self._header(self.offset)
+            if header is None:
+                break
+            headers.append(header)
+            self.offset = header.end
+        return headers
+
+    def pending(self):
+        """
+        Number of bytes written after the last complete box, ie. of the box that is being written
+        """
+        return self.size - self.offset
+
+    def parse(self, header):
+        """
+        Parse a box with pymp4.parser.Box
+        """
+        from pymp4.parser import Box
+
+        self.fd.seek(header.offset)
+        return Box.parse(self.fd.read(header.size))
+
+    def follow(self, interval=1.0, timeout=None, types=None, sleep=time.sleep):
+        """
+        Yield the headers of the complete boxes as they are appended, polling every interval seconds
+
+        :param timeout: stop once no box has been completed for this many seconds, never by default
+        :param types: only yield the boxes of these types, the others are still stepped over
+        """
+        idle = 0.0
+        while True:
+            headers = self.poll()
+            for header in headers:
+                if types is None or header.type in types:
+                    yield header
+            if headers:
+                idle = 0.0
+            elif timeout is not None and idle >= timeout:
+                return
+            else:
+                sleep(interval)
+                idle += interval
+
+
+def follow(source, interval=1.0, timeout=None, types=None, offset=0):
+    """
+    Yield the headers of the complete top level boxes of source, a path or file object, as it grows
+    """
+    with Follower(source, offset) as follower:
+        for header in follower.follow(interval, timeout, types):
+            yield header
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   HDS bootstrap lookups
+
+   The segment (asrt) and fragment (afrt) run tables of an abst are kept run-length encoded in arrays, the
+   fragment covering a time, or the segment holding a fragment, are found by bisecting the runs and the
+   fragments are only expanded when they are iterated.
+"""
+import logging
+import struct
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from pymp4.exceptions import BoxNotFound, MalformedBox
+from pymp4.samples import U32, U64, be_array
+
+log = logging.getLogger(__name__)
+
+# discontinuity indicators of the afrt entries with a zero duration
+END_OF_PRESENTATION = 0
+FRAGMENT_DISCONTINUITY = 1
+TIMESTAMP_DISCONTINUITY = 2
+
+Fragment = namedtuple("Fragment", "segment fragment timestamp duration")
+
+_size_type = struct.Struct(">I4s")
+_fragment_run = struct.Struct(">IQI")
+
+
+class BootstrapIndex(object):
+    """
+    Lookup index over the run tables of one quality of an abst
+
+    Fragment timestamps and durations are in the time_scale of the afrt, the lookups by time expect them to
+    increase from one run to the next.
+
+    :param segment_runs: (first_segment, fragments_per_segment) of each asrt entry
+    :param fragment_runs: (first_fragment, first_fragment_timestamp, fragment_duration, discontinuity) of each
+                          afrt entry, discontinuity is None unless the duration is 0
+    :param current_media_time: in the abst time_scale, gives the number of fragments of the last run
+    """
+    def __init__(self, time_scale, segment_runs, fragment_runs, current_media_time=0, abst_time_scale=None):
+        self.time_scale = time_scale
+        self.current_media_time = current_media_time
+
+        self.first_segments, self.fragments_per_segment = array(U32), array(U32)
+        for first_segment, fragments_per_segment in segment_runs:
+            self.first_segments.append(first_segment)
+            self.fragments_per_segment.append(fragments_per_segment)
+
+        # runs of fragments, the discontinuity entries only end the run before them
+        self.first_fragments, self.timestamps = array(U32), array(U64)
+        self.durations, self.ends = array(U32), array(U64)
+        self.discontinuities = []
+        ended = False
+        for first_fragment, timestamp, duration, discontinuity in fragment_runs:
+            if len(self.first_fragments) > len(self.ends):
+                self.ends.append(first_fragment)
+            if duration == 0:
+                self.discontinuities.append((first_fragment, discontinuity))
+                if discontinuity == END_OF_PRESENTATION:
+                    ended = True
+                    break
+                continue
+            self.first_fragments.append(first_fragment)
+            self.timestamps.append(timestamp)
+            self.durations.append(duration)
+        if len(self.first_fragments) > len(self.ends):
+            self.ends.append(self.first_fragments[-1] + self._last_run_count(abst_time_scale or time_scale))
+        self.ended = ended
+
+        # the first fragment of each segment run, as the fragments are numbered across the segments
+        self.segment_fragments = array(U64)
+        fragment = self.first_fragments[0] if self.first_fragments else 1
+        for i, (first_segment, fragments_per_segment) in enumerate(zip(self.first_segments,
+                                                                         self.fragments_per_segment)):
+            self.segment_fragments.append(fragment)
+            if i + 1 < len(self.first_segments):
+                fragment += (self.first_segments[i + 1] - first_segment) * fragments_per_segment
+
+    def _last_run_count(self, abst_time_scale):
+        # the last run has as many fragments as fit before the current media time, and at least one
+        if not self.current_media_time or not abst_time_scale:
+            return 1
+        end = self.current_media_time * self.time_scale // abst_time_scale
+        return max(1, -(-(end - self.timestamps[-1]) // self.durations[-1]))
+
+    def __len__(self):
+        return sum(end - first for first, end in zip(self.first_fragments, self.ends))
+
+    def __iter__(self):
+        return self.fragments()
+
+    def __repr__(self):
+        return "<BootstrapIndex runs={} fragments={}>".format(len(self.first_fragments), len(self))
+
+    def segment(self, fragment):
+        """
+        Number of the segment that holds fragment
+        """
+        run = bisect_right(self.segment_fragments, fragment) - 1
+        if run < 0 or not self.fragments_per_segment[run]:
+            return self.first_segments[0] if self.first_segments else 1
+        return self.first_segments[run] + (fragment - self.segment_fragments[run]) // self.fragments_per_segment[run]
+
+    def _run(self, fragment):
+        run = bisect_right(self.first_fragments, fragment) - 1
+        if run < 0 or fragment >= self.ends[run]:
+            return None
+        return run
+
+    def _fragment(self, run, fragment):
+        timestamp = self.timestamps[run] + (fragment - self.first_fragments[run]) * self.durations[run]
+        return Fragment(self.segment(fragment), fragment, timestamp, self.durations[run])
+
+    def __contains__(self, fragment):
+        return self._run(fragment) is not None
+
+    def fragment(self, fragment):
+        """
+        The Fragment with the given number, a KeyError if the fragment runs do not have it
+        """
+        run = self._run(fragment)
+        if run is None:
+            raise KeyError("no fragment {}".format(fragment))
+        return self._fragment(run, fragment)
+
+    def at(self, timestamp):
+        """
+        The Fragment playing at timestamp, the last one before it when timestamp falls in a gap, None before
+        the first fragment
+        """
+        run = bisect_right(self.timestamps, timestamp) - 1
+        if run < 0:
+            return None
+        count = self.ends[run] - self.first_fragments[run]
+        index = min((timestamp - self.timestamps[run]) // self.durations[run], count - 1)
+        return self._fragment(run, self.first_fragments[run] + index)
+
+    @property
+    def first(self):
+        return self._fragment(0, self.first_fragments[0]) if self.first_fragments else None
+
+    @property
+    def last(self):
+        return self._fragment(len(self.ends) - 1, self.ends[-1] - 1) if self.ends else None
+
+    def fragments(self, start=None, end=None):
+        """
+        Yield the Fragments with a timestamp in [start, end), expanding the runs as it goes
+        """
+        run = 0 if start is None else max(bisect_right(self.timestamps, start) - 1, 0)
+        for run in range(run, len(self.first_fragments)):
+            first = self.first_fragments[run]
+            skip = 0
+            if start is not None and self.timestamps[run] < start:
+                skip = -(-(start - self.timestamps[run]) // self.durations[run])
+            for fragment in range(first + skip, self.ends[run]):
+                item = self._fragment(run, fragment)
+                if end is not None and item.timestamp >= end:
+                    return
+                yield item
+
+    @staticmethod
+    def url(base, fragment):
+        """
+        URL of a fragment, base being the server base URL followed by the movie identifier and the quality
+        """
+        return "{}Seg{}-Frag{}".format(base, fragment.segment, fragment.fragment)
+
+    @classmethod
+    def from_box(cls, abst, quality=None):
+        """
+        Index of an abst box parsed with pymp4.parser.Box
+        """
+        asrt = _select(abst.segment_run_table, quality)
+        afrt = _select(abst.fragment_run_table, quality)
+        return cls(afrt.time_scale,
+                   [(e.first_segment, e.fragments_per_segment) for e in asrt.segment_run_enteries],
+                   [(e.first_fragment, e.first_fragment_timestamp, e.fragment_duration, e.discontinuity)
+                    for e in afrt.fragment_run_enteries],
+                   abst.current_media_time, abst.time_scale)
+
+    @classmethod
+    def parse(cls, data, quality=None):
+        """
+        Index of the abst box in data, decoded without construct
+        """
+        return cls(*decode_abst(data, quality))
+
+
+def _select(tables, quality):
+    # the run table for quality, a table without qualities applies to all of them
+    for table in tables:
+        qualities = [q.decode("utf8") if isinstance(q, bytes) else q for q in table.quality_entry_table]
+        if quality is None or not qualities or quality in qualities:
+            return table
+    raise BoxNotFound("no run table for quality {!r}".format(quality))
+
+
+def _cstring(data, pos):
+    end = data.index(b"\x00", pos)
+    return bytes(data[pos:end]), end + 1
+
+
+def _qualities(data, pos):
+    count = data[pos]
+    pos += 1
+    qualities = []
+    for _ in range(count):
+        quality, pos = _cstring(data, pos)
+        qualities.append(quality.decode("utf8"))
+    return qualities, pos
+
+
+def _boxes(data, pos):
+    count = data[pos]
+    pos += 1
+    boxes = []
+    for _ in range(count):
+        size, type_ = _size_type.unpack_from(data, pos)
+        if size < 8 or pos + size > len(data):
+            raise MalformedBox("invalid size {} for box {!r} at offset {}".format(size, type_, pos))
+        boxes.append((type_, data[pos + 8:pos + size]))
+        pos += size
+    return boxes, pos
+
+
+def decode_asrt(payload):
+    """
+    :returns: the qualities and (first_segment, fragments_per_segment) pairs of an asrt payload
+    """
+    qualities, pos = _qualities(payload, 4)
+    count, = struct.unpack_from(">I", payload, pos)
+    values = be_array(U32, payload, pos + 4, count * 2)
+    return qualities, list(zip(values[0::2], values[1::2]))
+
+
+def decode_afrt(payload):
+    """
+    :returns: the time_scale, the qualities and (first_fragment, timestamp, duration, discontinuity) tuples
+              of an afrt payload
+    """
+    time_scale, = struct.unpack_from(">I", payload, 4)
+    qualities, pos = _qualities(payload, 8)
+    count, = struct.unpack_from(">I", payload, pos)
+    pos += 4
+    entries = []
+    if len(payload) - pos == count * _fragment_run.size:
+        # no discontinuity entries, which add a byte, so the entries can be unpacked in one go
+        entries = [entry + (None,) for entry in _fragment_run.iter_unpack(payload[pos:])]
+        if all(entry[2] for entry in entries):
+            return time_scale, qualities, entries
+        entries = []
+    for _ in range(count):
+        first_fragment, timestamp, duration = _fragment_run.unpack_from(payload, pos)
+        pos += _fragment_run.size
+        discontinuity = None
+        if duration == 0:
+            discontinuity = payload[pos]
+            pos += 1
+        entries.append((first_fragment, timestamp, duration, discontinuity))
+    return time_scale, qualities, entries
+
+
+def decode_abst(data, quality=None):
+    """
+    BootstrapIndex arguments from the bytes of an abst box
+    """
+    size, type_ = _size_type.unpack_from(data)
+    if type_ != b"abst":
+        raise BoxNotFound("could not find box of type: {}".format(b"abst"))
+    header_size = 8
+    if size == 1:
+        size, = struct.unpack_from(">Q", data, 8)
+        header_size = 16
+    payload = bytes(data[header_size:size])
+    time_scale, current_media_time = struct.unpack_from(">IQ", payload, 9)
+    pos = 29
+    _, pos = _cstring(payload, pos)  # movie identifier
+    for _ in range(2):  # server and quality entries
+        _, pos = _qualities(payload, pos)
+    _, pos = _cstring(payload, pos)  # drm data
+    _, pos = _cstring(payload, pos)  # metadata
+    segment_tables, pos = _boxes(payload, pos)
+    fragment_tables, pos = _boxes(payload, pos)
+
+    asrt = afrt = None
+    for type_, table in segment_tables:
+        qualities, runs = decode_asrt(table)
+        if quality is None or not qualities or quality in qualities:
+            asrt = runs
+            break
+    for type_, table in fragment_tables:
+        fragment_time_scale, qualities, runs = decode_afrt(table)
+        if quality is None or not qualities or quality in qualities:
+            afrt = runs
+            break
+    if asrt is None or afrt is None:
+        raise BoxNotFound("no run table for quality {!r}".format(quality))
+    return fragment_time_scale, asrt, afrt, current_media_time, time_scale
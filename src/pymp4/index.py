@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import struct
+from collections import namedtuple
+
+from pymp4.exceptions import MalformedBox
+
+log = logging.getLogger(__name__)
+
+# boxes that hold nothing but other boxes, matches the ContainerBox entries in pymp4.parser.Box
+CONTAINER_BOXES = frozenset([
+    b"moov", b"moof", b"traf", b"mvex", b"trak", b"edts", b"mdia", b"minf", b"dinf",
+    b"stbl", b"schi", b"sinf", b"vttc", b"vttx",
+])
+
+_size_type = struct.Struct(">I4s")
+_largesize = struct.Struct(">Q")
+
+
+class BoxHeader(namedtuple("BoxHeader", "type offset size header_size depth")):
+    """
+    Location of a box in a file, the payload starts at `data_offset` and the box ends at `end`
+    """
+    __slots__ = ()
+
+    @property
+    def data_offset(self):
+        return self.offset + self.header_size
+
+    @property
+    def data_size(self):
+        return self.size - self.header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+def read_box_header(fd, offset, end=None, depth=0):
+    """
+    Read the header of the box starting at offset, returns None when there are no more boxes before end
+    """
+    fd.seek(offset)
+    data = fd.read(8)
+    if len(data) < 8:
+        if data and (end is None or offset + len(data) <= end):
+            raise MalformedBox("truncated box header at offset {}".format(offset))
+        return None
+    size, type_ = _size_type.unpack(data)
+    header_size = 8
+    if size == 1:
+        data = fd.read(8)
+        if len(data) < 8:
+            raise MalformedBox("truncated box header at offset {}".format(offset))
+        size, = _largesize.unpack(data)
+        header_size = 16
+    elif size == 0:
+        # the box extends to the end of the file (or enclosing box)
+        if end is None:
+            fd.seek(0, io.SEEK_END)
+            end = fd.tell()
+        size = end - offset
+    if size < header_size:
+        raise MalformedBox("invalid size {} for box {!r} at offset {}".format(size, type_, offset))
+    if end is not None and offset + size > end:
+        raise MalformedBox("box {!r} at offset {} overruns its parent".format(type_, offset))
+    return BoxHeader(type_, offset, size, header_size, depth)
+
+
+def iter_boxes(fd, offset=0, end=None, depth=0, recursive=False):
+    """
+    Walk the box headers between offset and end without decoding any payloads
+
+    When recursive is set the children of the container boxes are yielded straight after their parent.
+    """
+    while end is None or offset < end:
+        header = read_box_header(fd, offset, end, depth)
+        if header is None:
+            break
+        yield header
+        if recursive and header.type in CONTAINER_BOXES:
+            for child in iter_boxes(fd, header.data_offset, header.end, depth + 1, recursive):
+                yield child
+        offset = header.end
+
+
+def index_boxes(fd, offset=0, end=None):
+    """
+    Build a flat, depth first, index of every box in the file
+    """
+    return list(iter_boxes(fd, offset, end, recursive=True))
+
+
+def read_payload(fd, header):
+    fd.seek(header.data_offset)
+    return fd.read(header.data_size)
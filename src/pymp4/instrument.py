@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import time
+import tracemalloc as _tracemalloc
+from contextlib import contextmanager
+
+from pymp4.parser import box_hook
+
+log = logging.getLogger(__name__)
+
+
+class BoxStats(object):
+    __slots__ = ("count", "bytes", "time", "self_time", "allocated")
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.time = 0.0
+        self.self_time = 0.0
+        self.allocated = 0
+
+    def __repr__(self):
+        return "<BoxStats count={} bytes={} time={:.6f} self_time={:.6f} allocated={}>".format(
+            self.count, self.bytes, self.time, self.self_time, self.allocated)
+
+
+class BoxProfiler(object):
+    """
+    Box hook that records, per box type and operation, the number of calls, the bytes processed, the wall
+    time spent including and excluding the child boxes and, optionally, the net memory allocated
+    """
+    def __init__(self, tracemalloc=False):
+        self.tracemalloc = tracemalloc
+        self.stats = {}
+        self._children = []
+
+    def _record(self, op, type_, size, elapsed, allocated):
+        key = (op, type_)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = BoxStats()
+        child_time = self._children.pop()
+        stats.count += 1
+        stats.bytes += size
+        stats.time += elapsed
+        stats.self_time += elapsed - child_time
+        stats.allocated += allocated
+        if self._children:
+            self._children[-1] += elapsed
+
+    def _measure(self, op, func, stream, args, type_=None):
+        self._children.append(0.0)
+        memory = _tracemalloc.get_traced_memory()[0] if self.tracemalloc else 0
+        start_offset = stream.tell()
+        start = time.perf_counter()
+        try:
+            obj = func(*args)
+        except Exception:
+            self._children.pop()
+            raise
+        elapsed = time.perf_counter() - start
+        allocated = _tracemalloc.get_traced_memory()[0] - memory if self.tracemalloc else 0
+        if type_ is None:
+            type_ = obj.get("type") if isinstance(obj, dict) else None
+        self._record(op, type_, stream.tell() - start_offset, elapsed, allocated)
+        return obj
+
+    def parse(self, parse, stream, context, path):
+        return self._measure("parse", parse, stream, (stream, context, path))
+
+    def build(self, build, obj, stream, context, path):
+        type_ = obj.get("type") if isinstance(obj, dict) else None
+        return self._measure("build", build, stream, (obj, stream, context, path), type_)
+
+    def report(self, op="parse"):
+        """
+        Text table of the recorded stats for op, the most expensive box types first
+        """
+        lines = ["{:<6} {:>10} {:>14} {:>12} {:>12} {:>12}".format(
+            "type", "count", "bytes", "total ms", "self ms", "alloc KiB")]
+        rows = sorted(((type_, stats) for (op_, type_), stats in self.stats.items() if op_ == op),
+                      key=lambda row: row[1].self_time, reverse=True)
+        for type_, stats in rows:
+            name = type_.decode("ascii", "replace") if isinstance(type_, bytes) else str(type_)
+            lines.append("{:<6} {:>10} {:>14} {:>12.3f} {:>12.3f} {:>12.1f}".format(
+                name, stats.count, stats.bytes, stats.time * 1000, stats.self_time * 1000,
+                stats.allocated / 1024.0))
+        return "\n".join(lines)
+
+
+@contextmanager
+def tracing(enabled=True):
+    """
+    Trace memory allocations within the block, unless they are already being traced
+    """
+    started = False
+    if enabled and not _tracemalloc.is_tracing():
+        _tracemalloc.start()
+        started = True
+    try:
+        yield
+    finally:
+        if started:
+            _tracemalloc.stop()
+
+
+@contextmanager
+def profile_boxes(tracemalloc=False):
+    """
+    Profile the boxes parsed and built by the current thread within the block
+
+        >>> with profile_boxes() as profiler:
+        ...     Box.parse(data)
+        >>> print(profiler.report())
+    """
+    profiler = BoxProfiler(tracemalloc)
+    with tracing(tracemalloc):
+        with box_hook(profiler):
+            yield profiler
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   NAL unit access for AVC and HEVC tracks
+
+   The NAL units are returned as memoryview slices of the source, so when the source is an mmap or a bytes
+   object nothing is copied.
+"""
+import logging
+import struct
+from collections import namedtuple
+
+from pymp4.exceptions import BoxNotFound, MalformedBox
+from pymp4.index import iter_boxes
+
+log = logging.getLogger(__name__)
+
+AVC = "avc"
+HEVC = "hevc"
+
+AVC_IDR = 5
+AVC_SEI = 6
+AVC_SPS = 7
+AVC_PPS = 8
+AVC_AUD = 9
+
+HEVC_BLA_W_LP = 16
+HEVC_RSV_IRAP_23 = 23
+HEVC_VPS = 32
+HEVC_SPS = 33
+HEVC_PPS = 34
+HEVC_AUD = 35
+
+AVC_FORMATS = frozenset([b"avc1", b"avc3"])
+HEVC_FORMATS = frozenset([b"hvc1", b"hev1"])
+
+_length_formats = {1: ">B", 2: ">H", 4: ">I"}
+
+NALUnit = namedtuple("NALUnit", "sample offset type data")
+NALConfig = namedtuple("NALConfig", "codec length_size parameter_sets")
+
+
+def nal_type(codec, header):
+    """
+    NAL unit type from the first byte of the NAL unit header
+    """
+    if codec == HEVC:
+        return (header >> 1) & 0x3f
+    return header & 0x1f
+
+
+def is_random_access_type(codec, type_):
+    """
+    IDR for AVC, IRAP (BLA, IDR and CRA) for HEVC
+    """
+    if codec == HEVC:
+        return HEVC_BLA_W_LP <= type_ <= HEVC_RSV_IRAP_23
+    return type_ == AVC_IDR
+
+
+def iter_nal_units(data, length_size=4, codec=AVC, offset=0, end=None):
+    """
+    Split length prefixed NAL units, yielding (offset, type, memoryview) tuples
+
+    :param data: buffer holding the samples, a memoryview of an mmap avoids any copies
+    """
+    view = data if isinstance(data, memoryview) else memoryview(data)
+    end = len(view) if end is None else end
+    length_format = _length_formats.get(length_size)
+    if length_format is None:
+        raise ValueError("unsupported NAL unit length size {}".format(length_size))
+    hevc = codec == HEVC
+    while offset < end:
+        start = offset + length_size
+        if start > end:
+            raise MalformedBox("truncated NAL unit length at offset {}".format(offset))
+        length, = struct.unpack_from(length_format, view, offset)
+        if length == 0 or start + length > end:
+            raise MalformedBox("invalid NAL unit length {} at offset {}".format(length, offset))
+        header = view[start]
+        yield start, ((header >> 1) & 0x3f) if hevc else (header & 0x1f), view[start:start + length]
+        offset = start + length
+
+
+def iter_nal_types(data, length_size=4, codec=AVC, offset=0, end=None):
+    """
+    Like iter_nal_units but only yields the (offset, type) of each NAL unit, the payloads are not touched
+    """
+    for offset, type_, nal in iter_nal_units(data, length_size, codec, offset, end):
+        nal.release()
+        yield offset, type_
+
+
+def iter_sample_nal_units(data, table, length_size=4, codec=AVC, first=0, last=None):
+    """
+    Yield a NALUnit for every NAL unit of the samples [first, last) of a SampleTable
+
+    :param data: the whole file as a buffer, typically an mmap
+    """
+    view = data if isinstance(data, memoryview) else memoryview(data)
+    last = len(table) if last is None else last
+    offsets, sizes = table.offsets, table.sizes
+    for sample in range(first, last):
+        offset = offsets[sample]
+        for nal_offset, type_, nal in iter_nal_units(view, length_size, codec, offset, offset + sizes[sample]):
+            yield NALUnit(sample, nal_offset, type_, nal)
+
+
+def is_random_access_sample(data, offset, size, length_size=4, codec=AVC):
+    """
+    Check whether the sample at offset starts an IDR (AVC) or IRAP (HEVC) picture by reading the NAL
+    headers up to the first slice
+    """
+    for _, type_ in iter_nal_types(data, length_size, codec, offset, offset + size):
+        if is_random_access_type(codec, type_):
+            return True
+        if (codec == AVC and type_ <= AVC_IDR) or (codec == HEVC and type_ < HEVC_VPS):
+            # the first slice of the picture is not a random access one
+            return False
+    return False
+
+
+def random_access_samples(data, table, length_size=4, codec=AVC, trust_sync=True):
+    """
+    Indexes of the IDR/IRAP samples of a track
+
+    With trust_sync the sync sample table is used when the track has one and nothing is read, otherwise
+    only the NAL headers of each sample are scanned.
+    """
+    if trust_sync and table.sync is not None:
+        return list(table.sync_samples())
+    view = data if isinstance(data, memoryview) else memoryview(data)
+    offsets, sizes = table.offsets, table.sizes
+    return [sample for sample in range(len(table))
+            if is_random_access_sample(view, offsets[sample], sizes[sample], length_size, codec)]
+
+
+def nal_config(fd, trak):
+    """
+    Codec, NAL unit length size and parameter sets of the first sample entry of the trak box header
+    """
+    from pymp4.parser import Box
+
+    for header in iter_boxes(fd, trak.data_offset, trak.end, trak.depth + 1, recursive=True):
+        if header.type == b"stsd":
+            fd.seek(header.offset)
+            stsd = Box.parse(fd.read(header.size))
+            break
+    else:
+        raise BoxNotFound("could not find box of type: {}".format(b"stsd"))
+
+    for entry in stsd.entries:
+        avc_data = entry.get("avc_data")
+        if avc_data is None:
+            continue
+        if avc_data.type == b"avcC":
+            return NALConfig(AVC, avc_data.nal_unit_length_field + 1, list(avc_data.sps) + list(avc_data.pps))
+        if avc_data.type == b"hvcC":
+            parameter_sets = [nal for array in avc_data.arrays for nal in array.nal_units]
+            return NALConfig(HEVC, avc_data.nalu_length_size + 1, parameter_sets)
+    raise BoxNotFound("could not find an avcC or hvcC configuration")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Compact box objects
+
+   A construct Container is a dict plus a list of its keys, which adds up when a process holds thousands
+   of parsed init segments. This module generates a class with __slots__ for every box type in the Box
+   switch, named after its definition in pymp4.parser (TrackHeaderBox, TrackRunBox, ...), along with
+   slotted records for the nested structures. from_container and to_container convert between the two
+   forms.
+"""
+import logging
+
+from construct import Container, LazyBound, ListContainer, Struct, Switch
+
+from pymp4 import parser
+
+log = logging.getLogger(__name__)
+
+# names for the box types that share the generic ContainerBox definition
+CONTAINER_NAMES = {
+    b"moov": "MovieBox",
+    b"moof": "MovieFragmentBox",
+    b"traf": "TrackFragmentBox",
+    b"mvex": "MovieExtendsBox",
+    b"trak": "TrackBox",
+    b"edts": "EditBox",
+    b"mdia": "MediaBox",
+    b"minf": "MediaInformationBox",
+    b"dinf": "DataInformationBox",
+    b"stbl": "SampleTableBox",
+    b"schi": "SchemeInformationBox",
+    b"vttc": "VTTCueBox",
+    b"vttx": "VTTEmptyCueBox",
+}
+
+_BOX_KEYS = ("offset", "type", "end")
+
+
+class Node(object):
+    """
+    Base class of the generated box and record classes, unset fields are left out when converting back
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, **kw):
+        for key, value in kw.items():
+            setattr(self, key, value)
+
+    def items(self):
+        for field in self.fields:
+            try:
+                yield field, getattr(self, field)
+            except AttributeError:
+                pass
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.fields and hasattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, Node):
+            return type(self) is type(other) and list(self.items()) == list(other.items())
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join("{}={!r}".format(k, v) for k, v in self.items()))
+
+    def to_container(self):
+        return to_container(self)
+
+
+class BoxNode(Node):
+    __slots__ = ()
+    box_type = None
+
+
+class RecordNode(Node):
+    __slots__ = ()
+
+
+def _field_names(con):
+    while isinstance(con, LazyBound):
+        con = con.subconfunc(Container())
+    if isinstance(con, Struct):
+        names = []
+        for sc in con.subcons:
+            if sc.flagembedded:
+                for name in _field_names(_unwrap(sc)):
+                    if name not in names:
+                        names.append(name)
+            elif sc.name is not None:
+                names.append(sc.name)
+        return names
+    if isinstance(con, Switch):
+        names = []
+        cases = list(con.cases.values())
+        if con.default is not Switch.NoDefault:
+            cases.append(con.default)
+        for case in cases:
+            for name in _field_names(case):
+                if name not in names:
+                    names.append(name)
+        return names
+    if hasattr(con, "subcon"):
+        return _field_names(con.subcon)
+    return []
+
+
+def _unwrap(con):
+    while not isinstance(con, (Struct, Switch, LazyBound)) and hasattr(con, "subcon"):
+        con = con.subcon
+    return con
+
+
+def _definition_names():
+    names = {}
+    for name, value in vars(parser).items():
+        if name[:1].isupper() and name.endswith("Box") and id(value) not in names:
+            names[id(value)] = name
+    return names
+
+
+def _make_class(name, base, fields, box_type=None):
+    attrs = dict(__slots__=tuple(fields), fields=tuple(fields))
+    if box_type is not None:
+        attrs["box_type"] = box_type
+    attrs["__module__"] = __name__
+    return type(name, (base,), attrs)
+
+
+def _box_switch():
+    for sc in parser.Box.subcon.subcon.subcons:
+        if sc.flagembedded:
+            return _unwrap(sc)
+    raise ValueError("could not find the Box switch")
+
+
+BOX_CLASSES = {}
+_records = {}
+# box classes for the boxes whose fields are not all known to the class of their type, by (type, fields)
+_extended = {}
+
+
+def _generate():
+    switch = _box_switch()
+    definitions = _definition_names()
+    for box_type, con in switch.cases.items():
+        name = CONTAINER_NAMES.get(box_type) or definitions.get(id(con)) or \
+            "Box_" + box_type.decode("ascii").strip()
+        fields = ["offset", "type"] + [f for f in _field_names(con) if f not in _BOX_KEYS] + ["end"]
+        BOX_CLASSES[box_type] = _make_class(name, BoxNode, fields, box_type)
+    raw_fields = ["offset", "type"] + [f for f in _field_names(switch.default) if f not in _BOX_KEYS] + ["end"]
+    BOX_CLASSES[None] = _make_class("RawBox", BoxNode, raw_fields)
+
+
+_generate()
+globals().update((cls.__name__, cls) for cls in BOX_CLASSES.values())
+RawBox = BOX_CLASSES[None]
+
+
+def record_class(keys):
+    """
+    Slotted record class for a nested structure with the given keys
+    """
+    keys = tuple(keys)
+    cls = _records.get(keys)
+    if cls is None:
+        cls = _records[keys] = _make_class("Record", RecordNode, keys)
+    return cls
+
+
+def _extended_class(base, box_type, keys):
+    key = (box_type, tuple(keys))
+    cls = _extended.get(key)
+    if cls is None:
+        cls = _extended[key] = _make_class(base.__name__, BoxNode, keys, box_type)
+    return cls
+
+
+def _is_box(container):
+    return "type" in container and "offset" in container and "end" in container
+
+
+def from_container(obj):
+    """
+    Convert a parsed Container (or a list of them) to nodes, recursively
+    """
+    if isinstance(obj, Container):
+        keys = list(obj.keys())
+        cls = None
+        if _is_box(obj):
+            cls = BOX_CLASSES.get(obj["type"], BOX_CLASSES[None])
+            if not set(keys).issubset(cls.fields):
+                cls = _extended_class(cls, obj["type"], keys)
+        if cls is None:
+            cls = record_class(keys)
+        node = cls.__new__(cls)
+        for key in keys:
+            setattr(node, key, from_container(obj[key]))
+        return node
+    if isinstance(obj, list):
+        return [from_container(v) for v in obj]
+    return obj
+
+
+def to_container(obj):
+    """
+    Convert nodes (or a list of them) back to construct Containers, recursively
+    """
+    if isinstance(obj, Node):
+        return Container((k, to_container(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return ListContainer(to_container(v) for v in obj)
+    return obj
+
+
+def parse(data):
+    """
+    Parse a single box to a node
+    """
+    return from_container(parser.Box.parse(data))
+
+
+def build(node):
+    return parser.Box.build(to_container(node))
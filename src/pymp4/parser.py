@@ -15,6 +15,9 @@
    limitations under the License.
 """
 import logging
+import struct
+import threading
+from contextlib import contextmanager
 from uuid import UUID
 
 from construct import *
@@ -25,6 +28,9 @@ log = logging.getLogger(__name__)
 
 UNITY_MATRIX = [0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000]
 
+# the box hooks active in each thread, see box_hook
+_local = threading.local()
+
 
 class PrefixedIncludingSize(Subconstruct):
     __slots__ = ["name", "lengthfield", "subcon"]
@@ -80,6 +86,144 @@ class PrefixedIncludingSize(Subconstruct):
         return self.lengthfield._sizeof(context, path) + self.subcon._sizeof(context, path)
 
 
+class Restreamed(construct.core.Restreamed):
+    """
+    Restreamed with a new wrapper stream for every parse and build, construct shares a single wrapper
+    stream between all the calls which breaks parsing in more than one thread at a time
+    """
+    def _restream(self, stream):
+        s = self.stream2
+        return RestreamedBytesIO(stream, s.encoder, s.encoderunit, s.decoder, s.decoderunit)
+
+    def _parse(self, stream, context, path):
+        stream2 = self._restream(stream)
+        obj = self.subcon._parse(stream2, context, path)
+        stream2.close()
+        return obj
+
+    def _build(self, obj, stream, context, path):
+        stream2 = self._restream(stream)
+        buildret = self.subcon._build(obj, stream2, context, path)
+        stream2.close()
+        return buildret
+
+
+def Bitwise(subcon):
+    return Restreamed(subcon, bits2bytes, 8, bytes2bits, 1, lambda n: n // 8)
+
+
+def BitStruct(*subcons):
+    return Bitwise(Struct(*subcons))
+
+
+def EmbeddedBitStruct(*subcons):
+    return Bitwise(Embedded(Struct(*subcons)))
+
+
+class BudgetExceeded(ExplicitError):
+    """
+    Parsing stopped because a count does not fit in its box, or a limit of the active ParseBudget was reached
+
+    It is an ExplicitError so that the constructs that try alternatives, such as GreedyRange and Select, do
+    not take it for the end of their input and carry on.
+    """
+
+
+def check_count(count, size, stream):
+    """
+    Check that count entries of at least size bytes fit in what is left of the box being parsed, and charge
+    them to the active hooks that keep count of entries, before any of them is decoded
+    """
+    available = getattr(stream, "available", None)
+    if available is not None and count * size > available:
+        raise BudgetExceeded("{} entries of {} bytes do not fit in the {} bytes left in the box".format(
+            count, size, available))
+    for hook in getattr(_local, "hooks", ()):
+        entries = getattr(hook, "entries", None)
+        if entries is not None:
+            entries(count)
+
+
+def _entry_size(subcon, context, path):
+    # the size of the entries when it does not depend on their data, otherwise nothing is known. A Struct is
+    # parsed in a context of its own with its parent as _, but construct sizes it in the parent's context
+    if isinstance(subcon, Struct):
+        context = Container(_=context)
+    try:
+        return subcon._sizeof(context, path)
+    except Exception:
+        return 0
+
+
+class Array(construct.core.Range):
+    """
+    Array that checks its count against the bytes left in the box before parsing the entries, construct's
+    would try to parse as many as the count asks for
+    """
+    def __init__(self, count, subcon):
+        super(Array, self).__init__(count, count, subcon)
+
+    def _parse(self, stream, context, path):
+        count = self.min(context) if callable(self.min) else self.min
+        check_count(count, _entry_size(self.subcon, context, path), stream)
+        return super(Array, self)._parse(stream, context, path)
+
+
+class PrefixedArray(construct.core.PrefixedArray):
+    """
+    PrefixedArray that checks its count against the bytes left in the box before parsing the entries
+    """
+    def _parse(self, stream, context, path):
+        try:
+            count = self.lengthfield._parse(stream, context, path)
+        except Exception:
+            raise RangeError("could not read prefix, stream too short?")
+        check_count(count, _entry_size(self.subcon, context, path), stream)
+        try:
+            return list(self.subcon._parse(stream, context, path) for i in range(count))
+        except ExplicitError:
+            raise
+        except Exception:
+            raise RangeError("could not read enough elements, stream too short?")
+
+
+class PackedArray(Construct):
+    """
+    Count prefixed array of flat records of integers, all unpacked with one struct.iter_unpack call instead
+    of a Struct parse per entry, for the tables that have an entry per sample
+
+    :param format: struct format of one entry without the byte order, or a function of the context that
+                   returns it, such as one that depends on the version of the box
+    """
+    def __init__(self, countfield, names, format):
+        super(PackedArray, self).__init__()
+        self.countfield = countfield
+        self.names = tuple(names)
+        self.format = format
+
+    def _struct(self, context):
+        format = self.format(context) if callable(self.format) else self.format
+        return struct.Struct(">" + format)
+
+    def _parse(self, stream, context, path):
+        count = self.countfield._parse(stream, context, path)
+        entry = self._struct(context)
+        check_count(count, entry.size, stream)
+        data = construct.core._read_stream(stream, count * entry.size)
+        names = self.names
+        return ListContainer(Container(zip(names, values)) for values in entry.iter_unpack(data))
+
+    def _build(self, obj, stream, context, path):
+        self.countfield._build(len(obj), stream, context, path)
+        entry = self._struct(context)
+        data = b"".join(entry.pack(*(item[name] for name in self.names)) for item in obj)
+        construct.core._write_stream(stream, len(data), data)
+        return obj
+
+    def _sizeof(self, context, path):
+        raise SizeofError("PackedArray has no fixed size")
+
+
 # Header box
 
 FileTypeBox = Struct(
@@ -355,15 +499,15 @@ HVCC = Struct(
         "general_profile_compatibility_flags" / BitsInteger(32),
         "general_constraint_indicator_flags" / BitsInteger(48),
         "general_level" / BitsInteger(8),
-        Padding(4, pattern=b'\xff'),
+        Padding(4, pattern=b'\x01'),
         "min_spatial_segmentation" / BitsInteger(12),
-        Padding(6, pattern=b'\xff'),
+        Padding(6, pattern=b'\x01'),
         "parallelism_type" / BitsInteger(2),
-        Padding(6, pattern=b'\xff'),
+        Padding(6, pattern=b'\x01'),
         "chroma_format" / BitsInteger(2),
-        Padding(5, pattern=b'\xff'),
+        Padding(5, pattern=b'\x01'),
         "luma_bit_depth" / BitsInteger(3),
-        Padding(5, pattern=b'\xff'),
+        Padding(5, pattern=b'\x01'),
         "chroma_bit_depth" / BitsInteger(3),
         "average_frame_rate" / BitsInteger(16),
         "constant_frame_rate" / BitsInteger(2),
@@ -371,8 +515,14 @@ HVCC = Struct(
         "temporal_id_nested" / BitsInteger(1),
         "nalu_length_size" / BitsInteger(2),
     ),
-    # TODO: parse NALUs
-    "raw_bytes" / GreedyBytes
+    "arrays" / Default(PrefixedArray(Int8ub, Struct(
+        EmbeddedBitStruct(
+            "array_completeness" / Default(Flag, True),
+            Padding(1),
+            "nal_unit_type" / BitsInteger(6),
+        ),
+        "nal_units" / PrefixedArray(Int16ub, PascalString(Int16ub)),
+    )), [])
 )
 
 AVC1SampleEntryBox = Struct(
@@ -411,6 +561,9 @@ SampleEntryBox = PrefixedIncludingSize(Int32ub, Struct(
         b"mp4a": MP4ASampleEntryBox,
         b"enca": MP4ASampleEntryBox,
         b"avc1": AVC1SampleEntryBox,
+        b"avc3": AVC1SampleEntryBox,
+        b"hvc1": AVC1SampleEntryBox,
+        b"hev1": AVC1SampleEntryBox,
         b"encv": AVC1SampleEntryBox,
         b"wvtt": Struct("children" / LazyBound(lambda ctx: GreedyRange(Box)))
     }, Struct("data" / GreedyBytes)))
@@ -505,6 +658,25 @@ ChunkLargeOffsetBox = Struct(
     ))
 )
 
+CompositionOffsetBox = Struct(
+    "type" / Const(b"ctts"),
+    "version" / Default(Int8ub, 0),
+    "flags" / Const(Int24ub, 0),
+    "entries" / Default(PackedArray(Int32ub, ("sample_count", "sample_offset"),
+                                    lambda ctx: "II" if ctx.version == 0 else "Ii"), [])
+)
+
+# Edit boxes, contained in trak box
+
+EditListBox = Struct(
+    "type" / Const(b"elst"),
+    "version" / Default(Int8ub, 0),
+    "flags" / Const(Int24ub, 0),
+    "entries" / Default(PackedArray(Int32ub, ("segment_duration", "media_time", "media_rate_integer",
+                                              "media_rate_fraction"),
+                                    lambda ctx: "Qqhh" if ctx.version == 1 else "Iihh"), [])
+)
+
 # Movie Fragment boxes, contained in moof box
 
 MovieFragmentHeaderBox = Struct(
@@ -623,6 +795,41 @@ SegmentIndexBox = Struct(
     ))
 )
 
+EventMessageBox = Struct(
+    "type" / Const(b"emsg"),
+    "version" / Default(OneOf(Int8ub, (0, 1)), 0),
+    "flags" / Const(Int24ub, 0),
+    # version 1 has an absolute presentation time and moves the strings after the integers
+    Embedded(Switch(this.version, {
+        0: Struct(
+            "scheme_id_uri" / CString(encoding="utf8"),
+            "value" / CString(encoding="utf8"),
+            "timescale" / Int32ub,
+            "presentation_time_delta" / Int32ub,
+            "event_duration" / Int32ub,
+            "id" / Int32ub,
+        ),
+        1: Struct(
+            "timescale" / Int32ub,
+            "presentation_time" / Int64ub,
+            "event_duration" / Int32ub,
+            "id" / Int32ub,
+            "scheme_id_uri" / CString(encoding="utf8"),
+            "value" / CString(encoding="utf8"),
+        ),
+    })),
+    "message_data" / Default(GreedyBytes, b"")
+)
+
+ProducerReferenceTimeBox = Struct(
+    "type" / Const(b"prft"),
+    "version" / Default(OneOf(Int8ub, (0, 1)), 0),
+    "flags" / Default(Int24ub, 0),
+    "reference_track_ID" / Int32ub,
+    "ntp_timestamp" / Int64ub,
+    "media_time" / IfThenElse(this.version == 0, Int32ub, Int64ub)
+)
+
 SampleAuxiliaryInformationSizesBox = Struct(
     "type" / Const(b"saiz"),
     "version" / Const(Int8ub, 0),
@@ -755,6 +962,57 @@ ProtectionSchemeInformationBox = Struct(
     "children" / LazyBound(lambda _: GreedyRange(Box))
 )
 
+# Sample group boxes, contained in stbl and traf boxes
+
+SampleToGroupBox = Struct(
+    "type" / Const(b"sbgp"),
+    "version" / Default(Int8ub, 0),
+    "flags" / Const(Int24ub, 0),
+    "grouping_type" / String(4),
+    "grouping_type_parameter" / Default(If(this.version == 1, Int32ub), None),
+    "entries" / Default(PackedArray(Int32ub, ("sample_count", "group_description_index"), "II"), [])
+)
+
+CencSampleEncryptionInformationGroupEntry = Struct(
+    "_reserved" / Const(Int8ub, 0),
+    "byte_blocks" / Default(BitStruct(
+        "crypt" / Nibble,
+        "skip" / Nibble
+    ), Container(crypt=0)(skip=0)),
+    "is_encrypted" / OneOf(Int8ub, (0, 1)),
+    "iv_size" / OneOf(Int8ub, (0, 8, 16)),
+    "key_ID" / UUIDBytes(Bytes(16)),
+    "constant_iv" / Default(If(
+        lambda ctx: ctx.is_encrypted and ctx.iv_size == 0,
+        PrefixedArray(Int8ub, Byte)
+    ), None)
+)
+
+
+def _group_entry_length(ctx):
+    # the length of the entry in front of it, for version 1 without a default length
+    if isinstance(ctx.data, bytes):
+        return len(ctx.data)
+    return len(CencSampleEncryptionInformationGroupEntry.build(ctx.data))
+
+
+SampleGroupDescriptionBox = Struct(
+    "type" / Const(b"sgpd"),
+    "version" / Default(Int8ub, 1),
+    "flags" / Const(Int24ub, 0),
+    "grouping_type" / String(4),
+    "default_length" / Default(If(this.version == 1, Int32ub), 0),
+    # the group of the samples that no sbgp maps to a group, 0 for none
+    "default_group_description_index" / Default(If(this.version >= 2, Int32ub), 0),
+    "entries" / PrefixedArray(Int32ub, Struct(
+        "description_length" / Rebuild(If(lambda ctx: ctx._.version == 1 and not ctx._.default_length, Int32ub),
+                                       _group_entry_length),
+        "data" / Switch(this._.grouping_type, {
+            b"seig": CencSampleEncryptionInformationGroupEntry,
+        }, default=Bytes(lambda ctx: ctx.description_length or ctx._.default_length or 0))
+    ))
+)
+
 # PIFF boxes
 
 UUIDBox = Struct(
@@ -812,7 +1070,55 @@ class TellMinusSizeOf(Subconstruct):
         return 0
 
 
-Box = PrefixedIncludingSize(Int32ub, Struct(
+
+def _run_parse(hooks, subcon, stream, context, path):
+    if not hooks:
+        return subcon._parse(stream, context, path)
+    return hooks[0].parse(lambda s, c, p: _run_parse(hooks[1:], subcon, s, c, p), stream, context, path)
+
+
+def _run_build(hooks, subcon, obj, stream, context, path):
+    if not hooks:
+        return subcon._build(obj, stream, context, path)
+    return hooks[0].build(lambda o, s, c, p: _run_build(hooks[1:], subcon, o, s, c, p), obj, stream, context, path)
+
+
+class Hooked(Subconstruct):
+    """
+    Runs the hooks that are active in the current thread around each parse and build of the subcon
+
+    A hook implements `parse(parse, stream, context, path)` and `build(build, obj, stream, context, path)`,
+    where the first argument continues with the next hook and finally the subcon. See box_hook. A hook can
+    also implement `entries(count)`, which is called with the count of every array before it is parsed.
+    """
+    def _parse(self, stream, context, path):
+        hooks = getattr(_local, "hooks", None)
+        if not hooks:
+            return self.subcon._parse(stream, context, path)
+        return _run_parse(hooks, self.subcon, stream, context, path)
+
+    def _build(self, obj, stream, context, path):
+        hooks = getattr(_local, "hooks", None)
+        if not hooks:
+            return self.subcon._build(obj, stream, context, path)
+        return _run_build(hooks, self.subcon, obj, stream, context, path)
+
+
+@contextmanager
+def box_hook(hook):
+    """
+    Activate a hook for every Box parsed or built by the current thread, the first hook activated is the
+    outermost
+    """
+    hooks = getattr(_local, "hooks", ())
+    _local.hooks = hooks + (hook,)
+    try:
+        yield hook
+    finally:
+        _local.hooks = hooks
+
+
+Box = Hooked(PrefixedIncludingSize(Int32ub, Struct(
     "offset" / TellMinusSizeOf(Int32ub),
     "type" / Peek(String(4, padchar=b" ", paddir="right")),
     Embedded(Switch(this.type, {
@@ -850,8 +1156,15 @@ Box = PrefixedIncludingSize(Int32ub, Struct(
         b"stsc": SampleToChunkBox,
         b"stco": ChunkOffsetBox,
         b"co64": ChunkLargeOffsetBox,
+        b"ctts": CompositionOffsetBox,
+        b"edts": ContainerBoxLazy,
+        b"elst": EditListBox,
+        b"sbgp": SampleToGroupBox,
+        b"sgpd": SampleGroupDescriptionBox,
         b"smhd": SoundMediaHeaderBox,
         b"sidx": SegmentIndexBox,
+        b"emsg": EventMessageBox,
+        b"prft": ProducerReferenceTimeBox,
         b"saiz": SampleAuxiliaryInformationSizesBox,
         b"saio": SampleAuxiliaryInformationOffsetsBox,
         b"btrt": BitRateBox,
@@ -879,7 +1192,7 @@ Box = PrefixedIncludingSize(Int32ub, Struct(
         b"payl": CuePayloadBox
     }, default=RawBox)),
     "end" / Tell
-))
+)))
 
 ContainerBox = Struct(
     "type" / String(4, padchar=b" ", paddir="right"),
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Timestamp rebasing for fragmented MP4
+
+   The tfdt, mfhd and sidx fields are patched in the raw bytes, nothing is parsed with construct. When a
+   version 0 tfdt (or sidx) can not hold the new time it is upgraded to version 1, the 4 extra bytes are
+   spliced in and the sizes of the enclosing boxes, the trun data offsets, the saio offsets and the sidx
+   referenced sizes are fixed up to match.
+"""
+import bisect
+import logging
+import struct
+from collections import namedtuple
+
+from pymp4.exceptions import MalformedBox
+
+log = logging.getLogger(__name__)
+
+_size_type = struct.Struct(">I4s")
+_u32 = struct.Struct(">I")
+_u64 = struct.Struct(">Q")
+
+MAX_U32 = 0xffffffff
+
+# tfhd flags
+BASE_DATA_OFFSET_PRESENT = 0x000001
+DEFAULT_BASE_IS_MOOF = 0x020000
+# trun flags
+DATA_OFFSET_PRESENT = 0x000001
+
+_Box = namedtuple("_Box", "type offset size header_size")
+# a field that points at target relative to base, base None means the start of the file
+_Reference = namedtuple("_Reference", "offset width format value base target")
+
+
+def _boxes(buf, offset, end):
+    while offset < end:
+        if offset + 8 > end:
+            raise MalformedBox("truncated box header at offset {}".format(offset))
+        size, type_ = _size_type.unpack_from(buf, offset)
+        header_size = 8
+        if size == 1:
+            size, = _u64.unpack_from(buf, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MalformedBox("invalid size {} for box {!r} at offset {}".format(size, type_, offset))
+        yield _Box(type_, offset, size, header_size)
+        offset += size
+
+
+def _full_box(buf, box):
+    value, = _u32.unpack_from(buf, box.offset + box.header_size)
+    return value >> 24, value & 0xffffff
+
+
+def _shifted(value, offset, name):
+    if offset is None:
+        return value
+    value += offset
+    if value < 0:
+        raise ValueError("{} would become negative ({})".format(name, value))
+    return value
+
+
+class _Patch(object):
+    """
+    The fields to rewrite in a buffer, keyed by offset: (current width, struct format, value)
+    """
+    def __init__(self, buf, position, shift=0):
+        self.buf = buf
+        self.position = position
+        self.shift = shift
+        self.fields = {}
+        self.boxes = []
+        self.references = []
+
+    def set(self, offset, width, format_, value):
+        self.fields[offset] = (width, format_, value)
+
+    def set_time(self, box, field_offset, version, value):
+        """
+        Write a 32 or 64 bit time, upgrading the box to version 1 when a version 0 field is too small
+        """
+        if version == 0 and value > MAX_U32:
+            self.set(box.offset + box.header_size, 1, ">B", 1)
+            self.set(field_offset, 4, ">Q", value)
+            return True
+        if version == 0:
+            self.set(field_offset, 4, ">I", value)
+        else:
+            self.set(field_offset, 8, ">Q", value)
+        return False
+
+    def reference(self, offset, width, format_, base, target):
+        value, = struct.unpack_from(format_, self.buf, offset)
+        self.references.append(_Reference(offset, width, format_, value, base, target))
+
+    def apply(self):
+        growth = sorted((offset, struct.calcsize(format_) - width)
+                        for offset, (width, format_, _) in self.fields.items()
+                        if struct.calcsize(format_) != width)
+        if growth:
+            self._fix_up(growth)
+            return self._splice()
+        for offset, (_, format_, value) in self.fields.items():
+            struct.pack_into(format_, self.buf, offset, value)
+        return self.buf
+
+    def _fix_up(self, growth):
+        offsets = [offset for offset, _ in growth]
+        totals = [0]
+        for _, extra in growth:
+            totals.append(totals[-1] + extra)
+
+        def grown(offset):
+            # bytes inserted before offset in the original buffer
+            if offset is None:
+                return 0
+            return totals[bisect.bisect_left(offsets, offset)]
+
+        for box in self.boxes:
+            extra = grown(box.offset + box.size) - grown(box.offset)
+            if extra:
+                if box.header_size == 16:
+                    self.set(box.offset + 8, 8, ">Q", box.size + extra)
+                elif box.size + extra > MAX_U32:
+                    raise ValueError("box {!r} at offset {} is too large".format(box.type, box.offset))
+                else:
+                    self.set(box.offset, 4, ">I", box.size + extra)
+        for ref in self.references:
+            extra = grown(ref.target) - grown(ref.base)
+            if extra:
+                field = self.fields.get(ref.offset)
+                if field is not None:
+                    self.set(ref.offset, field[0], field[1], field[2] + extra)
+                else:
+                    self.set(ref.offset, ref.width, ref.format, ref.value + extra)
+
+    def _splice(self):
+        view = memoryview(self.buf)
+        out = bytearray()
+        last = 0
+        for offset in sorted(self.fields):
+            width, format_, value = self.fields[offset]
+            out += view[last:offset]
+            out += struct.pack(format_, value)
+            last = offset + width
+        out += view[last:]
+        view.release()
+        return out
+
+
+def _time_offset(time_offset, track_ID):
+    if isinstance(time_offset, dict):
+        return time_offset.get(track_ID)
+    return time_offset or None
+
+
+def _rebase_traf(patch, moof, traf, first, time_offset):
+    buf = patch.buf
+    patch.boxes.append(traf)
+    children = list(_boxes(buf, traf.offset + traf.header_size, traf.offset + traf.size))
+    tfhd = next((box for box in children if box.type == b"tfhd"), None)
+    if tfhd is None:
+        raise MalformedBox("traf at offset {} has no tfhd".format(traf.offset))
+    _, flags = _full_box(buf, tfhd)
+    track_ID, = _u32.unpack_from(buf, tfhd.offset + tfhd.header_size + 4)
+
+    # the base that the trun data offsets and the saio offsets are relative to
+    if flags & BASE_DATA_OFFSET_PRESENT:
+        base_field = tfhd.offset + tfhd.header_size + 8
+        base_data_offset, = _u64.unpack_from(buf, base_field)
+        base = base_data_offset - patch.position
+        if patch.shift:
+            # the data has moved in the output by what the buffers in front of it grew
+            patch.set(base_field, 8, ">Q", base_data_offset + patch.shift)
+        patch.reference(base_field, 8, ">Q", None, base)
+    elif flags & DEFAULT_BASE_IS_MOOF or first:
+        base = moof.offset
+    else:
+        # relative to the end of the data of the previous traf, which does not move
+        base = None
+
+    offset = _time_offset(time_offset, track_ID)
+    for box in children:
+        if box.type == b"tfdt" and offset is not None:
+            patch.boxes.append(box)
+            version, _ = _full_box(buf, box)
+            field = box.offset + box.header_size + 4
+            time, = (_u64 if version == 1 else _u32).unpack_from(buf, field)
+            patch.set_time(box, field, version, _shifted(time, offset, "baseMediaDecodeTime"))
+        elif box.type == b"trun" and base is not None:
+            _, trun_flags = _full_box(buf, box)
+            if trun_flags & DATA_OFFSET_PRESENT:
+                field = box.offset + box.header_size + 8
+                data_offset, = struct.unpack_from(">i", buf, field)
+                patch.reference(field, 4, ">i", base, base + data_offset)
+        elif box.type == b"saio" and base is not None:
+            version, saio_flags = _full_box(buf, box)
+            field = box.offset + box.header_size + (12 if saio_flags & 1 else 4)
+            count, = _u32.unpack_from(buf, field)
+            format_, width = (">Q", 8) if version == 1 else (">I", 4)
+            for i in range(count):
+                entry = field + 4 + i * width
+                value, = struct.unpack_from(format_, buf, entry)
+                patch.reference(entry, width, format_, base, base + value)
+
+
+def _rebase_moof(patch, moof, time_offset, sequence_offset):
+    buf = patch.buf
+    patch.boxes.append(moof)
+    first = True
+    for box in _boxes(buf, moof.offset + moof.header_size, moof.offset + moof.size):
+        if box.type == b"mfhd" and sequence_offset:
+            field = box.offset + box.header_size + 4
+            sequence_number = _shifted(_u32.unpack_from(buf, field)[0], sequence_offset, "sequence_number")
+            if sequence_number > MAX_U32:
+                raise ValueError("sequence_number would overflow ({})".format(sequence_number))
+            patch.set(field, 4, ">I", sequence_number)
+        elif box.type == b"traf":
+            _rebase_traf(patch, moof, box, first, time_offset)
+            first = False
+
+
+def _rebase_sidx(patch, sidx, time_offset, rebase_time):
+    buf = patch.buf
+    patch.boxes.append(sidx)
+    version, _ = _full_box(buf, sidx)
+    payload = sidx.offset + sidx.header_size
+    reference_ID, = _u32.unpack_from(buf, payload + 4)
+    time_field = payload + 12
+    width = 8 if version == 1 else 4
+    format_ = ">Q" if version == 1 else ">I"
+    time, first_offset = struct.unpack_from(format_[0] + format_[1] * 2, buf, time_field)
+    offset_field = time_field + width
+
+    offset = _time_offset(time_offset, reference_ID) if rebase_time else None
+    if offset is not None:
+        time = _shifted(time, offset, "earliest_presentation_time")
+        if patch.set_time(sidx, time_field, version, time):
+            patch.set(offset_field, 4, ">Q", first_offset)
+
+    anchor = sidx.offset + sidx.size
+    patch.reference(offset_field, width, format_, anchor, anchor + first_offset)
+    count_field = offset_field + width + 2
+    count, = struct.unpack_from(">H", buf, count_field)
+    start = anchor + first_offset
+    for i in range(count):
+        entry = count_field + 2 + i * 12
+        referenced_size = _u32.unpack_from(buf, entry)[0] & 0x7fffffff
+        # the reference type bit is carried along, only the size part changes
+        patch.reference(entry, 4, ">I", start, start + referenced_size)
+        start += referenced_size
+
+
+def rebase(data, time_offset=0, sequence_offset=0, sidx=False, position=0, shift=0):
+    """
+    Shift the timestamps and sequence numbers of the fragments in data
+
+    :param data: one or more whole top level boxes (sidx, moof, mdat, ...); a bytearray is patched in place
+                 unless a box has to grow
+    :param time_offset: added to tfdt.baseMediaDecodeTime, in the media timescale, either one value for all
+                        the tracks or a dict of track_ID to offset; tracks missing from the dict are left alone
+    :param sequence_offset: added to mfhd.sequence_number
+    :param sidx: also shift sidx.earliest_presentation_time by the offset of the sidx reference_ID
+    :param position: file offset of data, used for absolute tfhd.base_data_offset values
+    :param shift: how much the output in front of data has grown by, which is added to the absolute
+                  tfhd.base_data_offset values
+    :return: the patched data as a bytearray
+    :raises ValueError: when the references of a sidx run past the end of data, their sizes could not be
+                        fixed up, see rebase_fragments
+    """
+    buf = data if isinstance(data, bytearray) else bytearray(data)
+    return _prepare(buf, time_offset, sequence_offset, sidx, position, shift).apply()
+
+
+def _prepare(buf, time_offset, sequence_offset, sidx, position, shift):
+    patch = _Patch(buf, position, shift)
+    for box in _boxes(buf, 0, len(buf)):
+        if box.type == b"moof":
+            _rebase_moof(patch, box, time_offset, sequence_offset)
+        elif box.type == b"sidx":
+            reach = _sidx_reach(buf, box)
+            if reach > len(buf):
+                raise ValueError("the references of the sidx at offset {} run to {}, past the end of the data at "
+                                 "{}, rebase the sidx together with the fragments it references".format(
+                                     box.offset, reach, len(buf)))
+            _rebase_sidx(patch, box, time_offset, sidx)
+    return patch
+
+
+def _sidx_reach(buf, sidx):
+    # offset in buf of the end of the last range referenced by a sidx
+    version, _ = _full_box(buf, sidx)
+    payload = sidx.offset + sidx.header_size
+    width = 8 if version == 1 else 4
+    first_offset, = struct.unpack_from(">Q" if version == 1 else ">I", buf, payload + 12 + width)
+    count_field = payload + 12 + 2 * width + 2
+    count, = struct.unpack_from(">H", buf, count_field)
+    return sidx.offset + sidx.size + first_offset + sum(
+        _u32.unpack_from(buf, count_field + 2 + i * 12)[0] & 0x7fffffff for i in range(count))
+
+
+def _rebase_group(group, time_offset, sequence_offset, sidx, position, shift):
+    # rebase consecutive buffers as one, and split the result where the buffers were
+    if len(group) == 1:
+        return [rebase(group[0], time_offset, sequence_offset, sidx, position, shift)]
+    patch = _prepare(bytearray().join(group), time_offset, sequence_offset, sidx, position, shift)
+    growth = [(offset, struct.calcsize(format_) - width) for offset, (width, format_, _) in patch.fields.items()]
+    buf = patch.apply()
+    rebased, start, end = [], 0, 0
+    for data in group:
+        end += len(data)
+        # the fields that grow are inside boxes, so the boundaries between the buffers only move
+        new_end = end + sum(extra for offset, extra in growth if offset < end)
+        rebased.append(buf[start:new_end])
+        start = new_end
+    return rebased
+
+
+def rebase_fragments(fragments, time_offset=0, sequence_offset=0, sidx=False, position=0):
+    """
+    Rebase every buffer of an iterable of fragments, yielding the patched buffers
+
+    The buffers are assumed to be consecutive in the file, starting at position. When a buffer grows, the
+    absolute tfhd.base_data_offset values of the buffers after it are moved by as much.
+
+    A sidx is rebased together with the fragments it references, so that its referenced sizes take the
+    growth of the fragments into account: a buffer with a sidx, and the buffers after it, are held back until
+    the last referenced range has been received, then they are rebased as one and yielded one by one again.
+    A ValueError is raised when the fragments end before the references of a sidx do.
+    """
+    shift = 0
+    group, group_size, reach = [], 0, 0
+    for data in fragments:
+        group.append(data)
+        group_size += len(data)
+        for box in _boxes(data, 0, len(data)):
+            if box.type == b"sidx":
+                reach = max(reach, group_size - len(data) + _sidx_reach(data, box))
+        if reach > group_size:
+            continue
+        rebased = _rebase_group(group, time_offset, sequence_offset, sidx, position, shift)
+        position += group_size
+        shift += sum(len(data) for data in rebased) - group_size
+        group, group_size, reach = [], 0, 0
+        for data in rebased:
+            yield data
+    if group:
+        raise ValueError("the references of a sidx run {} bytes past the end of the fragments".format(
+            reach - group_size))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Recovery from truncated and corrupt files
+
+   recover_boxes walks the box headers like pymp4.index.iter_boxes but checks that the size and type of each
+   box are plausible. When they are not, the bytes are searched for the next header of a known box type and
+   the range that was skipped is reported as a Damage. A box that runs past the end of the file, or of its
+   parent, is clipped and reported as truncated.
+"""
+import io
+import logging
+import mmap
+import re
+import struct
+from collections import namedtuple
+
+from pymp4.index import CONTAINER_BOXES, BoxHeader
+
+log = logging.getLogger(__name__)
+
+# boxes that are searched for when a file has to be resynchronised
+TOP_LEVEL_BOXES = frozenset([
+    b"ftyp", b"styp", b"moov", b"moof", b"mdat", b"sidx", b"ssix", b"free", b"skip", b"mfra", b"emsg",
+    b"prft", b"meta", b"pdin",
+])
+KNOWN_BOXES = TOP_LEVEL_BOXES | CONTAINER_BOXES | frozenset([
+    b"mvhd", b"mehd", b"trex", b"tkhd", b"mdhd", b"hdlr", b"vmhd", b"smhd", b"dref", b"stsd", b"stts",
+    b"ctts", b"stss", b"stsc", b"stsz", b"stz2", b"stco", b"co64", b"edts", b"elst", b"udta", b"mfhd",
+    b"tfhd", b"tfdt", b"trun", b"saiz", b"saio", b"senc", b"pssh", b"tenc", b"frma", b"schm", b"sbgp",
+    b"sgpd", b"tfra", b"mfro",
+])
+# top level boxes that are never found inside another box, finding one inside a box that runs past the end
+# of the file means that the size of the box is wrong rather than the file truncated. The payload of an mdat
+# is media data that can hold anything, so a truncated mdat is not searched
+ANCHOR_BOXES = frozenset([b"ftyp", b"styp", b"moov", b"moof", b"mdat", b"sidx", b"mfra"])
+
+SEARCH_SIZE = 1024 * 1024
+
+Damage = namedtuple("Damage", "offset size depth reason")
+
+_size_type = struct.Struct(">I4s")
+_largesize = struct.Struct(">Q")
+
+
+def plausible_type(type_):
+    """
+    Whether type_ looks like a box type, four printable characters (or the copyright sign of the iTunes
+    metadata boxes)
+    """
+    return len(type_) == 4 and all(32 <= c < 127 or c == 0xa9 for c in bytearray(type_))
+
+
+def _file_size(fd):
+    fd.seek(0, io.SEEK_END)
+    return fd.tell()
+
+
+class _Searcher(object):
+    """
+    Finds the next header of one of the given box types, over a memory map of the file when there is one
+    """
+    def __init__(self, fd, types):
+        self.fd = fd
+        self.pattern = re.compile(b"|".join(re.escape(type_) for type_ in sorted(types)))
+        self.map = None
+        self.mapped = False
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+
+    def _matches(self, start, end):
+        # offsets of the type fields that match, searched a block at a time when the file is not mapped
+        if not self.mapped:
+            self.mapped = True
+            try:
+                self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                pass
+        if self.map is not None:
+            for match in self.pattern.finditer(self.map, start, end):
+                yield match.start()
+            return
+        position = start
+        while position < end:
+            self.fd.seek(position)
+            block = self.fd.read(min(SEARCH_SIZE, end - position))
+            if len(block) < 4:
+                return
+            for match in self.pattern.finditer(block):
+                yield position + match.start()
+            # the next block overlaps by three bytes so that a type that is split between blocks is found
+            position += len(block) - 3
+
+    def find(self, start, end, depth, chained=False):
+        """
+        Header of the first box of a known type that starts in [start, end) and fits before end
+
+        :param chained: only accept a box that ends at end or is followed by another plausible box that fits
+        """
+        for match in self._matches(start + 4, end):
+            header = _check(self.fd, match - 4, end, depth)
+            if isinstance(header, str) or header.end > end:
+                continue
+            if chained and header.end < end:
+                following = _check(self.fd, header.end, end, depth)
+                if isinstance(following, str) or following.end > end:
+                    continue
+            return header
+        return None
+
+
+def _check(fd, offset, end, depth):
+    # the header at offset, or a string saying why it is not plausible
+    fd.seek(offset)
+    data = fd.read(min(16, end - offset))
+    if len(data) < 8:
+        return "truncated box header"
+    size, type_ = _size_type.unpack_from(data)
+    header_size = 8
+    if not plausible_type(type_):
+        return "invalid box type {!r}".format(type_)
+    if size == 1:
+        if len(data) < 16:
+            return "truncated box header"
+        size, = _largesize.unpack_from(data, 8)
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    if size < header_size:
+        return "invalid size {} for box {!r}".format(size, type_)
+    return BoxHeader(type_, offset, size, header_size, depth)
+
+
+def _damage(damaged, offset, size, depth, reason):
+    log.warning("damaged range at offset %d, %d bytes: %s", offset, size, reason)
+    damaged.append(Damage(offset, size, depth, reason))
+
+
+def recover_boxes(fd, offset=0, end=None, depth=0, recursive=False, damaged=None, types=None):
+    """
+    Walk the box headers between offset and end, skipping over the damaged parts of the file
+
+    :param damaged: a list that the Damage records are appended to as they are found, before the box that
+                    follows them is yielded
+    :param types: box types to resynchronise on, TOP_LEVEL_BOXES at depth 0 and KNOWN_BOXES below
+    """
+    damaged = [] if damaged is None else damaged
+    end = _file_size(fd) if end is None else end
+    searcher = _Searcher(fd, types or (TOP_LEVEL_BOXES if depth == 0 else KNOWN_BOXES))
+    anchors = _Searcher(fd, ANCHOR_BOXES)
+    try:
+        while offset < end:
+            header = _check(fd, offset, end, depth)
+            if not isinstance(header, str) and header.end > end:
+                # either the file is truncated or the size is wrong, in which case the next box can be found
+                following = None
+                if depth == 0 and header.type != b"mdat":
+                    following = anchors.find(header.data_offset, end, depth, chained=True)
+                if following is None:
+                    reason = "box {!r} is truncated, {} of {} bytes".format(header.type, end - offset, header.size)
+                    _damage(damaged, offset, end - offset, depth, reason)
+                    header = header._replace(size=end - offset)
+                else:
+                    header = "invalid size {} for box {!r}".format(header.size, header.type)
+            if isinstance(header, str):
+                if header == "truncated box header":
+                    _damage(damaged, offset, end - offset, depth, header)
+                    break
+                header, reason = searcher.find(offset + 1, end, depth), header
+                _damage(damaged, offset, (end if header is None else header.offset) - offset, depth, reason)
+                if header is None:
+                    break
+            yield header
+            if recursive and header.type in CONTAINER_BOXES:
+                for child in recover_boxes(fd, header.data_offset, header.end, depth + 1, recursive, damaged):
+                    yield child
+            offset = header.end
+    finally:
+        searcher.close()
+        anchors.close()
+
+
+def recover(fd):
+    """
+    Index every box that can be found in a damaged file
+
+    :returns: the depth first list of BoxHeaders and the list of Damage records
+    """
+    damaged = []
+    return list(recover_boxes(fd, recursive=True, damaged=damaged)), damaged
+
+
+def parse(fd):
+    """
+    Parse the top level boxes that can be found in a damaged file with pymp4.parser.Box, a box that fails to
+    parse is reported as damaged instead
+
+    :returns: the list of (BoxHeader, box) pairs and the list of Damage records, the offsets of the parsed
+              boxes are relative to the start of each box
+    """
+    from pymp4.parser import Box
+
+    boxes, damaged = [], []
+    for header in recover_boxes(fd, damaged=damaged):
+        fd.seek(header.offset)
+        data = fd.read(header.size)
+        # the size field of a truncated box is replaced, so that what is left of it can be parsed
+        if header.header_size == 16:
+            data = data[:8] + _largesize.pack(header.size) + data[16:]
+        else:
+            data = _size_type.pack(header.size, header.type) + data[8:]
+        try:
+            box = Box.parse(data)
+        except Exception as e:
+            _damage(damaged, header.offset, header.size, 0, str(e).split("\n")[0])
+            continue
+        boxes.append((header, box))
+    return boxes, damaged
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Progressive to fragmented MP4
+
+   The moov of the source is copied with empty sample tables and an mvex, then each fragment is written as
+   a moof with a traf per track and an mdat that is filled by copying byte ranges of the source. Fragments
+   start at the sync samples of the video track (or the first track).
+"""
+import logging
+import struct
+from bisect import bisect_left
+from collections import namedtuple
+
+from construct import Container
+
+from pymp4 import writer
+from pymp4.exceptions import BoxNotFound
+from pymp4.index import iter_boxes, read_payload
+from pymp4.parser import Box
+from pymp4.samples import read_tracks
+
+log = logging.getLogger(__name__)
+
+Fragment = namedtuple("Fragment", "sequence_number offset size time")
+
+
+def _read(fd, header):
+    fd.seek(header.offset)
+    return fd.read(header.size)
+
+
+def _empty_stbl(fd, stbl):
+    children = [_read(fd, header) for header in iter_boxes(fd, stbl.data_offset, stbl.end, stbl.depth + 1)
+                if header.type == b"stsd"]
+    children.append(writer.full_box(b"stts", 0, 0, bytes(4)))
+    children.append(writer.full_box(b"stsc", 0, 0, bytes(4)))
+    children.append(writer.full_box(b"stsz", 0, 0, bytes(8)))
+    children.append(writer.full_box(b"stco", 0, 0, bytes(4)))
+    return writer.box(b"stbl", *children)
+
+
+def _track_ID(fd, trak):
+    tkhd = next((h for h in iter_boxes(fd, trak.data_offset, trak.end, trak.depth + 1) if h.type == b"tkhd"), None)
+    if tkhd is None:
+        raise BoxNotFound("could not find box of type: {}".format(b"tkhd"))
+    payload = read_payload(fd, tkhd)
+    return struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)[0]
+
+
+def _replace(fd, header, path, track_IDs):
+    if header.type == b"trak" and _track_ID(fd, header) not in track_IDs:
+        return b""
+    if header.type == b"stbl":
+        return _empty_stbl(fd, header)
+    if header.type == b"mvex":
+        return b""
+    return None
+
+
+def _mvex(tracks, duration):
+    return Box.build(Container(type=b"mvex")(children=[
+        Container(type=b"mehd")(version=1 if duration > writer.MAX_U32 else 0)(fragment_duration=duration),
+    ] + [
+        Container(type=b"trex")(track_ID=track.track_ID) for track in tracks
+    ]))
+
+
+def init_segment(fd, tracks=None):
+    """
+    ftyp and moov of the fragmented version of the progressive file fd, with only the given tracks
+    """
+    ftyp = moov = None
+    for header in iter_boxes(fd):
+        if header.type == b"ftyp" and ftyp is None:
+            ftyp = header
+        elif header.type == b"moov":
+            moov = header
+    if moov is None:
+        raise BoxNotFound("could not find box of type: {}".format(b"moov"))
+    tracks = read_tracks(fd, moov) if tracks is None else tracks
+
+    brands = [b"iso6"]
+    if ftyp is not None:
+        payload = read_payload(fd, ftyp)
+        for i in range(0, len(payload), 4):
+            brand = payload[i:i + 4]
+            if i != 4 and len(brand) == 4 and brand not in brands:
+                brands.append(brand)
+    ftyp_data = Box.build(Container(type=b"ftyp")(major_brand=b"iso6")(minor_version=0)(compatible_brands=brands))
+
+    mvhd = next((h for h in iter_boxes(fd, moov.data_offset, moov.end, 1) if h.type == b"mvhd"), None)
+    if mvhd is None:
+        raise BoxNotFound("could not find box of type: {}".format(b"mvhd"))
+    payload = read_payload(fd, mvhd)
+    movie_timescale, = struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)
+    duration = max([track.duration * movie_timescale // track.timescale for track in tracks if track.timescale] or [0])
+
+    track_IDs = frozenset(track.track_ID for track in tracks)
+    children = [writer.rewrite(fd, header, lambda h, path: _replace(fd, h, path, track_IDs), (moov,))
+                for header in iter_boxes(fd, moov.data_offset, moov.end, 1)]
+    children.append(_mvex(tracks, duration))
+    return ftyp_data + writer.box(b"moov", *children)
+
+
+def plan_fragments(tracks, fragment_duration=2.0):
+    """
+    Split the tracks into fragments of at least fragment_duration seconds that start at a sync sample of
+    the video track, or the first track when there is no video
+
+    :returns: a list with, for each fragment, the [(track, (first, last)), ...] sample ranges of the tracks
+    """
+    tracks = [track for track in tracks if len(track)]
+    if not tracks:
+        return []
+    reference = next((track for track in tracks if track.handler_type == b"vide"), tracks[0])
+    target = int(fragment_duration * reference.timescale)
+    cuts = [0]
+    for sample in reference.sync_samples():
+        if sample and reference.dts[sample] - reference.dts[cuts[-1]] >= target:
+            cuts.append(sample)
+
+    bounds = []
+    for track in tracks:
+        if track is reference:
+            starts = cuts
+        else:
+            # the first sample decoded at or after each cut of the reference track
+            starts = [0] + [bisect_left(track.dts, -(-reference.dts[cut] * track.timescale // reference.timescale))
+                            for cut in cuts[1:]]
+        bounds.append(list(zip(starts, starts[1:] + [len(track)])))
+    return [[(track, ranges[i]) for track, ranges in zip(tracks, bounds)] for i in range(len(cuts))]
+
+
+def _traf(track, first, last, data_offset):
+    cts_offsets = track.cts_offsets[first:last] if track.cts_offsets is not None else None
+    flags = writer.sample_flags(track.sync[first:last]) if track.sync is not None else None
+    return writer.box(b"traf",
+                      writer.tfhd(track.track_ID),
+                      writer.tfdt(track.dts[first]),
+                      writer.trun(data_offset, track.durations[first:last], track.sizes[first:last], flags,
+                                  cts_offsets))
+
+
+def moof(sequence_number, fragment, data_offset=0):
+    """
+    moof for one planned fragment, with the samples of the tracks following each other in the mdat that
+    starts data_offset bytes after the moof
+    """
+    def build(moof_size):
+        trafs = []
+        offset = moof_size + data_offset
+        for track, (first, last) in fragment:
+            if first < last:
+                trafs.append(_traf(track, first, last, offset))
+                offset += sum(track.sizes[first:last])
+        return writer.box(b"moof", writer.mfhd(sequence_number), *trafs)
+
+    return build(len(build(0)))
+
+
+def write_fragment(src, out, sequence_number, fragment):
+    """
+    Write the moof and mdat of a planned fragment, the samples are copied from src a range at a time
+
+    :returns: the number of bytes written
+    """
+    size = sum(sum(track.sizes[first:last]) for track, (first, last) in fragment)
+    mdat_header = writer.box_header(b"mdat", size)
+    moof_data = moof(sequence_number, fragment, len(mdat_header))
+    out.write(moof_data)
+    out.write(mdat_header)
+    for track, (first, last) in fragment:
+        for offset, length in track.byte_ranges(first, last):
+            writer.copy_range(src, out, offset, length)
+    return len(moof_data) + len(mdat_header) + size
+
+
+def remux(source, output, fragment_duration=2.0):
+    """
+    Write a fragmented version of the progressive MP4 source to output, both can be paths or file objects
+
+    :returns: a list of the Fragments written, the time is the decode time of the fragment in the timescale
+              of the first track
+    """
+    fragments = []
+    with writer.opened(source, "rb") as src, writer.opened(output, "wb") as out:
+        tracks = read_tracks(src)
+        init = init_segment(src, tracks)
+        out.write(init)
+        position = len(init)
+        for sequence_number, fragment in enumerate(plan_fragments(tracks, fragment_duration), 1):
+            size = write_fragment(src, out, sequence_number, fragment)
+            track, (first, _) = fragment[0]
+            fragments.append(Fragment(sequence_number, position, size, track.dts[first]))
+            position += size
+    return fragments
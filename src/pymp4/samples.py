@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate, chain
+
+from pymp4.exceptions import BoxNotFound, MalformedBox
+from pymp4.index import iter_boxes, read_payload
+
+log = logging.getLogger(__name__)
+
+# array type codes for fixed width integers
+U8 = "B"
+U32 = "I" if array("I").itemsize == 4 else "L"
+S32 = "i" if array("i").itemsize == 4 else "l"
+U64 = "Q"
+
+_full_box = struct.Struct(">B3x")
+_u32 = struct.Struct(">I")
+
+Segment = namedtuple("Segment", "offset size time duration starts_with_sap")
+Edit = namedtuple("Edit", "segment_duration media_time media_rate")
+
+
+def be_array(typecode, data, offset=0, count=None):
+    """
+    Decode a run of big endian integers in one go
+    """
+    values = array(typecode)
+    if count is None:
+        count = (len(data) - offset) // values.itemsize
+    end = offset + count * values.itemsize
+    if end > len(data):
+        raise MalformedBox("table needs {} bytes but only {} are available".format(end, len(data)))
+    values.frombytes(data[offset:end])
+    if sys.byteorder == "little":
+        values.byteswap()
+    return values
+
+
+def _entry_count(payload):
+    return _u32.unpack_from(payload, 4)[0]
+
+
+def expand_runs(counts, values, typecode):
+    """
+    Expand run length encoded (count, value) pairs, as used by stts and ctts
+    """
+    out = array(typecode)
+    for count, value in zip(counts, values):
+        out.extend(array(typecode, [value]) * count)
+    return out
+
+
+def decode_stsz(payload):
+    sample_size, sample_count = struct.unpack_from(">II", payload, 4)
+    if sample_size:
+        return array(U32, [sample_size]) * sample_count
+    return be_array(U32, payload, 12, sample_count)
+
+
+def decode_stz2(payload):
+    field_size, = struct.unpack_from(">B", payload, 7)
+    sample_count, = _u32.unpack_from(payload, 8)
+    if field_size == 4:
+        packed = bytearray(payload[12:12 + (sample_count + 1) // 2])
+        sizes = array(U32)
+        for b in packed:
+            sizes.append(b >> 4)
+            sizes.append(b & 0x0f)
+        return sizes[:sample_count]
+    typecode = {8: U8, 16: "H"}.get(field_size)
+    if typecode is None:
+        raise MalformedBox("invalid stz2 field size {}".format(field_size))
+    return array(U32, be_array(typecode, payload, 12, sample_count))
+
+
+def decode_stts(payload):
+    """
+    :returns: per sample durations
+    """
+    runs = be_array(U32, payload, 8, _entry_count(payload) * 2)
+    return expand_runs(runs[0::2], runs[1::2], U32)
+
+
+def decode_ctts(payload):
+    """
+    :returns: per sample composition offsets, version 0 offsets are read as signed like most players do
+    """
+    entry_count = _entry_count(payload)
+    counts = be_array(U32, payload, 8, entry_count * 2)[0::2]
+    offsets = be_array(S32, payload, 12, entry_count * 2 - 1)[0::2] if entry_count else array(S32)
+    return expand_runs(counts, offsets, S32)
+
+
+def decode_elst(payload):
+    """
+    :returns: (segment_duration, media_time, media_rate) of each edit, media_time is -1 for an empty edit
+    """
+    version, = _full_box.unpack_from(payload)
+    entry = struct.Struct(">Qqhh" if version == 1 else ">Iihh")
+    edits = []
+    for segment_duration, media_time, rate_integer, rate_fraction in entry.iter_unpack(
+            payload[8:8 + _entry_count(payload) * entry.size]):
+        edits.append(Edit(segment_duration, media_time, rate_integer + rate_fraction / 65536.0))
+    return edits
+
+
+def decode_stss(payload):
+    """
+    :returns: 1-based sample numbers of the sync samples
+    """
+    return be_array(U32, payload, 8, _entry_count(payload))
+
+
+def decode_stsc(payload):
+    """
+    :returns: first_chunk, samples_per_chunk and sample_description_index columns
+    """
+    entries = be_array(U32, payload, 8, _entry_count(payload) * 3)
+    return entries[0::3], entries[1::3], entries[2::3]
+
+
+def decode_stco(payload):
+    return array(U64, be_array(U32, payload, 8, _entry_count(payload)))
+
+
+def decode_co64(payload):
+    return be_array(U64, payload, 8, _entry_count(payload))
+
+
+def chunk_sample_offsets(chunk_offsets, stsc, sizes):
+    """
+    Resolve the file offset of every sample from the chunk offsets, the sample to chunk runs and the sizes
+    """
+    first_chunks, samples_per_chunk, _ = stsc
+    offsets = array(U64, bytes(8 * len(sizes)))
+    # position of every sample relative to the start of the data, the chunk offset replaces the base
+    starts = array(U64, [0])
+    starts.extend(accumulate(sizes))
+    sample = 0
+    nchunks = len(chunk_offsets)
+    for run in range(len(first_chunks)):
+        first = first_chunks[run] - 1
+        last = first_chunks[run + 1] - 1 if run + 1 < len(first_chunks) else nchunks
+        per_chunk = samples_per_chunk[run]
+        for chunk in range(first, min(last, nchunks)):
+            end = min(sample + per_chunk, len(sizes))
+            delta = chunk_offsets[chunk] - starts[sample]
+            offsets[sample:end] = array(U64, map(delta.__add__, starts[sample:end]))
+            sample = end
+    if sample != len(sizes):
+        raise MalformedBox("chunk table only covers {} of {} samples".format(sample, len(sizes)))
+    return offsets
+
+
+def decode_sidx(payload, offset):
+    """
+    Resolve the references of a sidx box, offset is the end of the sidx box in the file
+    """
+    version, = _full_box.unpack_from(payload, 0)
+    timescale, = _u32.unpack_from(payload, 8)
+    if version == 0:
+        time, first_offset = struct.unpack_from(">II", payload, 12)
+        pos = 20
+    else:
+        time, first_offset = struct.unpack_from(">QQ", payload, 12)
+        pos = 28
+    reference_count, = struct.unpack_from(">2xH", payload, pos)
+    refs = be_array(U32, payload, pos + 4, reference_count * 3)
+    offset += first_offset
+    segments = []
+    for i in range(reference_count):
+        size = refs[i * 3] & 0x7fffffff
+        duration = refs[i * 3 + 1]
+        segments.append(Segment(offset, size, time, duration, bool(refs[i * 3 + 2] >> 31)))
+        offset += size
+        time += duration
+    return timescale, segments
+
+
+class SampleTable(object):
+    """
+    Resolved sample table of a track, stored column wise
+
+    The columns are arrays, or any other sequence of integers such as the memoryviews of a sidecar index,
+    `cts_offsets` is None when there are no composition offsets and `sync` is None when every sample is a
+    sync sample.
+    """
+    __slots__ = ("track_ID", "timescale", "handler_type", "offsets", "sizes", "dts", "durations",
+                 "cts_offsets", "sync")
+
+    def __init__(self, track_ID, timescale, handler_type, offsets, sizes, dts, durations,
+                 cts_offsets=None, sync=None):
+        self.track_ID = track_ID
+        self.timescale = timescale
+        self.handler_type = handler_type
+        self.offsets = offsets
+        self.sizes = sizes
+        self.dts = dts
+        self.durations = durations
+        self.cts_offsets = cts_offsets
+        self.sync = sync
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __repr__(self):
+        return "<SampleTable track_ID={} samples={}>".format(self.track_ID, len(self))
+
+    @property
+    def pts(self):
+        if self.cts_offsets is None:
+            return self.dts
+        return array(U64 if min(self.cts_offsets, default=0) >= 0 else "q",
+                     map(int.__add__, self.dts, self.cts_offsets))
+
+    @property
+    def duration(self):
+        if not len(self):
+            return 0
+        return self.dts[-1] + self.durations[-1]
+
+    def is_sync(self, sample):
+        return self.sync is None or bool(self.sync[sample])
+
+    def sync_samples(self):
+        if self.sync is None:
+            return range(len(self))
+        return [i for i, flag in enumerate(self.sync) if flag]
+
+    def sample_at(self, time):
+        """
+        Index of the sample decoded at time (in the track timescale)
+        """
+        return max(bisect_right(self.dts, time) - 1, 0)
+
+    def sync_sample_at(self, time):
+        """
+        Index of the last sync sample at or before time, ie. where to start decoding to present time
+        """
+        sample = self.sample_at(time)
+        while sample > 0 and not self.is_sync(sample):
+            sample -= 1
+        return sample
+
+    def byte_ranges(self, first=0, last=None):
+        """
+        Coalesced (offset, size) byte ranges for the samples [first, last)
+        """
+        last = len(self) if last is None else last
+        ranges = []
+        for i in range(first, last):
+            offset, size = self.offsets[i], self.sizes[i]
+            if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+                ranges[-1][1] += size
+            else:
+                ranges.append([offset, size])
+        return [tuple(r) for r in ranges]
+
+    @classmethod
+    def from_trak(cls, fd, trak):
+        """
+        Build the table for the trak box header `trak` by decoding the raw tables, without construct
+        """
+        boxes = dict()
+        for header in iter_boxes(fd, trak.data_offset, trak.end, trak.depth + 1, recursive=True):
+            boxes.setdefault(header.type, header)
+
+        for required in (b"tkhd", b"mdhd", b"stbl"):
+            if required not in boxes:
+                raise BoxNotFound("could not find box of type: {}".format(required))
+
+        tkhd = read_payload(fd, boxes[b"tkhd"])
+        track_ID, = _u32.unpack_from(tkhd, 20 if tkhd[0] == 1 else 12)
+        mdhd = read_payload(fd, boxes[b"mdhd"])
+        timescale, = _u32.unpack_from(mdhd, 20 if mdhd[0] == 1 else 12)
+        handler_type = read_payload(fd, boxes[b"hdlr"])[8:12] if b"hdlr" in boxes else None
+
+        def table(type_):
+            return read_payload(fd, boxes[type_]) if type_ in boxes else None
+
+        if b"stsz" in boxes:
+            sizes = decode_stsz(table(b"stsz"))
+        elif b"stz2" in boxes:
+            sizes = decode_stz2(table(b"stz2"))
+        else:
+            sizes = array(U32)
+
+        durations = decode_stts(table(b"stts")) if b"stts" in boxes else array(U32)
+        if len(durations) != len(sizes):
+            raise MalformedBox("stts describes {} samples but stsz has {}".format(len(durations), len(sizes)))
+        dts = array(U64, [0])
+        dts.extend(accumulate(durations))
+        dts.pop()
+
+        if b"co64" in boxes:
+            chunk_offsets = decode_co64(table(b"co64"))
+        else:
+            chunk_offsets = decode_stco(table(b"stco")) if b"stco" in boxes else array(U64)
+        stsc = decode_stsc(table(b"stsc")) if b"stsc" in boxes else (array(U32), array(U32), array(U32))
+        offsets = chunk_sample_offsets(chunk_offsets, stsc, sizes)
+
+        cts_offsets = decode_ctts(table(b"ctts")) if b"ctts" in boxes else None
+        sync = None
+        if b"stss" in boxes:
+            sync = array(U8, bytes(len(sizes)))
+            for number in decode_stss(table(b"stss")):
+                if 0 < number <= len(sizes):
+                    sync[number - 1] = 1
+
+        return cls(track_ID, timescale, handler_type, offsets, sizes, dts, durations, cts_offsets, sync)
+
+    def with_runs(self, runs):
+        """
+        A table with the samples of the track runs of a fragmented file (see iter_track_runs) after the
+        samples of this one, which usually has none
+        """
+        offsets, sizes = array(U64, self.offsets), array(U32, self.sizes)
+        dts, durations = array(U64, self.dts), array(U32, self.durations)
+        cts_offsets = array(S32, bytes(4 * len(self))) if self.cts_offsets is None else array(S32, self.cts_offsets)
+        sync = array(U8, [1]) * len(self) if self.sync is None else array(U8, self.sync)
+        has_cts = self.cts_offsets is not None
+        for run in runs:
+            count = len(run.sizes)
+            if not count:
+                continue
+            offsets.extend(accumulate(chain((run.offset,), run.sizes[:-1])))
+            dts.extend(accumulate(chain((run.decode_time,), run.durations[:-1])))
+            sizes.extend(run.sizes)
+            durations.extend(run.durations)
+            if run.cts_offsets is not None:
+                has_cts = True
+                cts_offsets.extend(run.cts_offsets)
+            else:
+                cts_offsets.extend(array(S32, bytes(4 * count)))
+            sync.extend(array(U8, (0 if flags & SAMPLE_IS_NON_SYNC else 1 for flags in run.flags)))
+        return SampleTable(self.track_ID, self.timescale, self.handler_type, offsets, sizes, dts, durations,
+                           cts_offsets if has_cts else None, None if all(sync) else sync)
+
+
+def read_tracks(fd, moov=None):
+    """
+    Sample tables for every track in the file, or in the given moov box header
+    """
+    if moov is None:
+        for header in iter_boxes(fd):
+            if header.type == b"moov":
+                moov = header
+                break
+        else:
+            raise BoxNotFound("could not find box of type: {}".format(b"moov"))
+    return [SampleTable.from_trak(fd, header)
+            for header in iter_boxes(fd, moov.data_offset, moov.end, moov.depth + 1)
+            if header.type == b"trak"]
+
+
+def read_segments(fd):
+    """
+    Resolve the segment references of the top level sidx boxes, as (timescale, [Segment, ...]) per sidx
+    """
+    return [decode_sidx(read_payload(fd, header), header.end)
+            for header in iter_boxes(fd) if header.type == b"sidx"]
+
+
+# Movie fragments
+
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+TrackDefaults = namedtuple("TrackDefaults", "sample_description_index duration size flags")
+TrackRun = namedtuple("TrackRun", "track_ID sample_description_index decode_time offset durations sizes flags "
+                                  "cts_offsets")
+
+_NO_DEFAULTS = TrackDefaults(1, 0, 0, 0)
+
+
+def decode_trex(payload):
+    """
+    :returns: track_ID and the TrackDefaults of the track
+    """
+    values = struct.unpack_from(">4x5I", payload)
+    return values[0], TrackDefaults(*values[1:])
+
+
+def decode_tfhd(payload, defaults=None):
+    """
+    :returns: track_ID, base_data_offset (None when absent), default_base_is_moof and the TrackDefaults with
+              the overrides of the tfhd applied
+    """
+    flags = _u32.unpack_from(payload)[0] & 0xffffff
+    track_ID, = _u32.unpack_from(payload, 4)
+    description, duration, size, sample_flags = defaults or _NO_DEFAULTS
+    pos = 8
+    base_data_offset = None
+    if flags & 0x000001:
+        base_data_offset, = struct.unpack_from(">Q", payload, pos)
+        pos += 8
+    if flags & 0x000002:
+        description, = _u32.unpack_from(payload, pos)
+        pos += 4
+    if flags & 0x000008:
+        duration, = _u32.unpack_from(payload, pos)
+        pos += 4
+    if flags & 0x000010:
+        size, = _u32.unpack_from(payload, pos)
+        pos += 4
+    if flags & 0x000020:
+        sample_flags, = _u32.unpack_from(payload, pos)
+    return track_ID, base_data_offset, bool(flags & 0x020000), TrackDefaults(description, duration, size, sample_flags)
+
+
+def decode_trun(payload, defaults=_NO_DEFAULTS):
+    """
+    :returns: data_offset (None when absent) and the durations, sizes, sample flags and composition offsets
+              (None when absent) columns, the composition offsets are read as signed like in decode_ctts
+    """
+    flags = _u32.unpack_from(payload)[0] & 0xffffff
+    sample_count, = _u32.unpack_from(payload, 4)
+    pos = 8
+    data_offset = first_sample_flags = None
+    if flags & 0x000001:
+        data_offset, = struct.unpack_from(">i", payload, pos)
+        pos += 4
+    if flags & 0x000004:
+        first_sample_flags, = _u32.unpack_from(payload, pos)
+        pos += 4
+    present = [bool(flags & bit) for bit in (0x000100, 0x000200, 0x000400, 0x000800)]
+    width = sum(present)
+    words = be_array(U32, payload, pos, sample_count * width)
+    columns = []
+    column = 0
+    for is_present, default in zip(present, (defaults.duration, defaults.size, defaults.flags, None)):
+        if is_present:
+            columns.append(words[column::width])
+            column += 1
+        else:
+            columns.append(None if default is None else array(U32, [default]) * sample_count)
+    durations, sizes, sample_flags, cts_offsets = columns
+    if first_sample_flags is not None and sample_count:
+        sample_flags[0] = first_sample_flags
+    if cts_offsets is not None:
+        cts_offsets = array(S32, cts_offsets.tobytes())
+    return data_offset, durations, sizes, sample_flags, cts_offsets
+
+
+def read_trex(fd, moov=None):
+    """
+    TrackDefaults of every track from the trex boxes, keyed by track_ID
+    """
+    if moov is None:
+        moov = next((header for header in iter_boxes(fd) if header.type == b"moov"), None)
+        if moov is None:
+            raise BoxNotFound("could not find box of type: {}".format(b"moov"))
+    defaults = {}
+    for header in iter_boxes(fd, moov.data_offset, moov.end, moov.depth + 1, recursive=True):
+        if header.type == b"trex":
+            track_ID, track_defaults = decode_trex(read_payload(fd, header))
+            defaults[track_ID] = track_defaults
+    return defaults
+
+
+def iter_track_runs(fd, defaults=None, offset=0, end=None, decode_times=None):
+    """
+    Resolve every trun of the moof boxes between offset and end to a TrackRun, the offset of a run is the
+    file offset of its first sample and the samples of a run follow each other
+
+    :param defaults: TrackDefaults keyed by track_ID, see read_trex
+    :param decode_times: the next decode time of each track, for the trafs without a tfdt, the dict is
+                         updated as the runs are read so it can be passed along to the next segment
+    """
+    defaults = defaults or {}
+    decode_times = {} if decode_times is None else decode_times
+    for moof in iter_boxes(fd, offset, end):
+        if moof.type != b"moof":
+            continue
+        data_end = moof.offset
+        first = True
+        for traf in iter_boxes(fd, moof.data_offset, moof.end, moof.depth + 1):
+            if traf.type != b"traf":
+                continue
+            children = list(iter_boxes(fd, traf.data_offset, traf.end, traf.depth + 1))
+            tfhd = next((header for header in children if header.type == b"tfhd"), None)
+            if tfhd is None:
+                raise BoxNotFound("could not find box of type: {}".format(b"tfhd"))
+            payload = read_payload(fd, tfhd)
+            track_ID, base_data_offset, default_base_is_moof, track_defaults = decode_tfhd(
+                payload, defaults.get(_u32.unpack_from(payload, 4)[0]))
+            if base_data_offset is not None:
+                base = base_data_offset
+            elif default_base_is_moof or first:
+                base = moof.offset
+            else:
+                base = data_end
+            first = False
+
+            time = decode_times.get(track_ID, 0)
+            position = base
+            for header in children:
+                if header.type == b"tfdt":
+                    payload = read_payload(fd, header)
+                    time, = struct.unpack_from(">Q" if payload[0] == 1 else ">I", payload, 4)
+                elif header.type == b"trun":
+                    data_offset, durations, sizes, flags, cts_offsets = decode_trun(read_payload(fd, header),
+                                                                                    track_defaults)
+                    start = position if data_offset is None else base + data_offset
+                    yield TrackRun(track_ID, track_defaults.sample_description_index, time, start, durations,
+                                   sizes, flags, cts_offsets)
+                    position = start + sum(sizes)
+                    time += sum(durations)
+            data_end = position
+            decode_times[track_ID] = time
+
+
+def read_source(fd):
+    """
+    The moov box header and the SampleTable of every track of a progressive or fragmented file, the samples
+    of the track runs are added to the tables of a fragmented file
+    """
+    moov = next((header for header in iter_boxes(fd) if header.type == b"moov"), None)
+    if moov is None:
+        raise BoxNotFound("could not find box of type: {}".format(b"moov"))
+    traks = [header for header in iter_boxes(fd, moov.data_offset, moov.end, 1) if header.type == b"trak"]
+    tables = [SampleTable.from_trak(fd, trak) for trak in traks]
+
+    runs = dict((table.track_ID, []) for table in tables)
+    if any(header.type == b"moof" for header in iter_boxes(fd)):
+        for run in iter_track_runs(fd, read_trex(fd, moov)):
+            if run.track_ID in runs:
+                runs[run.track_ID].append(run)
+            else:
+                log.warning("skipping the samples of track %d, it is not in the moov", run.track_ID)
+        tables = [table.with_runs(runs[table.track_ID]) if runs[table.track_ID] else table for table in tables]
+    return moov, traks, tables
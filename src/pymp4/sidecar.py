@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Sidecar index files
+
+   A sidecar holds the box index, the resolved sample tables and the sidx segment references of an MP4
+   file, so that it only has to be analysed once. Everything is stored little endian and 8 byte aligned
+   so the columns can be used straight from an mmap without decoding.
+
+   Layout:
+       header   magic, version, source size and mtime, box/track/segment counts
+       boxes    offset Q, size Q, type 4s, header_size B, depth B
+       tracks   track_ID I, timescale I, handler_type 4s, sample count I, flags I followed by the columns
+                offsets Q, dts Q, sizes I, durations I, [cts_offsets i], [sync B]
+       segments offset Q, time Q, size I, duration I, starts_with_SAP I, timescale I
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+from pymp4.exceptions import MalformedBox
+from pymp4.index import BoxHeader, index_boxes
+from pymp4.samples import U8, U32, S32, U64, SampleTable, Segment, read_segments, read_tracks
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"PYMP4IDX"
+VERSION = 2
+SUFFIX = ".pymp4idx"
+
+_header = struct.Struct("<8sIIQQIII4x")
+_box = struct.Struct("<QQ4sBB10x")
+_track = struct.Struct("<II4sII")
+_segment = struct.Struct("<QQIIII")
+
+HAS_CTS = 0x1
+HAS_SYNC = 0x2
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+def _column(values, typecode):
+    if not isinstance(values, array) or values.typecode != typecode:
+        values = array(typecode, values)
+    if sys.byteorder != "little":
+        values = array(typecode, values)
+        values.byteswap()
+    data = values.tobytes()
+    return data + b"\x00" * _pad(len(data))
+
+
+def write_sidecar(path, boxes, tracks, segments=(), source_size=0, source_mtime=0):
+    """
+    Write a sidecar index
+
+    :param boxes: list of BoxHeaders
+    :param tracks: list of SampleTables
+    :param segments: list of (timescale, [Segment, ...]) as returned by read_segments
+    """
+    segments = [(timescale, segment) for timescale, refs in segments for segment in refs]
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fd:
+        fd.write(_header.pack(MAGIC, VERSION, 0, source_size, source_mtime,
+                              len(boxes), len(tracks), len(segments)))
+        for box in boxes:
+            fd.write(_box.pack(box.offset, box.size, box.type, box.header_size, box.depth))
+        for track in tracks:
+            flags = (HAS_CTS if track.cts_offsets is not None else 0) | (HAS_SYNC if track.sync is not None else 0)
+            fd.write(_track.pack(track.track_ID, track.timescale, track.handler_type or b"\x00" * 4,
+                                 len(track), flags))
+            fd.write(b"\x00" * _pad(_track.size))
+            fd.write(_column(track.offsets, U64))
+            fd.write(_column(track.dts, U64))
+            fd.write(_column(track.sizes, U32))
+            fd.write(_column(track.durations, U32))
+            if track.cts_offsets is not None:
+                fd.write(_column(track.cts_offsets, S32))
+            if track.sync is not None:
+                fd.write(_column(track.sync, U8))
+        for timescale, segment in segments:
+            fd.write(_segment.pack(segment.offset, segment.time, segment.size, segment.duration,
+                                   segment.starts_with_sap, timescale))
+    os.replace(tmp, path)
+
+
+def build_sidecar(source, path=None):
+    """
+    Analyse source and write its sidecar, next to the source by default
+
+    :returns: the path of the sidecar
+    """
+    path = path or source + SUFFIX
+    st = os.stat(source)
+    with open(source, "rb") as fd:
+        boxes = index_boxes(fd)
+        tracks = read_tracks(fd) if any(box.type == b"moov" for box in boxes) else []
+        segments = read_segments(fd)
+    write_sidecar(path, boxes, tracks, segments, st.st_size, st.st_mtime_ns)
+    return path
+
+
+class Sidecar(object):
+    """
+    A memory mapped sidecar index, see open_sidecar
+    """
+    def __init__(self, path):
+        self._fd = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fd.close()
+            raise MalformedBox("empty sidecar {}".format(path))
+        self._view = memoryview(self._mmap)
+        self._columns = []
+        try:
+            self._load(path)
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self, path):
+        if len(self._view) < _header.size:
+            raise MalformedBox("truncated sidecar {}".format(path))
+        (magic, version, _, self.source_size, self.source_mtime,
+         box_count, track_count, segment_count) = _header.unpack_from(self._view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise MalformedBox("{} is not a version {} sidecar".format(path, VERSION))
+
+        pos = _header.size
+        self._boxes = (pos, box_count)
+        pos += box_count * _box.size
+
+        self.tracks = []
+        for _ in range(track_count):
+            track_ID, timescale, handler_type, count, flags = _track.unpack_from(self._view, pos)
+            pos += _track.size + _pad(_track.size)
+            offsets, pos = self._cast(pos, count, U64)
+            dts, pos = self._cast(pos, count, U64)
+            sizes, pos = self._cast(pos, count, U32)
+            durations, pos = self._cast(pos, count, U32)
+            cts_offsets = sync = None
+            if flags & HAS_CTS:
+                cts_offsets, pos = self._cast(pos, count, S32)
+            if flags & HAS_SYNC:
+                sync, pos = self._cast(pos, count, U8)
+            self.tracks.append(SampleTable(track_ID, timescale, handler_type.rstrip(b"\x00") or None,
+                                           offsets, sizes, dts, durations, cts_offsets, sync))
+
+        self._segments = (pos, segment_count)
+        self._segment_list = None
+        self._segment_times = None
+
+    def _cast(self, pos, count, typecode):
+        size = array(typecode).itemsize * count
+        view = self._view[pos:pos + size]
+        if sys.byteorder == "little":
+            view = view.cast(typecode)
+            self._columns.append(view)
+        else:
+            view = array(typecode, view.tobytes())
+            view.byteswap()
+        return view, pos + size + _pad(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for view in self._columns:
+            view.release()
+        self._columns = []
+        self.tracks = []
+        self._view.release()
+        self._mmap.close()
+        self._fd.close()
+
+    @property
+    def boxes(self):
+        pos, count = self._boxes
+        headers = []
+        for offset, size, type_, header_size, depth in _box.iter_unpack(self._view[pos:pos + count * _box.size]):
+            headers.append(BoxHeader(type_, offset, size, header_size, depth))
+        return headers
+
+    def track(self, track_ID):
+        for track in self.tracks:
+            if track.track_ID == track_ID:
+                return track
+        raise KeyError(track_ID)
+
+    @property
+    def segments(self):
+        if self._segment_list is None:
+            pos, count = self._segments
+            self._segment_list = [(timescale, Segment(offset, size, time, duration, bool(sap)))
+                                  for offset, time, size, duration, sap, timescale
+                                  in _segment.iter_unpack(self._view[pos:pos + count * _segment.size])]
+        return self._segment_list
+
+    def segment_at(self, time):
+        """
+        The segment (from the sidx boxes) that contains time, in the sidx timescale
+        """
+        segments = self.segments
+        if not segments:
+            return None
+        if self._segment_times is None:
+            self._segment_times = [segment.time for _, segment in segments]
+        return segments[max(bisect_right(self._segment_times, time) - 1, 0)][1]
+
+    def is_stale(self, source):
+        st = os.stat(source)
+        return st.st_size != self.source_size or st.st_mtime_ns != self.source_mtime
+
+
+def open_sidecar(path):
+    return Sidecar(path)
+
+
+def load_sidecar(source, path=None):
+    """
+    Open the sidecar for source, (re)building it when it is missing or out of date
+    """
+    path = path or source + SUFFIX
+    if os.path.exists(path):
+        try:
+            sidecar = Sidecar(path)
+        except MalformedBox:
+            log.debug("rebuilding unreadable sidecar %s", path)
+        else:
+            if not sidecar.is_stale(source):
+                return sidecar
+            sidecar.close()
+    build_sidecar(source, path)
+    return Sidecar(path)
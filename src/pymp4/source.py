@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Random access sources
+
+   A source only has to implement read_at(offset, size) and size, which is all that object storage offers.
+   BlockCache turns the many small reads of the box headers into fetches of aligned blocks, kept in an LRU
+   cache, and SourceReader makes any source look like a seekable file, so it can be passed to iter_boxes,
+   read_tracks or Box.parse_stream as it is.
+
+       >>> reader = open_url("https://example.com/movie.mp4")
+       >>> for header, data in fetch_boxes(reader, [b"moov"]):
+       ...     moov = Box.parse(data)
+"""
+import http.client
+import io
+import logging
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from pymp4.index import iter_boxes
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE = 16 * 1024
+CACHE_BLOCKS = 1024
+MAX_READ_AHEAD = 64
+
+
+class Source(object):
+    """
+    Random access to bytes that are not necessarily in a local file
+    """
+    size = None
+
+    def read_at(self, offset, size):
+        """
+        Up to size bytes starting at offset, fewer only at the end of the source
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileSource(Source):
+    """
+    Source for a local file, a path or a file object
+    """
+    def __init__(self, file):
+        self._owned = not hasattr(file, "read")
+        self.fd = open(file, "rb") if self._owned else file
+        self._lock = threading.Lock()
+        self.fd.seek(0, io.SEEK_END)
+        self.size = self.fd.tell()
+
+    def read_at(self, offset, size):
+        with self._lock:
+            self.fd.seek(offset)
+            return self.fd.read(size)
+
+    def close(self):
+        if self._owned:
+            self.fd.close()
+
+
+class HTTPSource(Source):
+    """
+    Source for a URL of a server that supports range requests, over one kept alive connection
+    """
+    def __init__(self, url, headers=None, timeout=30):
+        self.url = url
+        self.parts = urlsplit(url)
+        if self.parts.scheme not in ("http", "https"):
+            raise ValueError("unsupported URL scheme {!r}".format(self.parts.scheme))
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._connection = None
+        self._lock = threading.Lock()
+        self.size = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.parts.scheme == "https" else http.client.HTTPConnection
+        return cls(self.parts.netloc, timeout=self.timeout)
+
+    def _request(self, offset, size):
+        path = self.parts.path or "/"
+        if self.parts.query:
+            path += "?" + self.parts.query
+        headers = dict(self.headers, Range="bytes={}-{}".format(offset, offset + size - 1))
+        for attempt in (0, 1):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request("GET", path, headers=headers)
+                response = self._connection.getresponse()
+                if response.status not in (206, 416):
+                    # a server that ignores the range sends the whole object, which is not downloaded
+                    self._connection.close()
+                    self._connection = None
+                    return response, b""
+                return response, response.read()
+            except (OSError, http.client.HTTPException) as e:
+                # the server may have closed the kept alive connection, try a new one once
+                self._connection.close()
+                self._connection = None
+                if attempt:
+                    raise IOError("range request for {} failed: {}".format(self.url, e))
+
+    def read_at(self, offset, size):
+        if size <= 0 or (self.size is not None and offset >= self.size):
+            return b""
+        with self._lock:
+            response, data = self._request(offset, size)
+            self.requests += 1
+            self.bytes_fetched += len(data)
+        if response.status == 416:
+            self.size = offset if self.size is None else self.size
+            return b""
+        if response.status != 206:
+            raise IOError("range request for {} returned HTTP {}".format(self.url, response.status))
+        match = re.match(r"bytes \d+-\d+/(\d+)", response.getheader("Content-Range") or "")
+        if match:
+            self.size = int(match.group(1))
+        return data
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class BlockCache(Source):
+    """
+    Reads a source in aligned blocks that are kept in an LRU cache
+
+    The missing blocks of a read are fetched in a single request. Reads that carry on where the previous one
+    stopped, like the walk through the boxes of a moov, fetch read_ahead more blocks each time, doubling up
+    to max_read_ahead, while a read elsewhere, such as the header after an mdat, only fetches its own blocks.
+    """
+    def __init__(self, source, block_size=BLOCK_SIZE, max_blocks=CACHE_BLOCKS, max_read_ahead=MAX_READ_AHEAD):
+        self.source = source
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.max_read_ahead = max_read_ahead
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.evictions = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.RLock()
+        self._next = None
+        self._read_ahead = 0
+
+    @property
+    def size(self):
+        if self.source.size is None:
+            # one block from the start tells the size, and is likely to be needed anyway
+            self._fetch(0, 1)
+        return self.source.size
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, fetches=self.fetches, evictions=self.evictions,
+                    blocks=len(self._blocks))
+
+    def _fetch(self, first, count):
+        data = self.source.read_at(first * self.block_size, count * self.block_size)
+        self.fetches += 1
+        for i in range(count):
+            block = data[i * self.block_size:(i + 1) * self.block_size]
+            self._blocks[first + i] = block
+            self._blocks.move_to_end(first + i)
+            if len(block) < self.block_size:
+                break
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+            self.evictions += 1
+
+    def prefetch(self, offset, size):
+        """
+        Fetch the missing blocks of a range with as few requests as possible, without reading them
+        """
+        if size <= 0:
+            return
+        first, last = offset // self.block_size, (offset + size - 1) // self.block_size
+        with self._lock:
+            block = first
+            while block <= last:
+                if block in self._blocks:
+                    block += 1
+                    continue
+                start = block
+                while block <= last and block not in self._blocks and block - start < self.max_blocks:
+                    block += 1
+                self._fetch(start, block - start)
+
+    def read_at(self, offset, size):
+        if size <= 0:
+            return b""
+        first, last = offset // self.block_size, (offset + size - 1) // self.block_size
+        with self._lock:
+            sequential = self._next is not None and 0 <= offset - self._next < self.block_size
+            self._read_ahead = min(max(1, self._read_ahead * 2), self.max_read_ahead) if sequential else 0
+            self._next = offset + size
+            if all(block in self._blocks for block in range(first, last + 1)):
+                self.hits += 1
+            else:
+                self.misses += 1
+                end = offset + size + self._read_ahead * self.block_size
+                if self.source.size is not None:
+                    end = min(end, self.source.size)
+                self.prefetch(offset, end - offset)
+            parts = []
+            for block in range(first, last + 1):
+                data = self._blocks.get(block)
+                if data is None:
+                    # evicted by the blocks of the same read, only for reads larger than the cache
+                    data = self.source.read_at(block * self.block_size, self.block_size)
+                else:
+                    self._blocks.move_to_end(block)
+                parts.append(data)
+                if len(data) < self.block_size:
+                    break
+        data = b"".join(parts)
+        start = offset - first * self.block_size
+        return data[start:start + size]
+
+    def close(self):
+        self.source.close()
+
+
+class SourceReader(io.RawIOBase):
+    """
+    Read only, seekable file object over a source
+    """
+    def __init__(self, source):
+        super(SourceReader, self).__init__()
+        self.source = source
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.source.size + offset
+        else:
+            raise ValueError("invalid whence {!r}".format(whence))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.source.size - self.position, 0)
+        data = self.source.read_at(self.position, size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.source.close()
+        super(SourceReader, self).close()
+
+
+def open_source(source, block_size=BLOCK_SIZE, max_blocks=CACHE_BLOCKS, max_read_ahead=MAX_READ_AHEAD):
+    """
+    SourceReader over a block cache of a Source, a URL, a path or a file object
+    """
+    if not isinstance(source, Source):
+        if isinstance(source, str) and re.match(r"https?://", source):
+            source = HTTPSource(source)
+        else:
+            source = FileSource(source)
+    return SourceReader(BlockCache(source, block_size, max_blocks, max_read_ahead))
+
+
+def open_url(url, headers=None, block_size=BLOCK_SIZE, max_blocks=CACHE_BLOCKS, max_read_ahead=MAX_READ_AHEAD):
+    return open_source(HTTPSource(url, headers), block_size, max_blocks, max_read_ahead)
+
+
+def fetch_boxes(reader, types=(b"moov",)):
+    """
+    Yield (header, data) for the top level boxes of the given types, each one fetched as a whole while the
+    other boxes, the mdat in particular, are stepped over by their headers
+    """
+    types = frozenset(types)
+    cache = reader.source if isinstance(reader, SourceReader) else None
+    for header in iter_boxes(reader):
+        if header.type not in types:
+            continue
+        if isinstance(cache, BlockCache):
+            cache.prefetch(header.offset, header.size)
+        reader.seek(header.offset)
+        yield header, reader.read(header.size)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Presentation timelines
+
+   The presentation time of a sample is its decode time (stts, or tfdt and the trun durations) plus its
+   composition offset (ctts, or the trun offsets), moved by the edit list (elst) of the track. The edit
+   list is reduced to a single shift, with the empty edits in front of the first media edit delaying the
+   track, so the presentation times of a whole track are computed in a single pass over its arrays.
+"""
+import logging
+import struct
+from array import array
+from collections import namedtuple
+from operator import add
+
+from pymp4 import writer
+from pymp4.index import iter_boxes, read_payload
+from pymp4.samples import decode_elst, read_source
+
+log = logging.getLogger(__name__)
+
+S64 = "q"
+
+Timeline = namedtuple("Timeline", "track_ID timescale pts start end edits")
+
+
+def edit_shift(edits, timescale, movie_timescale):
+    """
+    Reduce an edit list to the shift from the composition times to the presentation times and the
+    presentation window [start, end), all in the media timescale, end is None when the edit runs to the end
+    of the media
+
+    Only the first edit with media is used, the ones after it (as used for loops or cuts) are ignored.
+    """
+    delay = 0
+    media = [edit for edit in edits if edit.media_time != -1]
+    if len(media) > 1:
+        log.warning("only the first of the %d media edits is applied", len(media))
+    for edit in edits:
+        duration = edit.segment_duration * timescale // movie_timescale if movie_timescale else 0
+        if edit.media_time == -1:
+            delay += duration
+            continue
+        if edit.media_rate != 1:
+            log.warning("ignoring the rate %s of the edit at media time %d", edit.media_rate, edit.media_time)
+        return delay - edit.media_time, delay, delay + duration if duration else None
+    return delay, delay, None
+
+
+def presentation_times(table, shift=0):
+    """
+    Presentation time of every sample of a SampleTable in its timescale, in decode order
+    """
+    if table.cts_offsets is None:
+        return array(S64, map(shift.__add__, table.dts))
+    return array(S64, map(add, table.dts, map(shift.__add__, table.cts_offsets)))
+
+
+def _movie_timescale(fd, moov):
+    for header in iter_boxes(fd, moov.data_offset, moov.end, moov.depth + 1):
+        if header.type == b"mvhd":
+            payload = read_payload(fd, header)
+            return struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)[0]
+    return None
+
+
+def _edits(fd, trak):
+    for header in iter_boxes(fd, trak.data_offset, trak.end, trak.depth + 1, recursive=True):
+        if header.type == b"elst":
+            return decode_elst(read_payload(fd, header))
+    return []
+
+
+def read_timelines(source):
+    """
+    Timeline of every track of a progressive or fragmented file, source is a path or a file object
+    """
+    timelines = []
+    with writer.opened(source, "rb") as fd:
+        moov, traks, tables = read_source(fd)
+        movie_timescale = _movie_timescale(fd, moov)
+        for trak, table in zip(traks, tables):
+            edits = _edits(fd, trak)
+            shift, start, end = edit_shift(edits, table.timescale, movie_timescale)
+            timelines.append(Timeline(table.track_ID, table.timescale, presentation_times(table, shift), start,
+                                      end, edits))
+    return timelines
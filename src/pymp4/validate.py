@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Structural validation
+
+   validate walks the box headers of a file once, in order, and hands the boxes each Rule asks for to the
+   rule, which decodes no more than it needs to check them. A rule only keeps what it needs until the box
+   that settles it, such as the track runs of a moof until the mdat that follows, so the memory used does
+   not grow with the size of the file. Damaged ranges found by the walk are reported as issues too.
+
+       >>> for issue in validate("movie.mp4"):
+       ...     print(issue.offset, issue.rule, issue.message)
+"""
+import heapq
+import logging
+import struct
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from pymp4 import writer
+from pymp4.exceptions import BoxNotFound, MalformedBox
+from pymp4.index import iter_boxes, read_payload
+from pymp4.recover import recover_boxes
+from pymp4.samples import U32, U64, be_array, decode_co64, decode_sidx, decode_stco, iter_track_runs, read_trex
+
+log = logging.getLogger(__name__)
+
+ERROR = "error"
+WARNING = "warning"
+
+_u32 = struct.Struct(">I")
+
+
+Issue = namedtuple("Issue", "rule severity offset type message")
+
+
+def _type(header):
+    return header.type.decode("ascii", "replace") if header is not None else None
+
+
+class Context(object):
+    """
+    What the rules share about the file being validated
+    """
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.size = size
+        self.moov = None
+        self._defaults = None
+
+    def payload(self, header):
+        return read_payload(self.fd, header)
+
+    def track_defaults(self):
+        """
+        TrackDefaults of the trex boxes of the moov, empty before the moov has been seen
+        """
+        if self._defaults is None:
+            if self.moov is None:
+                return {}
+            self._defaults = read_trex(self.fd, self.moov)
+        return self._defaults
+
+
+class Rule(object):
+    """
+    A check of the boxes of a file
+
+    box is called with the header of every box of one of the types, or of every box when types is None, in
+    file order and with the parents before their children. It and finish, called once the whole file has
+    been walked, return the Issues they found. A rule that can not decode a box is reported as an issue
+    with that box and validation carries on.
+    """
+    name = None
+    types = frozenset()
+
+    def start(self, context):
+        pass
+
+    def box(self, context, header):
+        return ()
+
+    def finish(self, context):
+        return ()
+
+    def issue(self, offset, header, message, severity=ERROR):
+        return Issue(self.name, severity, offset, _type(header), message)
+
+
+class TrunDataRule(Rule):
+    """
+    The samples of the track runs of a moof are in the mdat that follows it
+    """
+    name = "trun-data"
+    types = frozenset([b"moof", b"mdat"])
+
+    def start(self, context):
+        self.moof = None
+        self.runs = []
+
+    def _missing(self):
+        if self.moof is None:
+            return []
+        return [self.issue(self.moof.offset, self.moof, "no mdat follows the moof")]
+
+    def box(self, context, header):
+        if header.depth != 0:
+            return []
+        if header.type == b"moof":
+            issues = self._missing()
+            self.moof = header
+            self.runs = [(run.track_ID, run.offset, run.offset + sum(run.sizes))
+                         for run in iter_track_runs(context.fd, context.track_defaults(), header.offset,
+                                                    header.end, {})]
+            return issues
+        issues = []
+        if self.moof is not None:
+            for track_ID, start, end in self.runs:
+                if start < header.data_offset or end > header.end:
+                    issues.append(self.issue(
+                        self.moof.offset, self.moof,
+                        "samples of track {} at [{}, {}) are outside the mdat at [{}, {})".format(
+                            track_ID, start, end, header.data_offset, header.end)))
+        self.moof = None
+        self.runs = []
+        return issues
+
+    def finish(self, context):
+        return self._missing()
+
+
+class SampleCountRule(Rule):
+    """
+    stsz (or stz2), stts and ctts describe the same number of samples
+    """
+    name = "sample-count"
+    types = frozenset([b"stbl"])
+
+    def box(self, context, header):
+        counts = {}
+        for child in iter_boxes(context.fd, header.data_offset, header.end, header.depth + 1):
+            if child.type in (b"stsz", b"stz2"):
+                counts["stsz"], = _u32.unpack_from(context.payload(child), 8)
+            elif child.type in (b"stts", b"ctts"):
+                payload = context.payload(child)
+                entry_count, = _u32.unpack_from(payload, 4)
+                counts[child.type.decode("ascii")] = sum(be_array(U32, payload, 8, entry_count * 2)[0::2])
+        if "stsz" not in counts:
+            return [self.issue(header.offset, header, "stbl has no stsz or stz2")]
+        return [self.issue(header.offset, header, "stsz has {} samples but {} has {}".format(
+                           counts["stsz"], name, counts[name]))
+                for name in ("stts", "ctts") if name in counts and counts[name] != counts["stsz"]]
+
+
+class ChunkOffsetRule(Rule):
+    """
+    The chunk offsets of stco and co64 point into an mdat
+
+    The tables are checked once every mdat has been seen, by reading them again. The mdat ranges are only
+    kept for progressive files, they are dropped at the first moof if the moov had no chunks by then.
+    """
+    name = "chunk-offset"
+    types = frozenset([b"stco", b"co64", b"mdat", b"moof"])
+
+    def start(self, context):
+        self.tables = []
+        self.starts, self.ends = array(U64), array(U64)
+        self.collect = True
+
+    def box(self, context, header):
+        if header.type in (b"stco", b"co64"):
+            if _u32.unpack_from(context.payload(header), 4)[0]:
+                self.tables.append(header)
+        elif header.type == b"moof":
+            if not self.tables:
+                self.collect = False
+                self.starts, self.ends = array(U64), array(U64)
+        elif header.depth == 0 and self.collect:
+            self.starts.append(header.data_offset)
+            self.ends.append(header.end)
+        return ()
+
+    def finish(self, context):
+        issues = []
+        for header in self.tables:
+            decode = decode_stco if header.type == b"stco" else decode_co64
+            outside = [offset for offset in decode(context.payload(header)) if not self._inside(offset)]
+            if outside:
+                issues.append(self.issue(header.offset, header, "{} chunk offsets are outside of every mdat, "
+                                                                "the first is {}".format(len(outside), outside[0])))
+        return issues
+
+    def _inside(self, offset):
+        i = bisect_right(self.starts, offset) - 1
+        return i >= 0 and offset < self.ends[i]
+
+
+class SidxRule(Rule):
+    """
+    The references of a sidx start and end on the boundaries of the top level boxes that follow it
+    """
+    name = "sidx-size"
+    types = None
+
+    def start(self, context):
+        # (boundary, sidx offset, reference number, edge) of the boundaries that have not been reached yet
+        self.pending = []
+
+    def _reference(self, pending, reason):
+        boundary, sidx, reference, edge = pending
+        return Issue(self.name, ERROR, sidx, "sidx", "reference {} of the sidx {} at {}, {}".format(
+            reference, edge, boundary, reason))
+
+    def box(self, context, header):
+        if header.depth != 0:
+            return []
+        issues = []
+        while self.pending and self.pending[0][0] <= header.offset:
+            pending = heapq.heappop(self.pending)
+            if pending[0] < header.offset:
+                issues.append(self._reference(pending, "inside the box before offset {}".format(header.offset)))
+        if header.type == b"sidx":
+            _, segments = decode_sidx(context.payload(header), header.end)
+            if segments:
+                heapq.heappush(self.pending, (segments[0].offset, header.offset, 0, "starts"))
+            for reference, segment in enumerate(segments):
+                heapq.heappush(self.pending, (segment.offset + segment.size, header.offset, reference, "ends"))
+        return issues
+
+    def finish(self, context):
+        issues = []
+        for pending in sorted(self.pending):
+            if pending[0] > context.size:
+                issues.append(self._reference(pending, "past the end of the file at {}".format(context.size)))
+            elif pending[0] < context.size:
+                issues.append(self._reference(pending, "inside the last box"))
+        return issues
+
+
+class SequenceNumberRule(Rule):
+    """
+    The sequence numbers of the mfhd boxes increase from one moof to the next
+    """
+    name = "sequence-number"
+    types = frozenset([b"mfhd"])
+
+    def start(self, context):
+        self.last = None
+
+    def box(self, context, header):
+        sequence_number, = _u32.unpack_from(context.payload(header), 4)
+        last, self.last = self.last, sequence_number
+        if last is not None and sequence_number <= last:
+            return [self.issue(header.offset, header, "sequence number {} does not follow {}".format(
+                sequence_number, last))]
+        return []
+
+
+DEFAULT_RULES = (TrunDataRule, SampleCountRule, ChunkOffsetRule, SidxRule, SequenceNumberRule)
+
+
+def _checked(rule, header, call):
+    try:
+        return list(call())
+    except (MalformedBox, BoxNotFound, struct.error, ValueError) as e:
+        return [rule.issue(header.offset if header is not None else 0, header, "could not decode: {}".format(e))]
+
+
+def validate(source, rules=None):
+    """
+    Yield the Issues found in source, a path or file object, in a single pass over its boxes
+
+    :param rules: Rule instances, an instance of each of DEFAULT_RULES by default
+    """
+    rules = [cls() for cls in DEFAULT_RULES] if rules is None else list(rules)
+    with writer.opened(source, "rb") as fd:
+        fd.seek(0, 2)
+        context = Context(fd, fd.tell())
+        for rule in rules:
+            rule.start(context)
+        damaged = []
+        reported = 0
+        for header in recover_boxes(fd, recursive=True, damaged=damaged):
+            for damage in damaged[reported:]:
+                yield Issue("structure", ERROR, damage.offset, None, damage.reason)
+            reported = len(damaged)
+            if header.depth == 0 and header.type == b"moov":
+                context.moov = header
+            for rule in rules:
+                if rule.types is None or header.type in rule.types:
+                    for issue in _checked(rule, header, lambda: rule.box(context, header)):
+                        yield issue
+        for damage in damaged[reported:]:
+            yield Issue("structure", ERROR, damage.offset, None, damage.reason)
+        for rule in rules:
+            for issue in _checked(rule, None, lambda: rule.finish(context)):
+                yield issue
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Encoders for the boxes that hold one entry per sample
+
+   The sample tables and track runs are written straight from arrays, the counterpart of the decoders in
+   pymp4.samples, so that the tables of long files never turn into lists of Containers.
+"""
+import logging
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+
+from pymp4.index import iter_boxes
+from pymp4.samples import U32, U64
+
+log = logging.getLogger(__name__)
+
+MAX_U32 = 0xffffffff
+COPY_SIZE = 1024 * 1024
+
+# trun flags
+DATA_OFFSET_PRESENT = 0x000001
+FIRST_SAMPLE_FLAGS_PRESENT = 0x000004
+SAMPLE_DURATION_PRESENT = 0x000100
+SAMPLE_SIZE_PRESENT = 0x000200
+SAMPLE_FLAGS_PRESENT = 0x000400
+SAMPLE_COMPOSITION_TIME_OFFSETS_PRESENT = 0x000800
+# tfhd flags
+DEFAULT_BASE_IS_MOOF = 0x020000
+
+# sample_flags of a sync sample, which depends on no other sample, and of any other sample
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+# boxes on the way from the moov to the sample tables
+_REWRITTEN = frozenset([b"moov", b"trak", b"mdia", b"minf"])
+
+_header = struct.Struct(">I4s")
+_large_header = struct.Struct(">I4sQ")
+
+
+@contextmanager
+def opened(file, mode):
+    """
+    Use file as it is when it is a file object, otherwise open the path
+    """
+    if hasattr(file, "read" if "r" in mode else "write"):
+        yield file
+    else:
+        with open(file, mode) as fd:
+            yield fd
+
+
+def copy_range(src, out, offset, size):
+    """
+    Copy size bytes of src starting at offset to out, a block at a time
+    """
+    src.seek(offset)
+    while size > 0:
+        data = src.read(min(size, COPY_SIZE))
+        if not data:
+            raise IOError("unexpected end of file at offset {}".format(src.tell()))
+        out.write(data)
+        size -= len(data)
+
+
+def be_bytes(typecode, values):
+    """
+    Big endian bytes of a sequence of integers, the reverse of pymp4.samples.be_array
+    """
+    if isinstance(values, array) and values.typecode == typecode and sys.byteorder == "big":
+        return values.tobytes()
+    data = array(typecode, values)
+    if sys.byteorder == "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def box_header(type_, payload_size):
+    """
+    Header of a box with a payload of payload_size bytes, with a 64 bit size when it does not fit in 32 bits
+    """
+    size = 8 + payload_size
+    if size > MAX_U32:
+        return _large_header.pack(1, type_, size + 8)
+    return _header.pack(size, type_)
+
+
+def box(type_, *payload):
+    """
+    A box from its type and payload parts
+    """
+    return b"".join((box_header(type_, sum(len(part) for part in payload)),) + payload)
+
+
+def full_box(type_, version, flags, *payload):
+    return box(type_, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+def rewrite(fd, header, replace, path=()):
+    """
+    Copy the box at header from fd, replacing some of the boxes on the way to the sample tables
+
+    replace(header, path) returns the bytes to write instead of the box, b"" to drop it, or None to keep it,
+    path holds the headers of the enclosing boxes. The children of moov, trak, mdia and minf are visited,
+    every other box is copied as it is.
+    """
+    data = replace(header, path)
+    if data is not None:
+        return data
+    if header.type not in _REWRITTEN:
+        fd.seek(header.offset)
+        return fd.read(header.size)
+    path += (header,)
+    return box(header.type, *(rewrite(fd, child, replace, path)
+                              for child in iter_boxes(fd, header.data_offset, header.end, header.depth + 1)))
+
+
+def _runs(values):
+    # run length encode a sequence into (counts, values) arrays
+    counts, run_values = array(U32), array("q")
+    previous = None
+    for value in values:
+        if counts and value == previous:
+            counts[-1] += 1
+        else:
+            counts.append(1)
+            run_values.append(value)
+            previous = value
+    return counts, run_values
+
+
+def _interleave(typecode, *columns):
+    width = len(columns)
+    out = array(typecode, bytes(array(typecode).itemsize * width * len(columns[0])))
+    for i, column in enumerate(columns):
+        out[i::width] = column if isinstance(column, array) and column.typecode == typecode \
+            else array(typecode, column)
+    return out
+
+
+def stts(durations):
+    counts, deltas = _runs(durations)
+    return full_box(b"stts", 0, 0, struct.pack(">I", len(counts)),
+                    be_bytes(U32, _interleave(U32, counts, array(U32, deltas))))
+
+
+def ctts(cts_offsets):
+    counts, offsets = _runs(cts_offsets)
+    version = 1 if any(offset < 0 for offset in offsets) else 0
+    offsets = array(U32, (offset & MAX_U32 for offset in offsets))
+    return full_box(b"ctts", version, 0, struct.pack(">I", len(counts)),
+                    be_bytes(U32, _interleave(U32, counts, offsets)))
+
+
+def stsz(sizes):
+    if len(sizes) and min(sizes) == max(sizes):
+        return full_box(b"stsz", 0, 0, struct.pack(">II", sizes[0], len(sizes)))
+    return full_box(b"stsz", 0, 0, struct.pack(">II", 0, len(sizes)), be_bytes(U32, sizes))
+
+
+def stsc(first_chunks, samples_per_chunk, sample_description_indexes):
+    return full_box(b"stsc", 0, 0, struct.pack(">I", len(first_chunks)),
+                    be_bytes(U32, _interleave(U32, first_chunks, samples_per_chunk, sample_description_indexes)))
+
+
+def stco(chunk_offsets):
+    """
+    stco, or co64 when an offset does not fit in 32 bits
+    """
+    if len(chunk_offsets) and max(chunk_offsets) > MAX_U32:
+        return full_box(b"co64", 0, 0, struct.pack(">I", len(chunk_offsets)), be_bytes(U64, chunk_offsets))
+    return full_box(b"stco", 0, 0, struct.pack(">I", len(chunk_offsets)), be_bytes(U32, chunk_offsets))
+
+
+def stss(sync):
+    """
+    stss from an array of per sample sync flags
+    """
+    numbers = array(U32, (i + 1 for i, flag in enumerate(sync) if flag))
+    return full_box(b"stss", 0, 0, struct.pack(">I", len(numbers)), be_bytes(U32, numbers))
+
+
+def mfhd(sequence_number):
+    return full_box(b"mfhd", 0, 0, struct.pack(">I", sequence_number))
+
+
+def tfhd(track_ID, flags=DEFAULT_BASE_IS_MOOF):
+    return full_box(b"tfhd", 0, flags, struct.pack(">I", track_ID))
+
+
+def tfdt(base_media_decode_time):
+    if base_media_decode_time > MAX_U32:
+        return full_box(b"tfdt", 1, 0, struct.pack(">Q", base_media_decode_time))
+    return full_box(b"tfdt", 0, 0, struct.pack(">I", base_media_decode_time))
+
+
+def trun(data_offset, durations, sizes, sample_flags=None, cts_offsets=None):
+    """
+    trun with a data offset and a duration and size for every sample, plus the flags and composition
+    offsets when given
+    """
+    flags = DATA_OFFSET_PRESENT | SAMPLE_DURATION_PRESENT | SAMPLE_SIZE_PRESENT
+    columns = [durations, sizes]
+    version = 0
+    if sample_flags is not None:
+        flags |= SAMPLE_FLAGS_PRESENT
+        columns.append(sample_flags)
+    if cts_offsets is not None:
+        flags |= SAMPLE_COMPOSITION_TIME_OFFSETS_PRESENT
+        if any(offset < 0 for offset in cts_offsets):
+            version = 1
+        columns.append(array(U32, (offset & MAX_U32 for offset in cts_offsets)))
+    return full_box(b"trun", version, flags, struct.pack(">Ii", len(sizes), data_offset),
+                    be_bytes(U32, _interleave(U32, *columns)))
+
+
+def sample_flags(sync):
+    """
+    trun sample_flags for an array of per sample sync flags
+    """
+    return array(U32, (SYNC_SAMPLE_FLAGS if flag else NON_SYNC_SAMPLE_FLAGS for flag in sync))
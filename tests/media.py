@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+   Small synthetic MP4 files for the tests
+"""
+import struct
+
+from construct import Container
+from pymp4.parser import Box
+
+SPS = b"\x67\x64\x00\x1f\xac\xd9\x40\x50"
+PPS = b"\x68\xeb\xe3\xcb"
+
+
+def video_sample(index, gop=4, size=20):
+    """
+    An AVC sample with 4 byte NAL lengths, an IDR slice every gop samples and a SEI on the IDRs
+    """
+    nal_type = 5 if index % gop == 0 else 1
+    slice_nal = bytes([0x60 | nal_type]) + bytes([index & 0xff]) * (size - 1)
+    sample = struct.pack(">I", len(slice_nal)) + slice_nal
+    if nal_type == 5:
+        sei = b"\x06\x05\x01\x00"
+        sample = struct.pack(">I", len(sei)) + sei + sample
+    return sample
+
+
+def audio_sample(index, size=12):
+    return bytes([0x80 | (index & 0x7f)]) * size
+
+
+def _stbl(entry, samples, chunk_size, chunk_offsets, delta, sync=None, cts_offsets=None):
+    children = [
+        Container(type=b"stsd")(version=0)(flags=0)(entries=[entry]),
+        Container(type=b"stts")(version=0)(flags=0)(entries=[
+            Container(sample_count=len(samples))(sample_delta=delta)
+        ]),
+        Container(type=b"stsc")(version=0)(flags=0)(entries=[
+            Container(first_chunk=1)(samples_per_chunk=chunk_size)(sample_description_index=1)
+        ]),
+        Container(type=b"stsz")(version=0)(flags=0)(sample_size=0)(sample_count=len(samples))
+        (entry_sizes=[len(s) for s in samples]),
+        Container(type=b"stco")(version=0)(flags=0)(entries=[
+            Container(chunk_offset=offset) for offset in chunk_offsets
+        ]),
+    ]
+    if cts_offsets is not None:
+        entries = []
+        for offset in cts_offsets:
+            if entries and entries[-1].sample_offset == offset:
+                entries[-1].sample_count += 1
+            else:
+                entries.append(Container(sample_count=1)(sample_offset=offset))
+        children.append(Container(type=b"ctts")(version=1 if min(cts_offsets) < 0 else 0)(entries=entries))
+    if sync is not None:
+        children.append(Container(type=b"stss")(version=0)(flags=0)(entries=[
+            Container(sample_number=n) for n in sync
+        ]))
+    return Container(type=b"stbl")(children=children)
+
+
+def _trak(track_ID, handler_type, timescale, duration, media_header, stbl, edits=None):
+    children = [
+        Container(type=b"tkhd")(version=0)(flags=1)(creation_time=0)(modification_time=0)
+        (track_ID=track_ID)(duration=duration)(layer=0)(alternate_group=0)(volume=0)
+        (width=0)(height=0),
+    ]
+    if edits is not None:
+        children.append(Container(type=b"edts")(children=[Container(type=b"elst")(entries=[
+            Container(segment_duration=segment_duration)(media_time=media_time)(media_rate_integer=1)
+            (media_rate_fraction=0) for segment_duration, media_time in edits
+        ])]))
+    return Container(type=b"trak")(children=children + [
+        Container(type=b"mdia")(children=[
+            Container(type=b"mdhd")(version=0)(creation_time=0)(modification_time=0)
+            (timescale=timescale)(duration=duration)(language="und"),
+            Container(type=b"hdlr")(handler_type=handler_type)(name=""),
+            Container(type=b"minf")(children=[media_header, stbl]),
+        ]),
+    ])
+
+
+def progressive(video_count=12, audio_count=8, gop=4, chunk_size=4, cts_offsets=None, edits=None):
+    """
+    ftyp, moov and mdat with an avc1 track (ID 1) and, if audio_count, an mp4a track (ID 2)
+
+    The chunks of the tracks are interleaved in the mdat, chunk_size samples at a time. cts_offsets gives
+    the video track a ctts, and edits, a list of (segment_duration, media_time), an edit list.
+    """
+    video = [video_sample(i, gop) for i in range(video_count)]
+    audio = [audio_sample(i) for i in range(audio_count)]
+    chunks = []
+    for i in range(0, max(video_count, audio_count), chunk_size):
+        if video[i:i + chunk_size]:
+            chunks.append((1, b"".join(video[i:i + chunk_size])))
+        if audio[i:i + chunk_size]:
+            chunks.append((2, b"".join(audio[i:i + chunk_size])))
+
+    avc1 = Container(format=b"avc1")(data_reference_index=1)(version=0)(revision=0)(vendor=b"brdy")
+    avc1(temporal_quality=0)(spatial_quality=0)(width=320)(height=240)(horizontal_resolution=72)
+    avc1(vertical_resolution=72)(data_size=0)(frame_count=1)(compressor_name=b"")(depth=24)
+    avc1(color_table_id=-1)(sample_info=[])
+    avc1(avc_data=Container(type=b"avcC")(version=1)(profile=100)(compatibility=0)(level=31)
+         (nal_unit_length_field=3)(sps=[SPS])(pps=[PPS]))
+    mp4a = Container(format=b"mp4a")(data_reference_index=1)(version=0)(revision=0)(vendor=0)
+    mp4a(channels=2)(bits_per_sample=16)(compression_id=0)(packet_size=0)(sampling_rate=48000)
+
+    def build(mdat_offset):
+        offsets = {1: [], 2: []}
+        pos = mdat_offset + 8
+        for track_ID, data in chunks:
+            offsets[track_ID].append(pos)
+            pos += len(data)
+        traks = [_trak(1, b"vide", 1000, 40 * video_count,
+                       Container(type=b"vmhd")(version=0)(flags=1)(graphics_mode=0)
+                       (opcolor=Container(red=0)(green=0)(blue=0)),
+                       _stbl(avc1, video, chunk_size, offsets[1], 40,
+                             sync=list(range(1, video_count + 1, gop)), cts_offsets=cts_offsets), edits)]
+        if audio:
+            traks.append(_trak(2, b"soun", 48000, 1024 * audio_count,
+                               Container(type=b"smhd")(version=0)(flags=0)(balance=0)(reserved=0),
+                               _stbl(mp4a, audio, chunk_size, offsets[2], 1024)))
+        return Box.build(Container(type=b"moov")(children=[
+            Container(type=b"mvhd")(version=0)(flags=0)(creation_time=0)(modification_time=0)
+            (timescale=1000)(duration=40 * video_count)(next_track_ID=3),
+        ] + traks))
+
+    ftyp = Box.build(Container(type=b"ftyp")(major_brand=b"isom")(minor_version=512)
+                     (compatible_brands=[b"isom", b"avc1"]))
+    moov = build(0)
+    moov = build(len(ftyp) + len(moov))
+    payload = b"".join(data for _, data in chunks)
+    return ftyp + moov + struct.pack(">I", len(payload) + 8) + b"mdat" + payload
+
+
+def _traf(track_ID, base_time, sizes, duration, data_offset, tfdt_version=0, base_data_offset=None):
+    tfhd_flags = Container(default_base_is_moof=base_data_offset is None)(duration_is_empty=False)
+    tfhd_flags(default_sample_flags_present=False)
+    tfhd_flags(default_sample_size_present=False)(default_sample_duration_present=False)
+    tfhd_flags(sample_description_index_present=False)(base_data_offset_present=base_data_offset is not None)
+    trun_flags = Container(sample_composition_time_offsets_present=False)(sample_flags_present=False)
+    trun_flags(sample_size_present=True)(sample_duration_present=True)(first_sample_flags_present=False)
+    trun_flags(data_offset_present=True)
+    return Container(type=b"traf")(children=[
+        Container(type=b"tfhd")(version=0)(flags=tfhd_flags)(track_ID=track_ID)(base_data_offset=base_data_offset),
+        Container(type=b"tfdt")(version=tfdt_version)(baseMediaDecodeTime=base_time),
+        Container(type=b"trun")(version=0)(flags=trun_flags)(sample_count=len(sizes))(data_offset=data_offset)
+        (sample_info=[Container(sample_duration=duration)(sample_size=size)(sample_flags=None)
+                      (sample_composition_time_offsets=None) for size in sizes]),
+    ])
+
+
+def fragment(sequence_number=1, base_times=(0,), sample_count=4, tfdt_version=0, sidx=False, moof_offset=None):
+    """
+    moof and mdat with a traf per base time for the tracks 1, 2, ..., video samples for track 1 and audio
+    samples for the others
+
+    The trafs use default_base_is_moof and trun data offsets, or with moof_offset, the file offset of the
+    moof as an absolute base_data_offset. With sidx, a segment index referencing the fragment is put in
+    front of it.
+    """
+    tracks = []
+    for i, base_time in enumerate(base_times):
+        first = base_time // 40 if i == 0 else 0
+        sample = video_sample if i == 0 else audio_sample
+        tracks.append((i + 1, base_time, [sample(first + n) for n in range(sample_count)], 40 if i == 0 else 1024))
+
+    def build(moof_size):
+        trafs = []
+        data_offset = moof_size + 8
+        for track_ID, base_time, track_samples, duration in tracks:
+            trafs.append(_traf(track_ID, base_time, [len(s) for s in track_samples], duration, data_offset,
+                               tfdt_version, moof_offset))
+            data_offset += sum(len(s) for s in track_samples)
+        return Box.build(Container(type=b"moof")(children=[
+            Container(type=b"mfhd")(sequence_number=sequence_number),
+        ] + trafs))
+
+    moof = build(len(build(0)))
+    payload = b"".join(b"".join(track_samples) for _, _, track_samples, _ in tracks)
+    data = moof + struct.pack(">I", len(payload) + 8) + b"mdat" + payload
+    if sidx:
+        data = Box.build(Container(type=b"sidx")(version=0)(reference_ID=1)(timescale=1000)
+                         (earliest_presentation_time=base_times[0])(first_offset=0)(reference_count=1)
+                         (references=[Container(reference_type="MEDIA")(referenced_size=len(data))
+                                      (segment_duration=40 * sample_count)(starts_with_SAP=True)(SAP_type=1)
+                                      (SAP_delta_time=0)])) + data
+    return data
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+from array import array
+
+from pymp4.analytics import analyze, bitrate, gops, timing
+from pymp4.remux import remux
+from pymp4.samples import U32, U64, SampleTable
+
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+
+def table(sizes, durations, sync=None, timescale=1000):
+    dts = array(U64, [0])
+    for duration in durations[:-1]:
+        dts.append(dts[-1] + duration)
+    return SampleTable(1, timescale, b"vide", array(U64, range(len(sizes))), array(U32, sizes), dts,
+                       array(U32, durations), None, None if sync is None else array("B", sync))
+
+
+class AnalyticsTests(unittest.TestCase):
+    def test_bitrate(self):
+        sizes = [1000, 100, 100, 100, 2000, 100, 100, 100, 500, 100]
+        stats = bitrate(table(sizes, [250] * 10), window=1.0)
+        self.assertAlmostEqual(stats.average, 8 * sum(sizes) / 2.5)
+        # the busiest second starts at the 5th sample
+        self.assertEqual(stats.peak, 8 * 2300)
+        self.assertListEqual(list(stats.windows), [8 * 1300, 8 * 2300, 8 * 600])
+
+        for window in (0.3, 0.5, 0.75):
+            stats = bitrate(table(sizes, [250] * 10), window)
+            naive = max(sum(size for j, size in enumerate(sizes) if i * 250 <= j * 250 < i * 250 + window * 1000)
+                        for i in range(len(sizes)))
+            self.assertEqual(stats.peak, 8 * naive / window)
+
+    def test_gops(self):
+        stats = gops(table([10] * 10, [40] * 10, [1, 0, 0, 0, 1, 0, 0, 1, 0, 0]))
+        self.assertListEqual(list(stats.lengths), [4, 3, 3])
+        self.assertDictEqual(stats.distribution, {3: 2, 4: 1})
+        self.assertListEqual(list(stats.keyframe_intervals), [0.16, 0.12])
+        self.assertListEqual(list(gops(table([10] * 3, [40] * 3)).lengths), [1, 1, 1])
+
+    def test_timing(self):
+        frames = table([10] * 6, [40, 40, 40, 41, 40, 39])
+        stats = timing(frames)
+        self.assertEqual((stats.sample_duration, stats.sample_rate, stats.irregular), (40, 25.0, 2))
+        self.assertEqual((stats.min_duration, stats.max_duration, stats.discontinuities), (39, 41, 0))
+        self.assertAlmostEqual(stats.duration, 0.24)
+        frames.dts[3] += 80
+        self.assertEqual(timing(frames).discontinuities, 2)
+
+    def test_analyze(self):
+        fragmented = io.BytesIO()
+        remux(io.BytesIO(progressive()), fragmented, fragment_duration=0.16)
+        for data in (progressive(), fragmented.getvalue()):
+            video, audio = analyze(io.BytesIO(data)).tracks
+            self.assertEqual((video.sample_count, audio.sample_count), (12, 8))
+            self.assertListEqual(list(video.gops.lengths), [4, 4, 4])
+            self.assertEqual(video.timing.sample_rate, 25.0)
+            self.assertAlmostEqual(audio.timing.duration, 8 * 1024 / 48000.0)
+            drift = analyze(io.BytesIO(data)).drift
+            self.assertEqual((drift.video_track_ID, drift.audio_track_ID, drift.start), (1, 2, 0.0))
+            self.assertAlmostEqual(drift.end, 8 * 1024 / 48000.0 - 0.48)
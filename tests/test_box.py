@@ -18,7 +18,7 @@ import logging
 import unittest
 
 from construct import Container
-from pymp4.parser import Box
+from pymp4.parser import Box, HVCC
 
 log = logging.getLogger(__name__)
 
@@ -130,3 +130,41 @@ class BoxTests(unittest.TestCase):
             (entries=[Container(format=b'tx3g')(data_reference_index=1)(data=tx3g_data)])
             (end=len(in_bytes))
         )
+
+    def test_hvcc_parse_build(self):
+        hvcc_data = (b'\x01\x01\x60\x00\x00\x00\x90\x00\x00\x00\x00\x00\x5d\xf0\x00\xfc\xfd\xf8\xf8\x00\x00\x0f'
+                     b'\x03'
+                     b'\xa0\x00\x01\x00\x04\x40\x01\x0c\x01'
+                     b'\xa1\x00\x01\x00\x03\x42\x01\x01'
+                     b'\xa2\x00\x02\x00\x02\x44\x01\x00\x02\x44\x02')
+        hvcc = HVCC.parse(hvcc_data)
+        self.assertEqual(hvcc.general_profile, 1)
+        self.assertEqual(hvcc.general_level, 0x5d)
+        self.assertEqual(hvcc.nalu_length_size, 3)
+        self.assertEqual(
+            hvcc.arrays,
+            [Container(array_completeness=True)(nal_unit_type=32)(nal_units=[b'\x40\x01\x0c\x01']),
+             Container(array_completeness=True)(nal_unit_type=33)(nal_units=[b'\x42\x01\x01']),
+             Container(array_completeness=True)(nal_unit_type=34)(nal_units=[b'\x44\x01', b'\x44\x02'])]
+        )
+        self.assertEqual(HVCC.build(hvcc), hvcc_data)
+
+    def test_ctts_parse_build(self):
+        data = (b'\x00\x00\x00\x20ctts\x01\x00\x00\x00\x00\x00\x00\x02'
+                b'\x00\x00\x00\x02\xff\xff\xff\xd8\x00\x00\x00\x01\x00\x00\x00\x50')
+        ctts = Box.parse(data)
+        self.assertEqual(ctts.version, 1)
+        self.assertListEqual([(e.sample_count, e.sample_offset) for e in ctts.entries], [(2, -40), (1, 80)])
+        self.assertEqual(Box.build(ctts), data)
+        # version 0 offsets are unsigned
+        ctts = Box.parse(data[:8] + b'\x00' + data[9:])
+        self.assertEqual(ctts.entries[0].sample_offset, 0xffffffd8)
+
+    def test_edts_parse_build(self):
+        edts = Box.parse(Box.build(dict(type=b"edts", children=[dict(type=b"elst", version=1, entries=[
+            dict(segment_duration=1000, media_time=-1, media_rate_integer=1, media_rate_fraction=0),
+            dict(segment_duration=2 ** 40, media_time=80, media_rate_integer=1, media_rate_fraction=0),
+        ])])))
+        elst, = edts.children
+        self.assertEqual(elst.type, b"elst")
+        self.assertListEqual([(e.segment_duration, e.media_time) for e in elst.entries], [(1000, -1), (2 ** 40, 80)])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import struct
+import unittest
+
+from pymp4.budget import ParseBudget, parse_budget
+from pymp4.parser import MP4, Box, BudgetExceeded, box_hook
+from tests.media import fragment, progressive
+
+log = logging.getLogger(__name__)
+
+
+def with_count(data, type_, offset, count):
+    # data with the count at offset in the first box of type_ replaced
+    start = data.index(type_) - 4
+    return data[:start + offset] + struct.pack(">I", count) + data[start + offset + 4:]
+
+
+class BudgetTests(unittest.TestCase):
+    def test_counts(self):
+        # the counts of a trun, a stsz and a prefixed stts table that are far too large for their boxes
+        for data in (with_count(fragment(), b"trun", 12, 10 ** 9), with_count(progressive(), b"stsz", 16, 2 ** 32 - 1),
+                     with_count(progressive(), b"stts", 12, 2 ** 30)):
+            with self.assertRaises(BudgetExceeded):
+                MP4.parse(data)
+
+    def test_within_budget(self):
+        data = progressive()
+        with parse_budget(max_objects=1000, max_bytes=len(data), max_depth=8, timeout=60) as budget:
+            MP4.parse(data)
+        self.assertEqual(budget.bytes, len(data))
+        self.assertEqual(budget.depth, 0)
+        self.assertGreater(budget.objects, 12 + 8)
+
+    def test_limits(self):
+        data = progressive()
+        for limits in (dict(max_objects=50), dict(max_bytes=len(data) - 1), dict(max_depth=4)):
+            with parse_budget(**limits):
+                with self.assertRaises(BudgetExceeded):
+                    MP4.parse(data)
+
+    def test_timeout(self):
+        ticks = iter(range(100))
+        budget = ParseBudget(timeout=5, clock=lambda: next(ticks))
+        with box_hook(budget):
+            with self.assertRaises(BudgetExceeded):
+                MP4.parse(progressive())
+        Box.parse(b'\x00\x00\x00\x08free')
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from pymp4.cache import BoxCache
+
+log = logging.getLogger(__name__)
+
+
+class CacheTests(unittest.TestCase):
+    init = (b'\x00\x00\x00\x18ftypiso5\x00\x00\x00\x01iso5avc1'
+            b'\x00\x00\x00\x30moov'
+            b'\x00\x00\x00\x28mvex'
+            b'\x00\x00\x00\x20trex\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01'
+            b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+    data = init + b'\x00\x00\x00\x0cmdatdata'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "test.mp4")
+        with open(self.path, "wb") as fd:
+            fd.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_init_segment(self):
+        cache = BoxCache()
+        boxes = cache.init_segment(self.path)
+        self.assertListEqual([box.type for box in boxes], [b"ftyp", b"moov"])
+        self.assertIs(cache.init_segment(self.path), boxes)
+        self.assertEqual(cache.hits, 2)
+
+    def test_lru_eviction(self):
+        cache = BoxCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_maxbytes(self):
+        cache = BoxCache(maxbytes=100)
+        cache.put("a", 1, cost=60)
+        cache.put("b", 2, cost=60)
+        self.assertListEqual([k for k in ("a", "b") if k in cache], ["b"])
+        self.assertEqual(cache.currbytes, 60)
+
+    def test_content_key(self):
+        cache = BoxCache()
+        cache.parse(self.data)
+        cache.parse(bytearray(self.data))
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_file_change(self):
+        cache = BoxCache()
+        cache.index(self.path)
+        with open(self.path, "ab") as fd:
+            fd.write(b'\x00\x00\x00\x08free')
+        self.assertEqual(len(cache.index(self.path)), 6)
+        self.assertEqual(cache.misses, 2)
+
+    def test_disk_store(self):
+        directory = os.path.join(self.tmpdir, "cache")
+        BoxCache(directory=directory).parse(self.path)
+        cache = BoxCache(directory=directory)
+        boxes = cache.parse(self.path)
+        self.assertEqual(boxes[1].children[0].children[0].track_ID, 1)
+        self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual(cache.misses, 0)
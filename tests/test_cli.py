@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from pymp4.cli import dump
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+
+class DumpTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "test.mp4")
+        with open(self.path, "wb") as fd:
+            fd.write(progressive(video_count=30))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_dump(self, *args):
+        out = io.StringIO()
+        argv = sys.argv
+        sys.argv = ["mp4dump", self.path] + list(args)
+        try:
+            with redirect_stdout(out):
+                dump()
+        finally:
+            sys.argv = argv
+        return out.getvalue()
+
+    def test_ndjson(self):
+        records = [json.loads(line) for line in self.run_dump("--format", "ndjson").splitlines()]
+        self.assertListEqual([r["type"] for r in records if r["depth"] == 0], ["ftyp", "moov", "mdat"])
+        stsz = [r for r in records if r["type"] == "stsz"][0]
+        self.assertEqual(stsz["path"], "moov/trak/mdia/minf/stbl/stsz")
+        self.assertEqual(stsz["fields"]["entry_sizes"]["count"], 30)
+        self.assertEqual(len(stsz["fields"]["entry_sizes"]["first"]), 10)
+
+    def test_json(self):
+        records = json.loads(self.run_dump("--format", "json", "--max-depth", "0"))
+        self.assertListEqual([r["type"] for r in records], ["ftyp", "moov", "mdat"])
+
+    def test_types(self):
+        out = self.run_dump("--types", "tkhd,stss", "--full")
+        self.assertListEqual([line.split()[0] for line in out.splitlines() if "offset=" in line],
+                             ["tkhd", "stss", "tkhd"])
+        self.assertIn("sample_number = 29", out)
+
+    def test_profile(self):
+        err = io.StringIO()
+        with redirect_stderr(err):
+            self.run_dump("--profile", "--types", "ftyp")
+        profiled = [line.split()[0] for line in err.getvalue().splitlines()[1:]]
+        for type_ in ("moov", "trak", "stsz", "stts", "stco", "stsd"):
+            self.assertIn(type_, profiled)
+        self.assertEqual(profiled.count("stsz"), 1)
+        self.assertNotIn("mdat", profiled)
+
+    def test_text(self):
+        out = self.run_dump("--max-depth", "1")
+        self.assertIn("    mvhd (offset=32, size=108)", out)
+        self.assertNotIn("mdia", out)
+
+    def test_recover(self):
+        with open(self.path, "r+b") as fd:
+            fd.truncate(os.path.getsize(self.path) - 10)
+        with self.assertRaises(SystemExit) as raised:
+            self.run_dump("--format", "ndjson", "--max-depth", "0", "--recover")
+        self.assertEqual(raised.exception.code, 2)
+
+    def test_recover_output(self):
+        with open(self.path, "r+b") as fd:
+            data = fd.read()
+            fd.seek(0)
+            fd.write(data[:24] + b"\xff" * 16 + data[24:])
+        out = io.StringIO()
+        argv = sys.argv
+        sys.argv = ["mp4dump", self.path, "--format", "ndjson", "--max-depth", "0", "--recover"]
+        try:
+            with redirect_stdout(out), self.assertRaises(SystemExit):
+                dump()
+        finally:
+            sys.argv = argv
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertListEqual([r.get("type", "damaged") for r in records], ["ftyp", "damaged", "moov", "mdat"])
+        self.assertEqual((records[1]["offset"], records[1]["size"]), (24, 16))
+
+    def test_follow(self):
+        records = [json.loads(line) for line in self.run_dump("--format", "ndjson", "--max-depth", "0", "--follow",
+                                                              "--idle-timeout", "0").splitlines()]
+        self.assertListEqual([r["type"] for r in records], ["ftyp", "moov", "mdat"])
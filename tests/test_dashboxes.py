@@ -49,3 +49,46 @@ class BoxTests(unittest.TestCase):
                 iv_size=8,
                 is_encrypted=1)),
             b'\x00\x00\x00 tenc\x00\x00\x00\x00\x00\x00\x01\x083{\x96C!\xb6CU\x9eY>\xcc\xb4l~\xf7')
+
+    def test_emsg_parse_build(self):
+        data = (b'\x00\x00\x00\x39emsg\x00\x00\x00\x00urn:scte:scte35:2013:bin\x001\x00'
+                b'\x00\x01\x5f\x90\x00\x00\x00\x0a\x00\x00\x03\x84\x00\x00\x00\x07\xfc\x30')
+        emsg = Box.parse(data)
+        self.assertEqual((emsg.version, emsg.scheme_id_uri, emsg.value), (0, u"urn:scte:scte35:2013:bin", u"1"))
+        self.assertEqual((emsg.timescale, emsg.presentation_time_delta, emsg.event_duration, emsg.id),
+                         (90000, 10, 900, 7))
+        self.assertEqual(emsg.message_data, b'\xfc\x30')
+        self.assertEqual(Box.build(emsg), data)
+
+        emsg = Box.parse(Box.build(dict(type=b"emsg", version=1, timescale=90000, presentation_time=2 ** 33,
+                                        event_duration=0, id=1, scheme_id_uri=u"urn:x", value=u"")))
+        self.assertEqual((emsg.presentation_time, emsg.scheme_id_uri, emsg.message_data), (2 ** 33, u"urn:x", b""))
+
+    def test_prft_parse_build(self):
+        data = b'\x00\x00\x00\x1cprft\x00\x00\x00\x18\x00\x00\x00\x01\xe0\x00\x00\x00\x80\x00\x00\x00\x00\x00\x0f\xa0'
+        prft = Box.parse(data)
+        self.assertEqual((prft.version, prft.flags, prft.reference_track_ID), (0, 0x18, 1))
+        self.assertEqual((prft.ntp_timestamp, prft.media_time), (0xe000000080000000, 4000))
+        self.assertEqual(Box.build(prft), data)
+
+    def test_sgpd_sbgp_parse_build(self):
+        sgpd = Box.parse(Box.build(dict(type=b"sgpd", grouping_type=b"seig", entries=[
+            dict(data=dict(is_encrypted=1, iv_size=8, key_ID=UUID('337b9643-21b6-4355-9e59-3eccb46c7ef7'))),
+            dict(data=dict(is_encrypted=1, iv_size=0, key_ID=UUID('00112233-4455-6677-8899-aabbccddeeff'),
+                           byte_blocks=dict(crypt=1, skip=9), constant_iv=[1] * 16))])))
+        self.assertEqual((sgpd.version, sgpd.default_length), (1, 0))
+        self.assertListEqual([e.description_length for e in sgpd.entries], [20, 37])
+        self.assertEqual((sgpd.entries[1].data.byte_blocks.skip, sgpd.entries[1].data.constant_iv), (9, [1] * 16))
+
+        sgpd = Box.parse(Box.build(dict(type=b"sgpd", version=2, grouping_type=b"seig", default_group_description_index=1,
+                                        entries=[dict(data=dict(is_encrypted=0, iv_size=0, key_ID=UUID(int=0)))])))
+        self.assertEqual((sgpd.default_group_description_index, sgpd.entries[0].description_length), (1, None))
+        self.assertEqual(sgpd.entries[0].data.is_encrypted, 0)
+
+        data = b'\x00\x00\x00\x24sbgp\x00\x00\x00\x00seig\x00\x00\x00\x02\x00\x00\x00\x0a\x00\x00\x00\x01' \
+               b'\x00\x00\x00\x05\x00\x01\x00\x01'
+        sbgp = Box.parse(data)
+        self.assertEqual(sbgp.grouping_type, b"seig")
+        self.assertListEqual([(e.sample_count, e.group_description_index) for e in sbgp.entries],
+                             [(10, 1), (5, 0x10001)])
+        self.assertEqual(Box.build(sbgp), data)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from pymp4.demux import RAW, demux
+from pymp4.flatten import flatten
+from pymp4.index import iter_boxes
+from pymp4.remux import remux
+from pymp4.samples import read_tracks
+from tests.media import PPS, SPS, audio_sample, progressive, video_sample
+
+log = logging.getLogger(__name__)
+
+
+class RecordingReader(io.BytesIO):
+    """
+    BytesIO that records the ranges read from it
+    """
+    def __init__(self, data):
+        super(RecordingReader, self).__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        offset = self.tell()
+        data = super(RecordingReader, self).read(size)
+        self.reads.append((offset, len(data)))
+        return data
+
+
+class DemuxTests(unittest.TestCase):
+    def setUp(self):
+        self.progressive = progressive(video_count=12, audio_count=8, gop=4)
+        out = io.BytesIO()
+        remux(io.BytesIO(self.progressive), out, fragment_duration=0.16)
+        self.fragmented = out.getvalue()
+
+    def demux(self, data, **kwargs):
+        outputs = {}
+        src = RecordingReader(data)
+
+        def output(info):
+            outputs[info.track_ID] = io.BytesIO()
+            return outputs[info.track_ID]
+
+        infos = demux(src, output, **kwargs)
+        return infos, dict((track_ID, out.getvalue()) for track_ID, out in outputs.items()), src
+
+    def check_fmp4(self, data):
+        infos, outputs, src = self.demux(data, fragment_duration=0.16)
+        self.assertListEqual([(i.track_ID, i.kind, i.language, i.sample_count) for i in infos],
+                             [(1, "video", "und", 12), (2, "audio", "und", 8)])
+        for track_ID, expected in ((1, [video_sample(i, 4) for i in range(12)]),
+                                   (2, [audio_sample(i) for i in range(8)])):
+            flat = io.BytesIO()
+            flatten(io.BytesIO(outputs[track_ID]), output=flat)
+            flat = flat.getvalue()
+            table, = read_tracks(io.BytesIO(flat))
+            self.assertEqual(table.track_ID, track_ID)
+            self.assertListEqual([flat[o:o + s] for o, s in zip(table.offsets, table.sizes)], expected)
+        # every byte of the samples is read once, for both tracks
+        mdats = [h for h in iter_boxes(io.BytesIO(data)) if h.type == b"mdat"]
+        read = sum(max(0, min(offset + size, h.end) - max(offset, h.data_offset))
+                   for offset, size in src.reads for h in mdats)
+        self.assertEqual(read, sum(h.data_size for h in mdats))
+
+    def test_progressive(self):
+        self.check_fmp4(self.progressive)
+
+    def test_fragmented(self):
+        self.check_fmp4(self.fragmented)
+
+    def test_raw(self):
+        _, outputs, _ = self.demux(self.fragmented, format=RAW)
+        start_code = b"\x00\x00\x00\x01"
+        expected = b""
+        for i in range(12):
+            if i % 4 == 0:
+                expected += start_code + SPS + start_code + PPS + start_code + b"\x06\x05\x01\x00"
+            expected += start_code + video_sample(i, 4)[-20:]
+        self.assertEqual(outputs[1], expected)
+        self.assertEqual(outputs[2], b"".join(audio_sample(i) for i in range(8)))
+
+    def test_template(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infos = demux(io.BytesIO(self.progressive), os.path.join(tmpdir, "{kind}-{track_ID}.mp4"))
+            self.assertEqual(len(infos), 2)
+            self.assertListEqual(sorted(os.listdir(tmpdir)), ["audio-2.mp4", "video-1.mp4"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_skip(self):
+        infos, outputs, _ = self.demux(self.progressive)
+        self.assertEqual(len(outputs), 2)
+        infos = demux(io.BytesIO(self.progressive), lambda info: io.BytesIO() if info.kind == "audio" else None)
+        self.assertListEqual([info.track_ID for info in infos], [2])
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from uuid import UUID
+
+from construct import Container
+
+from pymp4.cli import drm
+from pymp4.drm import read_sample_keys, scan, scan_many, to_record
+from pymp4.index import iter_boxes
+from pymp4.parser import Box
+from pymp4.writer import box, full_box
+
+log = logging.getLogger(__name__)
+
+WIDEVINE = UUID("edef8ba9-79d6-4ace-a3c8-27dcd51d21ed")
+PLAYREADY = UUID("9a04f079-9840-4286-ab92-e65be0885f95")
+KID = UUID("00112233-4455-6677-8899-aabbccddeeff")
+KID2 = UUID("ffeeddcc-bbaa-9988-7766-554433221100")
+
+
+def pssh(system_ID, key_IDs=None, data=b"data"):
+    return Box.build(Container(type=b"pssh")(system_ID=system_ID)(key_IDs=key_IDs)(init_data=data))
+
+
+def piff_pssh(system_ID, data):
+    return box(b"uuid", UUID("D08A4F18-10F3-4A82-B6C8-32D8ABA183D3").bytes, b"\x00" * 4, system_ID.bytes,
+               struct.pack(">I", len(data)), data)
+
+
+def sinf(original_format, scheme_type, tenc):
+    return box(b"sinf", box(b"frma", original_format), full_box(b"schm", 0, 0, scheme_type, struct.pack(">I", 0x10000)),
+               box(b"schi", tenc))
+
+
+def trak(track_ID, handler_type, entry, *groups):
+    return box(b"trak",
+               full_box(b"tkhd", 0, 1, struct.pack(">III", 0, 0, track_ID), bytes(68)),
+               box(b"mdia", full_box(b"hdlr", 0, 0, bytes(4), handler_type, bytes(13)),
+                   box(b"minf", box(b"stbl", full_box(b"stsd", 0, 0, struct.pack(">I", 1), entry), *groups))))
+
+
+def seig(key_ID, iv_size=8, **fields):
+    return dict(data=dict(is_encrypted=1, iv_size=iv_size, key_ID=key_ID, **fields))
+
+
+def sbgp(*runs):
+    return Box.build(dict(type=b"sbgp", grouping_type=b"seig",
+                          entries=[dict(sample_count=count, group_description_index=index) for count, index in runs]))
+
+
+def init_segment():
+    tenc = Box.build(Container(type=b"tenc")(is_encrypted=1)(iv_size=8)(key_ID=KID))
+    cbcs = Box.build(Container(type=b"tenc")(version=1)(default_byte_blocks=Container(crypt=1)(skip=9))
+                     (is_encrypted=1)(iv_size=0)(key_ID=KID2)(constant_iv=list(range(16))))
+    encv = box(b"encv", bytes(78), box(b"avcC", b"\x01\x64\x00\x1f\xff\xe0\x00"), sinf(b"avc1", b"cenc", tenc))
+    enca = box(b"enca", bytes(28), box(b"esds", bytes(4)), sinf(b"mp4a", b"cbcs", cbcs))
+    return (Box.build(Container(type=b"ftyp")(major_brand=b"iso6")(minor_version=0)(compatible_brands=[b"iso6"])) +
+            box(b"moov", full_box(b"mvhd", 0, 0, bytes(96)), pssh(WIDEVINE, [KID, KID2]),
+                piff_pssh(PLAYREADY, b"<WRMHEADER/>"), trak(1, b"vide", encv), trak(2, b"soun", enca)) +
+            box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", 1)), pssh(WIDEVINE, data=b"rotated")))
+
+
+class DRMTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(3):
+            self.paths.append(os.path.join(self.tmpdir, "init{}.mp4".format(i)))
+            with open(self.paths[-1], "wb") as fd:
+                fd.write(init_segment())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_scan(self):
+        protection = scan(io.BytesIO(init_segment()))
+        self.assertListEqual([(p.system_ID, p.key_IDs, p.data) for p in protection.pssh],
+                             [(WIDEVINE, [KID, KID2], b"data"), (PLAYREADY, [], b"<WRMHEADER/>"),
+                              (WIDEVINE, [], b"rotated")])
+        video, audio = protection.tracks
+        self.assertEqual((video.track_ID, video.format, video.original_format, video.scheme_type), (1, "encv", "avc1", "cenc"))
+        self.assertEqual((video.is_protected, video.per_sample_iv_size, video.default_KID), (True, 8, KID))
+        self.assertEqual((audio.track_ID, audio.original_format, audio.scheme_type), (2, "mp4a", "cbcs"))
+        self.assertEqual((audio.per_sample_iv_size, audio.default_KID, audio.constant_iv), (0, KID2, bytes(range(16))))
+
+    def test_record(self):
+        record = json.loads(json.dumps(to_record("init.mp4", scan(io.BytesIO(init_segment())))))
+        self.assertEqual(record["pssh"][0]["key_IDs"], [str(KID), str(KID2)])
+        self.assertEqual(record["pssh"][0]["data"], "ZGF0YQ==")
+        self.assertEqual(record["tracks"][0]["default_KID"], str(KID))
+
+    def test_scan_many(self):
+        paths = self.paths + [os.path.join(self.tmpdir, "missing.mp4")]
+        with ThreadPoolExecutor(2) as executor:
+            records = list(scan_many(iter(paths), chunksize=2, executor=executor))
+        self.assertListEqual([r["path"] for r in records], paths)
+        self.assertListEqual([len(r.get("pssh", [])) for r in records], [3, 3, 3, 0])
+        self.assertIn("error", records[-1])
+
+    def test_cli(self):
+        out = io.StringIO()
+        argv = sys.argv
+        sys.argv = ["mp4drm", "--workers", "2"] + self.paths
+        try:
+            with redirect_stdout(out):
+                drm()
+        finally:
+            sys.argv = argv
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertListEqual([r["path"] for r in records], self.paths)
+        self.assertListEqual([t["scheme_type"] for t in records[0]["tracks"]], ["cenc", "cbcs"])
+
+    def test_sample_keys(self):
+        rotated = [UUID(int=i) for i in range(1, 4)]
+        tenc = Box.build(Container(type=b"tenc")(is_encrypted=1)(iv_size=8)(key_ID=KID))
+        encv = box(b"encv", bytes(78), sinf(b"avc1", b"cenc", tenc))
+        sgpd = Box.build(dict(type=b"sgpd", grouping_type=b"seig", entries=[seig(rotated[0]), seig(rotated[1], 16)]))
+        data = box(b"moov", trak(1, b"vide", encv, sgpd, sbgp((2, 0), (3, 1), (1000000, 2)))) + box(
+            b"moof", box(b"traf", sbgp((4, 0x10001), (2, 1)),
+                         Box.build(dict(type=b"sgpd", version=2, grouping_type=b"seig", default_group_description_index=1,
+                                        entries=[seig(rotated[2], 0, byte_blocks=dict(crypt=1, skip=9),
+                                                      constant_iv=list(range(16)))]))))
+        fd = io.BytesIO(data)
+        moov, moof = iter_boxes(fd)
+        trak_ = next(iter_boxes(fd, moov.data_offset, moov.end, 1))
+        traf = next(iter_boxes(fd, moof.data_offset, moof.end, 1))
+
+        keys = read_sample_keys(fd, trak_)
+        self.assertEqual(len(keys), 1000005)
+        self.assertListEqual([keys[i].KID for i in (0, 1, 2, 4, 5, 1000004)],
+                             [KID, KID, rotated[0], rotated[0], rotated[1], rotated[1]])
+        self.assertEqual((keys[1000005].KID, keys[1000005].per_sample_iv_size), (KID, 8))
+        self.assertEqual(keys[5].per_sample_iv_size, 16)
+        self.assertSetEqual(keys.key_IDs(), {KID, rotated[0], rotated[1]})
+        self.assertListEqual([(first, end, params.KID) for first, end, params in keys.runs()],
+                             [(0, 2, KID), (2, 5, rotated[0]), (5, 1000005, rotated[1])])
+
+        keys = read_sample_keys(fd, trak_, traf)
+        self.assertListEqual([keys[i].KID for i in range(7)], [rotated[2]] * 4 + [rotated[0]] * 2 + [rotated[2]])
+        self.assertEqual((keys[0].constant_iv, keys[0].crypt_byte_block, keys[0].skip_byte_block), (bytes(range(16)), 1, 9))
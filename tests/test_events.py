@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import struct
+import unittest
+
+from pymp4.events import SCTE35_SCHEMES, extract_events, iter_events, ntp_to_unix
+from pymp4.exceptions import MalformedBox
+from pymp4.parser import Box
+
+from tests.media import fragment
+
+log = logging.getLogger(__name__)
+
+SCTE35 = u"urn:scte:scte35:2013:bin"
+
+
+def emsg(id, version=0, data=b"\xfc\x30\x11"):
+    if version == 0:
+        return Box.build(dict(type=b"emsg", scheme_id_uri=SCTE35, value=u"1", timescale=90000,
+                              presentation_time_delta=900 * id, event_duration=2700, id=id, message_data=data))
+    return Box.build(dict(type=b"emsg", version=1, timescale=90000, presentation_time=2 ** 33 + id,
+                          event_duration=0, id=id, scheme_id_uri=u"urn:example:id3", value=u"", message_data=data))
+
+
+def prft(media_time):
+    # 2020-01-01T00:00:00.5Z
+    ntp = ((1577836800 + 2208988800) << 32) | 0x80000000
+    return Box.build(dict(type=b"prft", version=1, reference_track_ID=1, ntp_timestamp=ntp, media_time=media_time))
+
+
+class EventTests(unittest.TestCase):
+    def segment(self, n):
+        return prft(160 * n) + emsg(n) + emsg(n, version=1) + fragment(n + 1, (160 * n,))
+
+    def test_extract(self):
+        timing, scte, id3 = extract_events(self.segment(1))
+        self.assertEqual((timing.reference_track_ID, timing.media_time, timing.offset), (1, 160, 0))
+        self.assertEqual(ntp_to_unix(timing.ntp_timestamp), 1577836800.5)
+        self.assertIn(scte.scheme_id_uri, SCTE35_SCHEMES)
+        self.assertEqual((scte.version, scte.presentation_time, scte.presentation_time_delta, scte.id),
+                         (0, None, 900, 1))
+        self.assertEqual(scte.message_data, b"\xfc\x30\x11")
+        self.assertEqual((id3.version, id3.scheme_id_uri, id3.presentation_time, id3.presentation_time_delta),
+                         (1, u"urn:example:id3", 2 ** 33 + 1, None))
+
+    def test_file_object(self):
+        data = self.segment(2)
+        self.assertListEqual(list(extract_events(io.BytesIO(data))), list(extract_events(data)))
+        self.assertListEqual([e.id for e in extract_events(data, [b"emsg"])], [2, 2])
+
+    def test_stream(self):
+        events = list(iter_events(self.segment(n) for n in range(3)))
+        self.assertListEqual([(index, type(event).__name__) for index, event in events],
+                             [(n, name) for n in range(3) for name in ("ProducerReferenceTime", "Event", "Event")])
+
+    def test_truncated(self):
+        data = self.segment(1)
+        with self.assertRaises(MalformedBox):
+            list(extract_events(data[:-4]))
+        # boxes before the damage are still extracted
+        events = extract_events(data[:len(prft(0)) + len(emsg(1)) + 4])
+        self.assertEqual(len([next(events), next(events)]), 2)
+        self.assertRaises(MalformedBox, next, events)
+
+    def test_largesize(self):
+        box = emsg(5)
+        data = struct.pack(">I4sQ", 1, b"emsg", len(box) + 8) + box[8:]
+        event, = extract_events(data)
+        self.assertEqual((event.id, event.message_data), (5, b"\xfc\x30\x11"))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import unittest
+
+from pymp4 import fidelity
+from pymp4.parser import MP4
+from pymp4.util import BoxUtil
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+
+class FidelityTests(unittest.TestCase):
+    def setUp(self):
+        data = progressive()
+        # clear the reserved bits of the avcC, construct always builds them set
+        avcc = data.index(b"avcC") + 8
+        self.assertEqual(data[avcc], 0xff)
+        self.data = data[:avcc] + b"\x03" + data[avcc + 1:]
+        self.assertNotEqual(MP4.build(MP4.parse(self.data)), self.data)
+
+    def test_unmodified(self):
+        boxes = fidelity.parse(self.data)
+        self.assertFalse(any(fidelity.is_modified(box) for box in boxes))
+        self.assertEqual(fidelity.build(boxes), self.data)
+
+    def test_modified_field(self):
+        boxes = fidelity.parse(self.data)
+        moov = boxes[1]
+        mvhd = BoxUtil.first(moov, b"mvhd")
+        trak = BoxUtil.first(moov, b"trak")
+        mvhd.timescale = 90000
+        self.assertTrue(fidelity.is_modified(mvhd))
+        self.assertTrue(fidelity.is_modified(moov))
+        self.assertFalse(fidelity.is_modified(trak))
+        self.assertFalse(fidelity.is_modified(boxes[0]))
+
+        data = fidelity.build(boxes)
+        self.assertEqual(len(data), len(self.data))
+        self.assertEqual(MP4.parse(data)[1].children[0].timescale, 90000)
+        # the trak with the avcC is copied as it was
+        self.assertIn(bytes(fidelity.original_bytes(trak)), data)
+
+    def test_modified_nested(self):
+        boxes = fidelity.parse(self.data)
+        stsz = list(BoxUtil.find(boxes[1], b"stsz"))[1]
+        stsz.entry_sizes[0] = 13
+        trak = BoxUtil.first(boxes[1], b"trak")
+        self.assertTrue(fidelity.is_modified(stsz))
+        self.assertFalse(fidelity.is_modified(trak))
+        data = fidelity.build(boxes)
+        self.assertEqual(list(BoxUtil.find(MP4.parse(data)[1], b"stsz"))[1].entry_sizes[0], 13)
+        self.assertIn(bytes(fidelity.original_bytes(trak)), data)
+
+    def test_removed_box(self):
+        boxes = fidelity.parse(self.data)
+        moov = boxes[1]
+        audio = moov.children[2]
+        del moov.children[2]
+        self.assertTrue(fidelity.is_modified(moov))
+        data = fidelity.build(boxes)
+        self.assertEqual(len(data), len(self.data) - len(fidelity.original_bytes(audio)))
+        self.assertEqual(len(MP4.parse(data)[1].children), 2)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+
+from pymp4.flatten import flatten
+from pymp4.index import iter_boxes
+from pymp4.remux import remux
+from pymp4.samples import iter_track_runs, read_tracks, read_trex
+from tests.media import audio_sample, progressive, video_sample
+
+log = logging.getLogger(__name__)
+
+
+class FlattenTests(unittest.TestCase):
+    def setUp(self):
+        out = io.BytesIO()
+        self.fragments = remux(io.BytesIO(progressive(video_count=12, audio_count=8, gop=4)), out,
+                               fragment_duration=0.16)
+        self.fragmented = out.getvalue()
+
+    def check(self, data):
+        fd = io.BytesIO(data)
+        self.assertListEqual([header.type for header in iter_boxes(fd)], [b"ftyp", b"moov", b"mdat"])
+        video, audio = read_tracks(fd)
+        self.assertListEqual([data[o:o + s] for o, s in zip(video.offsets, video.sizes)],
+                             [video_sample(i, 4) for i in range(12)])
+        self.assertListEqual([data[o:o + s] for o, s in zip(audio.offsets, audio.sizes)],
+                             [audio_sample(i) for i in range(8)])
+        self.assertListEqual(list(video.durations), [40] * 12)
+        self.assertListEqual(list(audio.durations), [1024] * 8)
+        self.assertListEqual(video.sync_samples(), [0, 4, 8])
+        self.assertIsNone(audio.sync)
+        self.assertEqual(video.duration, 480)
+
+    def test_runs(self):
+        fd = io.BytesIO(self.fragmented)
+        runs = list(iter_track_runs(fd, read_trex(fd)))
+        self.assertListEqual([(run.track_ID, run.decode_time, len(run.sizes)) for run in runs],
+                             [(1, 0, 4), (2, 0, 8), (1, 160, 4), (1, 320, 4)])
+        self.assertListEqual([self.fragmented[run.offset:run.offset + run.sizes[0]] for run in runs],
+                             [video_sample(0, 4), audio_sample(0), video_sample(4, 4), video_sample(8, 4)])
+
+    def test_single_file(self):
+        out = io.BytesIO()
+        self.assertDictEqual(flatten(io.BytesIO(self.fragmented), output=out), {1: 12, 2: 8})
+        self.check(out.getvalue())
+
+    def test_segments(self):
+        init = self.fragmented[:self.fragments[0].offset]
+        segments = [io.BytesIO(self.fragmented[f.offset:f.offset + f.size]) for f in self.fragments]
+        out = io.BytesIO()
+        self.assertDictEqual(flatten(io.BytesIO(init), segments, out), {1: 12, 2: 8})
+        self.check(out.getvalue())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from pymp4.follow import Follower, follow
+
+from tests.media import fragment
+
+log = logging.getLogger(__name__)
+
+
+class FollowTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "live.mp4")
+        self.writer = open(self.path, "wb", buffering=0)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_partial_boxes(self):
+        first, second = fragment(1), fragment(2, (160,))
+        moof_size, = struct.unpack_from(">I", first)
+        with Follower(self.path) as follower:
+            self.assertListEqual(follower.poll(), [])
+            # half a header, then the moof and half of the mdat
+            self.writer.write(first[:4])
+            self.assertListEqual(follower.poll(), [])
+            self.writer.write(first[4:moof_size + 20])
+            self.assertListEqual([h.type for h in follower.poll()], [b"moof"])
+            self.assertEqual(follower.pending(), 20)
+            self.writer.write(first[moof_size + 20:] + second)
+            headers = follower.poll()
+            self.assertListEqual([(h.type, h.offset) for h in headers],
+                                 [(b"mdat", moof_size), (b"moof", len(first)), (b"mdat", len(first) + moof_size)])
+            self.assertEqual(follower.parse(headers[1]).children[0].sequence_number, 2)
+            self.assertListEqual(follower.poll(), [])
+            self.assertEqual(follower.offset, len(first + second))
+
+    def test_large_and_open_ended_boxes(self):
+        with Follower(io.BytesIO(struct.pack(">I4sQ", 1, b"free", 24) + b"\x00" * 8 +
+                                 struct.pack(">I4s", 0, b"mdat") + b"\x00" * 8)) as follower:
+            # the mdat runs to the end of the file, so it is never known to be complete
+            self.assertListEqual([(h.type, h.size, h.header_size) for h in follower.poll()], [(b"free", 24, 16)])
+            self.assertEqual(follower.pending(), 16)
+
+    def test_follow(self):
+        segments = [fragment(n, (160 * (n - 1),)) for n in range(1, 4)]
+        # each segment is written in two pieces, one before each poll
+        pieces = [piece for segment in segments for piece in (segment[:100], segment[100:])]
+        sleeps = []
+
+        def sleep(interval):
+            sleeps.append(interval)
+            if pieces:
+                self.writer.write(pieces.pop(0))
+
+        with Follower(self.path) as follower:
+            headers = list(follower.follow(interval=0.5, timeout=1.0, types=[b"moof"], sleep=sleep))
+            self.assertListEqual([follower.parse(h).children[0].sequence_number for h in headers], [1, 2, 3])
+        # the pieces, then two idle polls until the timeout
+        self.assertEqual(len(sleeps), 8)
+        self.assertEqual(follower.offset, sum(map(len, segments)))
+
+    def test_follow_function(self):
+        self.writer.write(fragment(1))
+        self.assertListEqual([h.type for h in follow(self.path, timeout=0)], [b"moof", b"mdat"])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import unittest
+
+from construct import Container
+
+from pymp4.hds import BootstrapIndex, Fragment
+from pymp4.parser import Box
+
+log = logging.getLogger(__name__)
+
+
+def abst(segment_runs, fragment_runs, current_media_time=0):
+    return Box.build(Container(type=b"abst")(version=0)(flags=0)(info_version=1)(profile=False)(live=True)
+                     (update=False)(time_scale=1000)(current_media_time=current_media_time)
+                     (smpte_time_code_offset=0)(movie_identifier=b"movie")(server_entry_table=[])
+                     (quality_entry_table=[])(drm_data=b"")(metadata=b"")(segment_run_table=[
+                         Container(type=b"asrt")(version=0)(flags=0)(quality_entry_table=[])
+                         (segment_run_enteries=[Container(first_segment=s)(fragments_per_segment=n)
+                                                for s, n in segment_runs])
+                     ])(fragment_run_table=[
+                         Container(type=b"afrt")(version=0)(flags=Container(update=False))(time_scale=1000)
+                         (quality_entry_table=[])
+                         (fragment_run_enteries=[Container(first_fragment=f)(first_fragment_timestamp=t)
+                                                 (fragment_duration=d)(discontinuity=c)
+                                                 for f, t, d, c in fragment_runs])
+                     ]))
+
+
+class BootstrapIndexTests(unittest.TestCase):
+    # fragments 1-10 of 4s, a jump in the fragment numbers to 20, then 6s fragments up to the live edge, with
+    # 5 fragments in segments 1 and 2 and 10 in the segments after that
+    data = abst([(1, 5), (3, 10)],
+                [(1, 0, 4000, None), (11, 0, 0, 1), (20, 40000, 6000, None)],
+                current_media_time=100000)
+
+    def check(self, index):
+        self.assertEqual(len(index), 20)
+        self.assertEqual(index.first, Fragment(1, 1, 0, 4000))
+        self.assertEqual(index.last, Fragment(4, 29, 94000, 6000))
+        self.assertEqual(index.fragment(5), Fragment(1, 5, 16000, 4000))
+        self.assertEqual(index.fragment(6), Fragment(2, 6, 20000, 4000))
+        self.assertEqual(index.fragment(21), Fragment(4, 21, 46000, 6000))
+        self.assertRaises(KeyError, index.fragment, 15)
+        self.assertNotIn(30, index)
+        self.assertEqual(index.at(17999).fragment, 5)
+        self.assertEqual(index.at(40000).fragment, 20)
+        self.assertEqual(index.at(10 ** 9).fragment, 29)
+        self.assertEqual(index.discontinuities, [(11, 1)])
+        self.assertListEqual([f.fragment for f in index.fragments(30000, 52000)], [9, 10, 20, 21])
+        self.assertEqual(BootstrapIndex.url("http://cdn/movie", index.fragment(21)), "http://cdn/movieSeg4-Frag21")
+
+    def test_from_box(self):
+        self.check(BootstrapIndex.from_box(Box.parse(self.data)))
+
+    def test_parse(self):
+        self.check(BootstrapIndex.parse(self.data))
+
+    def test_end_of_presentation(self):
+        index = BootstrapIndex.parse(abst([(1, 100)], [(1, 0, 2000, None), (4, 0, 0, 0), (5, 0, 2000, None)]))
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.ended)
+
+    def test_large(self):
+        runs = [(1 + i * 10, i * 40000, 4000, None) for i in range(20000)]
+        index = BootstrapIndex.parse(abst([(1, 200000)], runs))
+        self.assertEqual(len(index.first_fragments), 20000)
+        self.assertEqual(index.at(123456789), Fragment(1, 30865, 123456000, 4000))
+        self.assertEqual(index.fragment(199991).timestamp, 799960000)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import os
+import subprocess
+import sys
+import unittest
+
+import pymp4
+
+log = logging.getLogger(__name__)
+
+# modules that must stay usable without importing construct
+LIGHTWEIGHT = ["pymp4.index", "pymp4.samples", "pymp4.sidecar", "pymp4.cache", "pymp4.cli", "pymp4.rebase",
+               "pymp4.writer", "pymp4.flatten", "pymp4.recover", "pymp4.source",
+               "pymp4.hds", "pymp4.drm", "pymp4.validate", "pymp4.analytics",
+               "pymp4.timeline", "pymp4.follow", "pymp4.events"]
+
+
+class ImportTests(unittest.TestCase):
+    def test_lightweight_modules(self):
+        env = dict(os.environ)
+        src = os.path.dirname(os.path.dirname(os.path.abspath(pymp4.__file__)))
+        env["PYTHONPATH"] = os.pathsep.join([src, env.get("PYTHONPATH", "")])
+        for module in LIGHTWEIGHT:
+            out = subprocess.check_output(
+                [sys.executable, "-c", "import sys, {}; print('construct' in sys.modules)".format(module)],
+                env=env)
+            self.assertEqual(out.strip(), b"False", "{} imports construct".format(module))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+
+from pymp4.exceptions import MalformedBox
+from pymp4.index import BoxHeader, index_boxes, iter_boxes
+
+log = logging.getLogger(__name__)
+
+
+class IndexTests(unittest.TestCase):
+    data = (b'\x00\x00\x00\x18ftypiso5\x00\x00\x00\x01iso5avc1'
+            b'\x00\x00\x00\x30moov'
+            b'\x00\x00\x00\x28mvex'
+            b'\x00\x00\x00\x20trex\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01'
+            b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+            b'\x00\x00\x00\x01mdat\x00\x00\x00\x00\x00\x00\x00\x14data'
+            b'\x00\x00\x00\x00free1234')
+
+    def test_top_level(self):
+        self.assertListEqual(
+            [(h.type, h.offset, h.size) for h in iter_boxes(io.BytesIO(self.data))],
+            [(b"ftyp", 0, 24), (b"moov", 24, 48), (b"mdat", 72, 20), (b"free", 92, 12)]
+        )
+
+    def test_recursive(self):
+        index = index_boxes(io.BytesIO(self.data))
+        self.assertEqual(index[1], BoxHeader(b"moov", 24, 48, 8, 0))
+        self.assertEqual(index[2], BoxHeader(b"mvex", 32, 40, 8, 1))
+        self.assertEqual(index[3], BoxHeader(b"trex", 40, 32, 8, 2))
+        self.assertEqual(index[4].header_size, 16)
+        self.assertEqual(index[4].data_size, 4)
+
+    def test_overrun(self):
+        self.assertRaises(
+            MalformedBox,
+            index_boxes, io.BytesIO(b'\x00\x00\x00\x10moov\x00\x00\x00\x20mvex'),
+        )
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import unittest
+
+from construct import Container
+from pymp4.instrument import profile_boxes
+from pymp4.parser import MP4, Box
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+
+class InstrumentTests(unittest.TestCase):
+    def test_parse_stats(self):
+        data = progressive()
+        with profile_boxes() as profiler:
+            MP4.parse(data)
+        stsz = profiler.stats[("parse", b"stsz")]
+        self.assertEqual(stsz.count, 2)
+        self.assertEqual(stsz.bytes, 20 + 4 * 12 + 20 + 4 * 8)
+        moov = profiler.stats[("parse", b"moov")]
+        self.assertGreater(moov.time, moov.self_time)
+        self.assertEqual(profiler.stats[("parse", b"mdat")].bytes, len(data) - moov.bytes - 24)
+        self.assertIn("stsz", profiler.report())
+
+    def test_build_stats(self):
+        with profile_boxes(tracemalloc=True) as profiler:
+            Box.build(Container(type=b"moov")(children=[Container(type=b"mehd")(version=0)(fragment_duration=0)]))
+        self.assertEqual(profiler.stats[("build", b"mehd")].bytes, 16)
+        self.assertEqual(profiler.stats[("build", b"moov")].bytes, 24)
+
+    def test_inactive(self):
+        with profile_boxes() as profiler:
+            pass
+        Box.parse(b'\x00\x00\x00\x08free')
+        self.assertDictEqual(profiler.stats, {})
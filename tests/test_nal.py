@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+
+from pymp4 import nal
+from pymp4.exceptions import MalformedBox
+from pymp4.index import iter_boxes
+from pymp4.samples import read_tracks
+from tests.media import PPS, SPS, progressive
+
+log = logging.getLogger(__name__)
+
+
+class NALTests(unittest.TestCase):
+    def setUp(self):
+        self.data = progressive(video_count=12, gop=4)
+        self.video = read_tracks(io.BytesIO(self.data))[0]
+
+    def test_iter_nal_units(self):
+        data = b'\x00\x00\x00\x02\x09\xf0\x00\x00\x00\x03\x65\x88\x80'
+        units = list(nal.iter_nal_units(data))
+        self.assertListEqual([(offset, type_, bytes(unit)) for offset, type_, unit in units],
+                             [(4, nal.AVC_AUD, b'\x09\xf0'), (10, nal.AVC_IDR, b'\x65\x88\x80')])
+        self.assertIsInstance(units[0][2], memoryview)
+
+    def test_hevc_types(self):
+        data = b'\x00\x02\x40\x01\x00\x03\x26\x01\xaf'
+        self.assertListEqual([t for _, t in nal.iter_nal_types(data, 2, nal.HEVC)], [nal.HEVC_VPS, 19])
+        self.assertTrue(nal.is_random_access_sample(data, 0, len(data), 2, nal.HEVC))
+
+    def test_truncated(self):
+        self.assertRaises(MalformedBox, list, nal.iter_nal_units(b'\x00\x00\x00\x05\x65\x88'))
+
+    def test_sample_nal_units(self):
+        units = list(nal.iter_sample_nal_units(self.data, self.video, 4, nal.AVC))
+        self.assertEqual(len(units), 12 + 3)
+        self.assertListEqual([u.type for u in units[:3]], [nal.AVC_SEI, nal.AVC_IDR, 1])
+        self.assertEqual(units[1].sample, 0)
+        self.assertEqual(bytes(units[2].data[1:]), b'\x01' * 19)
+
+    def test_random_access_samples(self):
+        self.assertListEqual(nal.random_access_samples(self.data, self.video), [0, 4, 8])
+        self.assertListEqual(nal.random_access_samples(self.data, self.video, trust_sync=False), [0, 4, 8])
+
+    def test_nal_config(self):
+        fd = io.BytesIO(self.data)
+        moov = [h for h in iter_boxes(fd) if h.type == b"moov"][0]
+        trak = [h for h in iter_boxes(fd, moov.data_offset, moov.end, 1) if h.type == b"trak"][0]
+        config = nal.nal_config(fd, trak)
+        self.assertEqual(config, nal.NALConfig(nal.AVC, 4, [SPS, PPS]))
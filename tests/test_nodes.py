@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import unittest
+
+from construct import Container
+
+from pymp4 import nodes
+from pymp4.parser import MP4, Box
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+
+class NodeTests(unittest.TestCase):
+    def test_generated_classes(self):
+        self.assertIs(nodes.BOX_CLASSES[b"tkhd"], nodes.TrackHeaderBox)
+        self.assertIs(nodes.BOX_CLASSES[b"trun"], nodes.TrackRunBox)
+        self.assertIs(nodes.BOX_CLASSES[b"moov"], nodes.MovieBox)
+        self.assertIn("duration", nodes.MediaHeaderBox.fields)
+        self.assertIn("creation_time", nodes.TrackHeaderBox.fields)
+
+    def test_round_trip(self):
+        data = progressive()
+        boxes = MP4.parse(data)
+        converted = nodes.from_container(boxes)
+        moov = converted[1]
+        self.assertIsInstance(moov, nodes.MovieBox)
+        self.assertFalse(hasattr(moov, "__dict__"))
+        tkhd = moov.children[1].children[0]
+        self.assertIsInstance(tkhd, nodes.TrackHeaderBox)
+        self.assertEqual(tkhd.track_ID, 1)
+        self.assertTrue(tkhd == boxes[1].children[1].children[0])
+        self.assertEqual(nodes.to_container(converted), boxes)
+        self.assertEqual(b"".join(nodes.build(box) for box in converted), data)
+
+    def test_nested_records(self):
+        tfhd = nodes.parse(Box.build(dict(
+            type=b"tfhd", version=0, track_ID=1,
+            flags=dict(default_base_is_moof=True, duration_is_empty=False,
+                       default_sample_flags_present=False, default_sample_size_present=False,
+                       default_sample_duration_present=False, sample_description_index_present=False,
+                       base_data_offset_present=False))))
+        self.assertIsInstance(tfhd, nodes.TrackFragmentHeaderBox)
+        self.assertIsInstance(tfhd.flags, nodes.RecordNode)
+        self.assertTrue(tfhd.flags.default_base_is_moof)
+        self.assertIs(type(tfhd.flags), nodes.record_class(tfhd.flags.fields))
+
+    def test_unknown_box(self):
+        node = nodes.parse(b'\x00\x00\x00\x0cabcdtest')
+        self.assertIsInstance(node, nodes.RawBox)
+        self.assertEqual(node.data, b"test")
+        self.assertEqual(nodes.build(node), b'\x00\x00\x00\x0cabcdtest')
+
+    def test_extended_class_cached(self):
+        # a box with fields that the class of its type does not know gets a class of its own, made once
+        boxes = [nodes.from_container(Container(offset=0)(type=b"mfhd")(version=0)(flags=0)(sequence_number=n)
+                                      (extra=n)(end=20)) for n in range(3)]
+        self.assertEqual(len(set(type(box) for box in boxes)), 1)
+        self.assertIsNot(type(boxes[0]), nodes.MovieFragmentHeaderBox)
+        self.assertListEqual([box.extra for box in boxes], [0, 1, 2])
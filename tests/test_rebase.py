@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import unittest
+
+from construct import Container
+
+from pymp4.parser import MP4, Box
+from pymp4.rebase import rebase, rebase_fragments
+from pymp4.util import BoxUtil
+from tests.media import fragment
+
+log = logging.getLogger(__name__)
+
+
+def find(boxes, type_):
+    return [box for top in boxes for box in BoxUtil.find(top, type_)]
+
+
+class RebaseTests(unittest.TestCase):
+    def assertSamples(self, data, original):
+        # the samples referenced by the trun data offsets are unchanged
+        boxes, original_boxes = MP4.parse(bytes(data)), MP4.parse(original)
+        for moof, original_moof in zip(find(boxes, b"moof"), find(original_boxes, b"moof")):
+            for trun, original_trun in zip(find([moof], b"trun"), find([original_moof], b"trun")):
+                start = moof.offset + trun.data_offset
+                original_start = original_moof.offset + original_trun.data_offset
+                size = sum(s.sample_size for s in trun.sample_info)
+                self.assertEqual(bytes(data[start:start + size]), original[original_start:original_start + size])
+
+    def test_in_place(self):
+        original = fragment(sequence_number=3, base_times=(400, 1000))
+        data = bytearray(original)
+        result = rebase(data, time_offset=1000, sequence_offset=10)
+        self.assertIs(result, data)
+        boxes = MP4.parse(bytes(data))
+        self.assertEqual(find(boxes, b"mfhd")[0].sequence_number, 13)
+        self.assertListEqual([tfdt.baseMediaDecodeTime for tfdt in find(boxes, b"tfdt")], [1400, 2000])
+        self.assertListEqual([tfdt.version for tfdt in find(boxes, b"tfdt")], [0, 0])
+
+    def test_per_track(self):
+        data = rebase(fragment(base_times=(400, 1000)), time_offset={2: 24000})
+        self.assertListEqual([tfdt.baseMediaDecodeTime for tfdt in find(MP4.parse(bytes(data)), b"tfdt")],
+                             [400, 25000])
+
+    def test_tfdt_upgrade(self):
+        original = fragment(base_times=(400, 1000), sidx=True)
+        data = rebase(original, time_offset=2 ** 32, sidx=True)
+        self.assertEqual(len(data), len(original) + 4 * 2 + 8)
+        boxes = MP4.parse(bytes(data))
+        tfdts = find(boxes, b"tfdt")
+        self.assertListEqual([tfdt.version for tfdt in tfdts], [1, 1])
+        self.assertListEqual([tfdt.baseMediaDecodeTime for tfdt in tfdts], [2 ** 32 + 400, 2 ** 32 + 1000])
+        sidx, moof, mdat = boxes
+        self.assertEqual((sidx.version, sidx.earliest_presentation_time), (1, 2 ** 32 + 400))
+        self.assertEqual(sidx.references[0].referenced_size, len(data) - sidx.end)
+        self.assertEqual(mdat.end, len(data))
+        self.assertSamples(data, original)
+
+    def test_sidx_buffer(self):
+        # the sidx in a buffer of its own is rebased once the fragments it references have been
+        fragments = [fragment(sequence_number=n, base_times=(n * 400, 1000)) for n in (1, 2)]
+        index = Box.build(Container(type=b"sidx")(version=0)(reference_ID=1)(timescale=1000)
+                          (earliest_presentation_time=400)(first_offset=0)(reference_count=len(fragments))
+                          (references=[Container(reference_type="MEDIA")(referenced_size=len(f))
+                                       (segment_duration=160)(starts_with_SAP=True)(SAP_type=1)(SAP_delta_time=0)
+                                       for f in fragments]))
+        parts = [index] + fragments
+        rebased = list(rebase_fragments(parts, time_offset=2 ** 32, sidx=True))
+        self.assertEqual(len(rebased), 3)
+        sidx, = MP4.parse(bytes(rebased[0]))
+        self.assertListEqual([r.referenced_size for r in sidx.references], [len(data) for data in rebased[1:]])
+        self.assertListEqual([len(data) for data in rebased[1:]], [len(f) + 4 * 2 for f in fragments])
+        for data, original in zip(rebased[1:], fragments):
+            self.assertSamples(data, original)
+
+        self.assertRaises(ValueError, list, rebase_fragments(parts[:2], time_offset=2 ** 32, sidx=True))
+        self.assertRaises(ValueError, rebase, index, time_offset=2 ** 32, sidx=True)
+
+    def test_negative(self):
+        self.assertRaises(ValueError, rebase, fragment(base_times=(400,)), time_offset=-800)
+
+    def test_fragments(self):
+        fragments = [fragment(sequence_number=n, base_times=(n * 160,)) for n in range(1, 4)]
+        rebased = list(rebase_fragments(fragments, time_offset=2 ** 32 - 200, sequence_offset=100))
+        self.assertListEqual([find(MP4.parse(bytes(data)), b"tfdt")[0].version for data in rebased], [0, 1, 1])
+        self.assertListEqual([find(MP4.parse(bytes(data)), b"mfhd")[0].sequence_number for data in rebased],
+                             [101, 102, 103])
+        for data, original in zip(rebased, fragments):
+            self.assertSamples(data, original)
+
+    def test_base_data_offset(self):
+        fragments, position = [], 0
+        for n in range(1, 4):
+            fragments.append(fragment(sequence_number=n, base_times=(n * 160, n * 1024), moof_offset=position))
+            position += len(fragments[-1])
+        rebased = list(rebase_fragments(fragments, time_offset=2 ** 32))
+        original, data = b"".join(fragments), b"".join(bytes(data) for data in rebased)
+        self.assertEqual(len(data), len(original) + 3 * 2 * 4)
+
+        def samples(data):
+            found = []
+            for traf in find(MP4.parse(data), b"traf"):
+                tfhd, trun = find([traf], b"tfhd")[0], find([traf], b"trun")[0]
+                self.assertTrue(tfhd.flags.base_data_offset_present)
+                start = tfhd.base_data_offset + trun.data_offset
+                found.append(data[start:start + sum(s.sample_size for s in trun.sample_info)])
+            return found
+
+        self.assertListEqual(samples(data), samples(original))
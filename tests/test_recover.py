@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import struct
+import unittest
+
+from pymp4.index import iter_boxes
+from pymp4.recover import Damage, parse, recover, recover_boxes
+from tests.media import fragment, progressive
+
+log = logging.getLogger(__name__)
+
+
+class RecoverTests(unittest.TestCase):
+    def setUp(self):
+        self.fragments = [fragment(sequence_number=n, base_times=(n * 160,)) for n in range(1, 4)]
+        self.data = b"".join(self.fragments)
+
+    def top_level(self, data):
+        damaged = []
+        return [(h.type, h.offset, h.size) for h in recover_boxes(io.BytesIO(data), damaged=damaged)], damaged
+
+    def test_intact(self):
+        boxes, damaged = self.top_level(self.data)
+        self.assertListEqual(boxes, [(h.type, h.offset, h.size) for h in iter_boxes(io.BytesIO(self.data))])
+        self.assertListEqual(damaged, [])
+
+    def test_truncated(self):
+        data = progressive()
+        mdat = list(iter_boxes(io.BytesIO(data)))[-1]
+        boxes, damaged = self.top_level(data[:mdat.offset + 20])
+        self.assertListEqual([b[0] for b in boxes], [b"ftyp", b"moov", b"mdat"])
+        self.assertEqual(boxes[-1][2], 20)
+        self.assertEqual(len(damaged), 1)
+        self.assertEqual(damaged[0].offset, mdat.offset)
+        self.assertIn("truncated", damaged[0].reason)
+
+    def test_truncated_mdat(self):
+        # a header of an anchor box in the media data is not taken for the next box
+        data = progressive()
+        mdat = list(iter_boxes(io.BytesIO(data)))[-1]
+        data = data[:mdat.data_offset] + b"\x12\x34\x56\x78moof" + b"\x00" * 32
+        boxes, damaged = self.top_level(data)
+        self.assertListEqual([b[0] for b in boxes], [b"ftyp", b"moov", b"mdat"])
+        self.assertEqual(boxes[-1][1:], (mdat.offset, len(data) - mdat.offset))
+        self.assertEqual(len(damaged), 1)
+        self.assertIn("truncated", damaged[0].reason)
+
+        # nor is one that would run past the end of the file
+        data = struct.pack(">I4s", 1000, b"moov") + b"\x12\x34\x56\x78moof" + b"\x00" * 32
+        boxes, damaged = self.top_level(data)
+        self.assertListEqual(boxes, [(b"moov", 0, len(data))])
+        self.assertIn("truncated", damaged[0].reason)
+
+    def test_bad_size(self):
+        data = bytearray(self.data)
+        second = len(self.fragments[0])
+        struct.pack_into(">I", data, second, 0x7ffffff0)
+        boxes, damaged = self.top_level(bytes(data))
+        # the moof is lost, the search picks up again at its mdat
+        self.assertListEqual([b[0] for b in boxes], [b"moof", b"mdat", b"mdat", b"moof", b"mdat"])
+        self.assertEqual(len(damaged), 1)
+        self.assertEqual(damaged[0].offset, second)
+        self.assertEqual(second + damaged[0].size, boxes[2][1])
+
+    def test_garbage(self):
+        first = len(self.fragments[0])
+        data = self.data[:first] + b"\x00\xff" * 50 + self.data[first:]
+        boxes, damaged = self.top_level(data)
+        self.assertListEqual([b[0] for b in boxes], [b"moof", b"mdat"] * 3)
+        self.assertListEqual(damaged, [Damage(first, 100, 0, "invalid box type b'\\x00\\xff\\x00\\xff'")])
+
+    def test_nested(self):
+        data = bytearray(self.data)
+        tfhd = next(h for h in recover(io.BytesIO(self.data))[0] if h.type == b"tfhd")
+        struct.pack_into(">I", data, tfhd.offset, 3)
+        headers, damaged = recover(io.BytesIO(bytes(data)))
+        self.assertListEqual([h.type for h in headers if h.depth == 2], [b"tfdt", b"trun", b"tfhd", b"tfdt",
+                                                                         b"trun", b"tfhd", b"tfdt", b"trun"])
+        self.assertListEqual([(d.offset, d.depth) for d in damaged], [(tfhd.offset, 2)])
+
+    def test_parse(self):
+        data = self.data[:len(self.fragments[0]) + 30]
+        boxes, damaged = parse(io.BytesIO(data))
+        # what is left of the truncated moof is parsed too
+        self.assertListEqual([box.type for _, box in boxes], [b"moof", b"mdat", b"moof"])
+        self.assertListEqual([box.children[0].sequence_number for _, box in boxes[::2]], [1, 2])
+        self.assertEqual(boxes[2][0].size, 30)
+        self.assertEqual(len(damaged), 1)
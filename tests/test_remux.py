@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+
+from pymp4.parser import MP4
+from pymp4.remux import remux
+from pymp4.util import BoxUtil
+from tests.media import SPS, audio_sample, progressive, video_sample
+
+log = logging.getLogger(__name__)
+
+
+class RemuxTests(unittest.TestCase):
+    def setUp(self):
+        out = io.BytesIO()
+        self.fragments = remux(io.BytesIO(progressive(video_count=12, audio_count=8, gop=4)), out,
+                               fragment_duration=0.16)
+        self.data = out.getvalue()
+        self.boxes = MP4.parse(self.data)
+
+    def samples(self, track_ID):
+        samples = []
+        for moof in (box for box in self.boxes if box.type == b"moof"):
+            for traf in BoxUtil.find(moof, b"traf"):
+                if BoxUtil.first(traf, b"tfhd").track_ID != track_ID:
+                    continue
+                trun = BoxUtil.first(traf, b"trun")
+                offset = moof.offset + trun.data_offset
+                for info in trun.sample_info:
+                    samples.append(self.data[offset:offset + info.sample_size])
+                    offset += info.sample_size
+        return samples
+
+    def test_init_segment(self):
+        ftyp, moov = self.boxes[:2]
+        self.assertEqual(ftyp.major_brand, b"iso6")
+        self.assertListEqual([trex.track_ID for trex in BoxUtil.find(moov, b"trex")], [1, 2])
+        self.assertEqual(BoxUtil.first(moov, b"mehd").fragment_duration, 480)
+        self.assertListEqual([stsz.sample_count for stsz in BoxUtil.find(moov, b"stsz")], [0, 0])
+        self.assertEqual(BoxUtil.first(moov, b"stsd").entries[0].avc_data.sps, [SPS])
+
+    def test_fragments(self):
+        self.assertListEqual([box.type for box in self.boxes[2:]], [b"moof", b"mdat"] * 3)
+        self.assertListEqual([(f.sequence_number, f.time) for f in self.fragments], [(1, 0), (2, 160), (3, 320)])
+        self.assertListEqual([f.offset for f in self.fragments],
+                             [box.offset for box in self.boxes if box.type == b"moof"])
+        moofs = [box for box in self.boxes if box.type == b"moof"]
+        self.assertListEqual([BoxUtil.first(moof, b"mfhd").sequence_number for moof in moofs], [1, 2, 3])
+        self.assertListEqual([len(list(BoxUtil.find(moof, b"traf"))) for moof in moofs], [2, 1, 1])
+        self.assertListEqual([tfdt.baseMediaDecodeTime for tfdt in BoxUtil.find(moofs[1], b"tfdt")], [160])
+        trun = BoxUtil.first(moofs[1], b"trun")
+        self.assertListEqual([info.sample_flags.sample_is_non_sync_sample for info in trun.sample_info],
+                             [False, True, True, True])
+
+    def test_samples(self):
+        self.assertListEqual(self.samples(1), [video_sample(i, 4) for i in range(12)])
+        self.assertListEqual(self.samples(2), [audio_sample(i) for i in range(8)])
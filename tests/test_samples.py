@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+
+from pymp4.samples import decode_ctts, decode_stz2, read_tracks
+from tests.media import audio_sample, progressive, video_sample
+
+log = logging.getLogger(__name__)
+
+
+class SampleTableTests(unittest.TestCase):
+    def setUp(self):
+        self.data = progressive(video_count=12, audio_count=8, gop=4, chunk_size=4)
+        self.video, self.audio = read_tracks(io.BytesIO(self.data))
+
+    def test_tracks(self):
+        self.assertEqual((self.video.track_ID, self.video.handler_type, self.video.timescale), (1, b"vide", 1000))
+        self.assertEqual((self.audio.track_ID, self.audio.handler_type, len(self.audio)), (2, b"soun", 8))
+
+    def test_offsets(self):
+        for i in range(12):
+            offset, size = self.video.offsets[i], self.video.sizes[i]
+            self.assertEqual(self.data[offset:offset + size], video_sample(i, 4))
+        for i in range(8):
+            offset, size = self.audio.offsets[i], self.audio.sizes[i]
+            self.assertEqual(self.data[offset:offset + size], audio_sample(i))
+
+    def test_timing(self):
+        self.assertListEqual(list(self.video.dts[:4]), [0, 40, 80, 120])
+        self.assertEqual(self.video.duration, 480)
+        self.assertEqual(self.video.sample_at(85), 2)
+        self.assertEqual(self.video.sync_sample_at(300), 4)
+        self.assertListEqual(list(self.video.sync_samples()), [0, 4, 8])
+        self.assertIsNone(self.audio.sync)
+
+    def test_byte_ranges(self):
+        ranges = self.video.byte_ranges(0, 8)
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(sum(size for _, size in ranges), sum(self.video.sizes[:8]))
+
+    def test_ctts(self):
+        payload = b'\x01\x00\x00\x00\x00\x00\x00\x02\x00\x00\x00\x02\x00\x00\x00\x50\x00\x00\x00\x01\xff\xff\xff\xd8'
+        self.assertListEqual(list(decode_ctts(payload)), [80, 80, -40])
+
+    def test_stz2(self):
+        payload = b'\x00\x00\x00\x00\x00\x00\x00\x04\x00\x00\x00\x03\x12\x30'
+        self.assertListEqual(list(decode_stz2(payload)), [1, 2, 3])
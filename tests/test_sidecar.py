@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from construct import Container
+from pymp4.index import index_boxes
+from pymp4.parser import Box
+from pymp4.samples import read_tracks
+from pymp4.sidecar import build_sidecar, load_sidecar, open_sidecar
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+
+class SidecarTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "test.mp4")
+        self.data = progressive()
+        with open(self.path, "wb") as fd:
+            fd.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        with open_sidecar(build_sidecar(self.path)) as sidecar:
+            self.assertListEqual(sidecar.boxes, index_boxes(io.BytesIO(self.data)))
+            for expected, track in zip(read_tracks(io.BytesIO(self.data)), sidecar.tracks):
+                self.assertEqual((track.track_ID, track.timescale, track.handler_type),
+                                 (expected.track_ID, expected.timescale, expected.handler_type))
+                self.assertListEqual(list(track.offsets), list(expected.offsets))
+                self.assertListEqual(list(track.sizes), list(expected.sizes))
+                self.assertListEqual(list(track.dts), list(expected.dts))
+                self.assertEqual(track.sync is None, expected.sync is None)
+            self.assertEqual(sidecar.track(1).sync_sample_at(300), 4)
+
+    def test_aligned(self):
+        # an odd number of box records still leaves the track columns that follow them 8 byte aligned
+        if len(index_boxes(io.BytesIO(self.data))) % 2 == 0:
+            with open(self.path, "ab") as fd:
+                fd.write(Box.build(Container(type=b"free")(data=b"")))
+        with open_sidecar(build_sidecar(self.path)) as sidecar:
+            self.assertEqual(len(sidecar.boxes) % 2, 1)
+            self.assertEqual(sidecar._segments[0] % 8, 0)
+
+    def test_stale(self):
+        load_sidecar(self.path).close()
+        with open(self.path, "ab") as fd:
+            fd.write(Box.build(Container(type=b"free")(data=b"")))
+        with load_sidecar(self.path) as sidecar:
+            self.assertFalse(sidecar.is_stale(self.path))
+            self.assertEqual(sidecar.boxes[-1].type, b"free")
+
+    def test_segments(self):
+        sidx = Box.build(Container(type=b"sidx")(version=0)(reference_ID=1)(timescale=1000)
+                         (earliest_presentation_time=0)(first_offset=0)(reference_count=2)(references=[
+                             Container(reference_type="MEDIA")(referenced_size=100)(segment_duration=2000)
+                             (starts_with_SAP=True)(SAP_type=1)(SAP_delta_time=0),
+                             Container(reference_type="MEDIA")(referenced_size=120)(segment_duration=2000)
+                             (starts_with_SAP=True)(SAP_type=1)(SAP_delta_time=0),
+                         ]))
+        with open(self.path, "wb") as fd:
+            fd.write(sidx)
+        with load_sidecar(self.path) as sidecar:
+            segment = sidecar.segment_at(2500)
+            self.assertEqual((segment.offset, segment.size, segment.time), (len(sidx) + 100, 120, 2000))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import re
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pymp4.index import iter_boxes
+from pymp4.parser import Box
+from pymp4.samples import read_tracks
+from pymp4.source import BlockCache, FileSource, HTTPSource, SourceReader, fetch_boxes, open_url
+from tests.media import progressive, video_sample
+
+log = logging.getLogger(__name__)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.data with support for single range requests, like object storage
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        data = self.server.data
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match is None or self.server.ignore_ranges:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(len(data)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.ranges.append((start, end + 1))
+        self.send_response(206)
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(data)))
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPSourceTests(unittest.TestCase):
+    def setUp(self):
+        self.data = progressive(video_count=3000, audio_count=0, gop=30)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.daemon_threads = True
+        self.server.data = self.data
+        self.server.ranges = []
+        self.server.ignore_ranges = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/movie.mp4".format(self.server.server_port)
+        self.mdat = [h for h in iter_boxes(io.BytesIO(self.data)) if h.type == b"mdat"][0]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetched(self, start, end):
+        return sum(max(0, min(e, end) - max(s, start)) for s, e in self.server.ranges)
+
+    def test_fetch_moov(self):
+        reader = open_url(self.url, block_size=1024)
+        self.addCleanup(reader.close)
+        (header, data), = fetch_boxes(reader, [b"moov"])
+        self.assertEqual(data, self.data[header.offset:header.end])
+        self.assertEqual(Box.parse(data).type, b"moov")
+        # the moov in one request, of the mdat only the blocks with the end of the moov and its header
+        self.assertLessEqual(len(self.server.ranges), 4)
+        self.assertLessEqual(self.fetched(self.mdat.data_offset, self.mdat.end), 2 * 1024)
+
+    def test_read_tracks(self):
+        reader = open_url(self.url, block_size=1024)
+        self.addCleanup(reader.close)
+        track, = read_tracks(reader)
+        self.assertEqual(len(track), 3000)
+        offset, size = track.offsets[1], track.sizes[1]
+        reader.seek(offset)
+        self.assertEqual(reader.read(size), video_sample(1, 30))
+        self.assertLess(self.fetched(self.mdat.data_offset, self.mdat.end), self.mdat.data_size // 4)
+        self.assertListEqual(list(iter_boxes(reader)), list(iter_boxes(io.BytesIO(self.data))))
+
+    def test_no_ranges(self):
+        source = HTTPSource(self.url, timeout=5)
+        self.addCleanup(source.close)
+        self.assertEqual(source.read_at(0, 8), self.data[:8])
+        self.assertEqual(source.size, len(self.data))
+        self.assertEqual(source.read_at(len(self.data) + 10, 8), b"")
+        self.assertEqual(source.requests, 1)
+
+
+    def test_ranges_ignored(self):
+        self.server.ignore_ranges = True
+        source = HTTPSource(self.url, timeout=5)
+        self.addCleanup(source.close)
+        self.assertRaises(IOError, source.read_at, 0, 8)
+        self.assertEqual(source.bytes_fetched, 0)
+        # the connection with the unread body is not used again
+        self.server.ignore_ranges = False
+        self.assertEqual(source.read_at(0, 8), self.data[:8])
+
+
+class BlockCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 64
+        self.reads = []
+        source = FileSource(io.BytesIO(self.data))
+        read_at = source.read_at
+
+        def recording(offset, size):
+            self.reads.append((offset, size))
+            return read_at(offset, size)
+        source.read_at = recording
+        self.cache = BlockCache(source, block_size=256, max_blocks=8, max_read_ahead=4)
+
+    def test_aligned(self):
+        self.assertEqual(self.cache.read_at(300, 8), self.data[300:308])
+        self.assertEqual(self.cache.read_at(1000, 40), self.data[1000:1040])
+        self.assertListEqual(self.reads, [(256, 256), (768, 512)])
+        self.assertEqual(self.cache.read_at(1020, 2), self.data[1020:1022])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_coalesced(self):
+        self.cache.read_at(600, 4)
+        self.reads[:] = []
+        self.cache.prefetch(0, 1024)
+        self.assertListEqual(self.reads, [(0, 512), (768, 256)])
+
+    def test_read_ahead(self):
+        for offset in range(0, 2048, 128):
+            self.assertEqual(self.cache.read_at(offset, 128), self.data[offset:offset + 128])
+        # the read ahead doubles on each sequential miss, up to max_read_ahead blocks
+        self.assertListEqual([size // 256 for _, size in self.reads], [1, 3, 5])
+
+    def test_lru(self):
+        for block in range(10):
+            self.cache.read_at(block * 1024, 1)
+        self.assertEqual(self.cache.evictions, 2)
+        self.assertEqual(self.cache.stats()["blocks"], 8)
+        reader = SourceReader(self.cache)
+        reader.seek(-16, io.SEEK_END)
+        self.assertEqual(reader.read(), self.data[-16:])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import sys
+import threading
+import unittest
+
+from pymp4.batch import build_many, parse_many
+from pymp4.instrument import profile_boxes
+from pymp4.parser import MP4, Box
+from tests.media import fragment, progressive
+
+log = logging.getLogger(__name__)
+
+THREADS = 8
+ROUNDS = 20
+
+
+class ThreadTests(unittest.TestCase):
+    def setUp(self):
+        self.interval = sys.getswitchinterval()
+        # switch threads as often as possible to interleave the parsers
+        sys.setswitchinterval(1e-6)
+        self.buffers = [progressive(), fragment(base_times=(0, 0), sidx=True),
+                        fragment(sequence_number=2, base_times=(2 ** 32,), tfdt_version=1)]
+        self.expected = [MP4.parse(data) for data in self.buffers]
+
+    def tearDown(self):
+        sys.setswitchinterval(self.interval)
+
+    def run_threads(self, target):
+        barrier = threading.Barrier(THREADS)
+        errors = []
+
+        def run(n):
+            try:
+                barrier.wait()
+                target(n)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual(errors, [])
+
+    def test_concurrent_parse_build(self):
+        def target(n):
+            for i in range(ROUNDS):
+                k = (n + i) % len(self.buffers)
+                boxes = MP4.parse(self.buffers[k])
+                self.assertEqual(boxes, self.expected[k])
+                self.assertEqual(MP4.build(boxes), self.buffers[k])
+
+        self.run_threads(target)
+
+    def test_hooks_are_per_thread(self):
+        counts = {}
+
+        def target(n):
+            if n % 2:
+                with profile_boxes() as profiler:
+                    for _ in range(ROUNDS):
+                        Box.parse(self.buffers[1])
+                counts[n] = profiler.stats[("parse", b"sidx")].count
+            else:
+                for _ in range(ROUNDS):
+                    Box.parse(self.buffers[1])
+
+        self.run_threads(target)
+        self.assertListEqual(sorted(counts.values()), [ROUNDS] * (THREADS // 2))
+
+    def test_parse_many(self):
+        buffers = self.buffers * 10
+        self.assertEqual(parse_many(buffers, max_workers=4), self.expected * 10)
+        self.assertEqual(build_many(self.expected, max_workers=4), self.buffers)
+
+    def test_return_exceptions(self):
+        results = parse_many([self.buffers[0], b"\x00\x00\x00\x20ftyp"], con=Box, return_exceptions=True)
+        self.assertEqual(results[0], Box.parse(self.buffers[0]))
+        self.assertIsInstance(results[1], Exception)
+        self.assertRaises(Exception, parse_many, [b"\x00\x00\x00\x20ftyp"], con=Box)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import unittest
+
+from pymp4.remux import remux
+from pymp4.samples import Edit
+from pymp4.timeline import edit_shift, read_timelines
+
+from tests.media import progressive
+
+log = logging.getLogger(__name__)
+
+# I P B B in decode order, presented as I B B P
+CTS_OFFSETS = [40, 120, 0, 0] * 3
+PTS = [40, 160, 80, 120, 200, 320, 240, 280, 360, 480, 400, 440]
+
+
+class TimelineTests(unittest.TestCase):
+    def test_edit_shift(self):
+        self.assertEqual(edit_shift([], 1000, 600), (0, 0, None))
+        self.assertEqual(edit_shift([Edit(480, 40, 1.0)], 1000, 1000), (-40, 0, 480))
+        # the empty edit is in the movie timescale
+        self.assertEqual(edit_shift([Edit(60, -1, 1.0), Edit(0, 1024, 1.0)], 48000, 600), (4800 - 1024, 4800, None))
+
+    def test_composition_offsets(self):
+        video, audio = read_timelines(io.BytesIO(progressive(cts_offsets=CTS_OFFSETS)))
+        self.assertListEqual(list(video.pts), PTS)
+        self.assertListEqual(list(audio.pts), [1024 * i for i in range(8)])
+
+    def test_edit_list(self):
+        data = progressive(cts_offsets=CTS_OFFSETS, edits=[(100, -1), (480, 40)])
+        video, _ = read_timelines(io.BytesIO(data))
+        self.assertListEqual(list(video.pts), [pts + 60 for pts in PTS])
+        self.assertEqual((video.start, video.end), (100, 580))
+        self.assertEqual(min(video.pts), video.start)
+
+    def test_fragmented(self):
+        data = progressive(cts_offsets=CTS_OFFSETS, edits=[(480, 40)])
+        fragmented = io.BytesIO()
+        remux(io.BytesIO(data), fragmented, fragment_duration=0.16)
+        video, _ = read_timelines(fragmented)
+        self.assertListEqual(list(video.pts), [pts - 40 for pts in PTS])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+   Copyright 2016 beardypig
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import io
+import logging
+import struct
+import unittest
+
+from pymp4.remux import remux
+from pymp4.validate import ERROR, Rule, validate
+
+from tests.media import fragment, progressive
+
+log = logging.getLogger(__name__)
+
+
+def patch_u32(data, type_, field_offset, value):
+    # overwrite a 32 bit field of the first box of a type, field_offset counts from the start of the payload
+    data = bytearray(data)
+    pos = data.index(type_) + 4 + field_offset
+    data[pos:pos + 4] = struct.pack(">I", value)
+    return bytes(data)
+
+
+class ValidateTests(unittest.TestCase):
+    def rules(self, data):
+        return [(issue.rule, issue.type) for issue in validate(io.BytesIO(data))]
+
+    def test_valid(self):
+        out = io.BytesIO()
+        remux(io.BytesIO(progressive()), out)
+        self.assertListEqual(self.rules(progressive()), [])
+        self.assertListEqual(self.rules(out.getvalue()), [])
+        self.assertListEqual(self.rules(fragment(1, sidx=True) + fragment(2, (160,), sidx=True)), [])
+
+    def test_sample_count(self):
+        # one more sample in the first stts run
+        data = patch_u32(progressive(), b"stts", 8, 13)
+        self.assertListEqual(self.rules(data), [("sample-count", "stbl")])
+
+    def test_chunk_offset(self):
+        data = patch_u32(progressive(), b"stco", 8, 0xffff0000)
+        issues = list(validate(io.BytesIO(data)))
+        self.assertEqual([(issue.rule, issue.type) for issue in issues], [("chunk-offset", "stco")])
+        self.assertIn("4294901760", issues[0].message)
+
+    def test_trun_data(self):
+        data = fragment(1)
+        moof_size, = struct.unpack_from(">I", data)
+        # the mdat loses its last sample
+        payload = data[moof_size + 8:-20]
+        data = data[:moof_size] + struct.pack(">I", len(payload) + 8) + b"mdat" + payload
+        issue, = validate(io.BytesIO(data))
+        self.assertEqual((issue.rule, issue.severity, issue.offset, issue.type), ("trun-data", ERROR, 0, "moof"))
+        self.assertListEqual(self.rules(fragment(1)[:moof_size]), [("trun-data", "moof")])
+
+    def test_sidx(self):
+        indexed = fragment(1, sample_count=4, sidx=True)
+        sidx_size, = struct.unpack_from(">I", indexed)
+        # the sidx references a fragment of 4 samples but is followed by one of 3
+        self.assertListEqual(self.rules(indexed[:sidx_size] + fragment(1, sample_count=3)), [("sidx-size", "sidx")])
+        self.assertListEqual(self.rules(indexed[:sidx_size] + fragment(1, sample_count=3) + fragment(2)),
+                             [("sidx-size", "sidx")])
+
+    def test_sequence_number(self):
+        issues = list(validate(io.BytesIO(fragment(2) + fragment(2, (160,)) + fragment(3, (320,)))))
+        self.assertEqual([(issue.rule, issue.type) for issue in issues], [("sequence-number", "mfhd")])
+        self.assertIn("2 does not follow 2", issues[0].message)
+
+    def test_custom_rule(self):
+        class TrakCount(Rule):
+            name = "trak-count"
+            types = frozenset([b"trak"])
+
+            def start(self, context):
+                self.count = 0
+
+            def box(self, context, header):
+                self.count += 1
+                return ()
+
+            def finish(self, context):
+                if self.count != 1:
+                    yield self.issue(context.moov.offset, context.moov, "{} tracks".format(self.count))
+
+        class Broken(Rule):
+            name = "broken"
+            types = frozenset([b"mdat"])
+
+            def box(self, context, header):
+                raise ValueError("bad mdat")
+
+        issues = list(validate(io.BytesIO(progressive()), [TrakCount(), Broken()]))
+        self.assertListEqual([(issue.rule, issue.type, issue.message) for issue in issues],
+                             [("broken", "mdat", "could not decode: bad mdat"), ("trak-count", "moov", "2 tracks")])
+
+    def test_damaged(self):
+        data = progressive()
+        self.assertListEqual(self.rules(data[:-10]), [("structure", None)])